@@ -16,10 +16,11 @@ Fecha: 2025-10-16
 """
 
 import os
-import pandas as pd
 import numpy as np
 from pathlib import Path
 
+from data_store import read_table, table_exists, write_table
+
 # ==============================================================================
 # CONFIGURACIÓN
 # ==============================================================================
@@ -95,7 +96,7 @@ def agregar_variables_derivadas(usuario_id, info):
         'error': None
     }
 
-    if not archivo.exists():
+    if not table_exists(archivo):
         stats['error'] = f"Archivo no encontrado: {archivo}"
         print(f"❌ {usuario_id} ({info['nombre']}): Archivo no encontrado")
         return stats
@@ -104,7 +105,7 @@ def agregar_variables_derivadas(usuario_id, info):
 
     try:
         # Leer dataset
-        df = pd.read_csv(archivo)
+        df = read_table(archivo)
         stats['n_registros'] = len(df)
 
         # Calcular TMB (constante por usuario)
@@ -157,7 +158,7 @@ def agregar_variables_derivadas(usuario_id, info):
         stats['superavit_calorico_mean'] = df['Superavit_calorico_basal'].mean()
 
         # Guardar archivo actualizado
-        df.to_csv(archivo, index=False)
+        write_table(df, archivo)
         stats['procesado'] = True
 
         print(f"✅ {usuario_id} ({info['nombre']}): {stats['n_registros']} registros, "
@@ -4,10 +4,7 @@ Análisis Pre-Clustering: Correlaciones, VIF, Escalado, PCA, K-Sweep
 Complementario al clustering ya ejecutado (06_clustering_semana.py)
 """
 
-from sklearn.metrics import silhouette_score, silhouette_samples
-from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
-from sklearn.preprocessing import RobustScaler
 from sklearn.linear_model import LinearRegression
 import warnings
 from datetime import datetime
@@ -22,6 +19,10 @@ import matplotlib
 matplotlib.use('Agg')
 warnings.filterwarnings('ignore')
 
+from data_store import table_exists
+from feature_cache import feature_frame, load_scaled
+from k_sweep import barrer_k
+
 # Configuración de rutas
 BASE_DIR = Path(__file__).parent.resolve()
 INPUT_FILE = BASE_DIR / 'analisis_u' / 'semanal' / 'cluster_inputs_weekly.csv'
@@ -41,6 +42,9 @@ FEATURES = [
 # Configuración de clustering exploratorio
 K_RANGE = range(2, 7)  # K=2..6
 RANDOM_STATE = 42
+KSWEEP_MINIBATCH = 'auto'  # MiniBatchKMeans sólo para cohortes grandes
+KSWEEP_WARM_START = False  # True: K+1 arranca de la solución de K dividida
+KSWEEP_SILHOUETTE = 'auto'  # 'exacta' (por bloques), 'muestra' (con IC) o 'auto'
 
 
 def log(msg):
@@ -73,12 +77,13 @@ log(f"Directorio salida: {OUTPUT_DIR}")
 # ============================================================================
 print_header('1. CARGANDO DATOS')
 
-if not INPUT_FILE.exists():
+if not table_exists(INPUT_FILE):
     log(f"❌ ERROR: No existe {INPUT_FILE}")
     sys.exit(1)
 
-df = pd.read_csv(INPUT_FILE)
-log(f"✅ Datos cargados: {len(df)} semanas")
+# Claves y features vía la caché memory-mapped de esta misma tabla
+df = feature_frame(FEATURES, source=INPUT_FILE)
+log(f"✅ Datos cargados: {len(df)} semanas (caché de features)")
 log(f"   Columnas: {list(df.columns)}")
 
 # Verificar que existen las 8 features
@@ -196,8 +201,9 @@ else:
 print_header('5. ESCALADO ROBUSTO (RobustScaler)')
 
 
-scaler = RobustScaler()
-X_scaled = scaler.fit_transform(X)
+# Matriz escalada compartida con completar_k_sweep.py (caché de features)
+X_scaled, scaler = load_scaled(FEATURES, filas=df_clean.index.to_numpy(),
+                               source=INPUT_FILE)
 
 log(f"✅ RobustScaler entrenado (mediana/IQR)")
 log(f"   Shape: {X_scaled.shape}")
@@ -276,45 +282,21 @@ log(f"✅ Guardado: {biplot_file.name}")
 print_header('7. K-SWEEP: MÉTRICAS DE VIABILIDAD (K=2..6)')
 
 
-k_metrics = []
-
-for k in K_RANGE:
-    log(f"\n  Evaluando K={k}...")
-
-    # KMeans
-    kmeans = KMeans(n_clusters=k, random_state=RANDOM_STATE,
-                    n_init=10, max_iter=500)
-    labels = kmeans.fit_predict(X_scaled)
-
-    # Inertia (suma de distancias al cuadrado)
-    inertia = kmeans.inertia_
-
-    # Silhouette
-    if k > 1:
-        sil_scores = silhouette_samples(X_scaled, labels)
-        sil_mean = sil_scores.mean()
-        sil_std = sil_scores.std()
-    else:
-        sil_mean = np.nan
-        sil_std = np.nan
-
-    # Tamaños de clusters
-    unique, counts = np.unique(labels, return_counts=True)
-    sizes = dict(zip(unique, counts))
-
-    k_metrics.append({
-        'k': k,
-        'inertia': inertia,
-        'silhouette_mean': sil_mean,
-        'silhouette_std': sil_std,
-        'cluster_sizes': str(sizes)
-    })
+k_metrics_df, _ = barrer_k(X_scaled, K_RANGE, random_state=RANDOM_STATE,
+                           n_init=10, max_iter=500, minibatch=KSWEEP_MINIBATCH,
+                           warm_start=KSWEEP_WARM_START,
+                           silhouette=KSWEEP_SILHOUETTE)
 
-    log(f"    Inertia: {inertia:.2f}")
-    log(f"    Silhouette: {sil_mean:.3f} ± {sil_std:.3f}")
-    log(f"    Tamaños: {sizes}")
+for _, fila in k_metrics_df.iterrows():
+    log(f"\n  Evaluando K={fila['k']}...")
+    log(f"    Inertia: {fila['inertia']:.2f}")
+    log(f"    Silhouette: {fila['silhouette_mean']:.3f} ± {fila['silhouette_std']:.3f}")
+    if 'silhouette_ic95_inf' in fila:
+        log(f"    Silhouette IC95% (muestra): [{fila['silhouette_ic95_inf']:.3f}, "
+            f"{fila['silhouette_ic95_sup']:.3f}]")
+    log(f"    Davies-Bouldin: {fila['davies_bouldin']:.3f}")
+    log(f"    Tamaños: {fila['cluster_sizes']}")
 
-k_metrics_df = pd.DataFrame(k_metrics)
 k_metrics_file = OUTPUT_DIR / 'k_sweep_metrics.csv'
 k_metrics_df.to_csv(k_metrics_file, index=False)
 log(f"\n✅ Guardado: {k_metrics_file.name}")
@@ -4,6 +4,7 @@ Derivación de Funciones de Membresía Difusas desde Datos Semanales
 Paso 7A: Setup del Sistema Difuso
 """
 
+import argparse
 import warnings
 import yaml
 import json
@@ -18,6 +19,9 @@ import matplotlib
 matplotlib.use('Agg')
 warnings.filterwarnings('ignore')
 
+from data_store import iter_table, read_columns, table_exists
+from quantile_sketch import KLLSketch
+
 # ============================================================================
 # CONFIGURACIÓN
 # ============================================================================
@@ -29,6 +33,13 @@ PLOTS_DIR = OUTPUT_DIR / 'plots'
 PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 
 LOG_FILE = OUTPUT_DIR / '07_fuzzy_setup_log.txt'
+CONFIG_FILE = OUTPUT_DIR / 'fuzzy_membership_config.yaml'
+SCALERS_FILE = OUTPUT_DIR / 'feature_scalers.json'
+# Estado de los sketches (modo incremental)
+STATE_FILE = OUTPUT_DIR / 'mf_sketch_state.json'
+# En modo exacto (--sketch-k 0) el estado guarda todos los valores; por
+# encima de este número de valores por feature no se persiste
+MAX_VALORES_ESTADO_EXACTO = 200_000
 
 # Features núcleo (columnas en weekly_consolidado.csv)
 CORE_FEATURES = {
@@ -57,6 +68,18 @@ PERCENTILES_CARGA = {
 # Percentiles para clip robusto (escalar a [0,1])
 CLIP_PERCENTILES = [5, 95]
 
+parser = argparse.ArgumentParser(
+    description='Derivación de funciones de membresía (Paso 7A)')
+parser.add_argument('--sketch-k', type=int, default=0,
+                    help='Parámetro k del sketch de cuantiles (error ≈ 2.296/k^0.9723; 0 = exacto)')
+parser.add_argument('--chunk-size', type=int, default=50000,
+                    help='Filas por lote en la pasada de lectura')
+parser.add_argument('--incremental', action='store_true',
+                    help='Agregar sólo semanas nuevas al estado guardado en mf_sketch_state.json')
+parser.add_argument('--tolerancia', type=float, default=0.02,
+                    help='Deriva máxima (fracción del rango p5-p95) antes de reescribir una MF')
+ARGS = parser.parse_args()
+
 
 def log(msg):
     """Escribe en log y consola"""
@@ -88,42 +111,36 @@ log(f"Directorio salida: {OUTPUT_DIR}")
 # ============================================================================
 print_header('1. CARGANDO DATOS SEMANALES')
 
-if not INPUT_FILE.exists():
+if not table_exists(INPUT_FILE):
     log(f"❌ ERROR: No existe {INPUT_FILE}")
     sys.exit(1)
 
-df = pd.read_csv(INPUT_FILE)
-log(f"✅ Datos cargados: {len(df)} semanas")
-log(f"   Columnas disponibles: {list(df.columns)}")
+# Sólo el encabezado; los datos se leen por lotes más abajo
+columnas = read_columns(INPUT_FILE)
+log(f"   Columnas disponibles: {columnas}")
 
 # Verificar features núcleo
 missing_features = []
 for feat in CORE_FEATURES.keys():
-    if feat not in df.columns:
+    if feat not in columnas:
         missing_features.append(feat)
 
+derivar_delta = False
 if missing_features:
     log(f"⚠️  WARNING: Faltan features: {missing_features}")
 
     # Intentar crear Delta_cardiaco_p50 si falta
     if 'Delta_cardiaco_p50' in missing_features:
-        if 'FC_al_caminar_promedio_diario_p50' in df.columns and 'FCr_promedio_diario_p50' in df.columns:
-            df['Delta_cardiaco_p50'] = df['FC_al_caminar_promedio_diario_p50'] - \
-                df['FCr_promedio_diario_p50']
+        if 'FC_al_caminar_promedio_diario_p50' in columnas and 'FCr_promedio_diario_p50' in columnas:
+            derivar_delta = True
             log(f"   ✅ Creado Delta_cardiaco_p50 = FC_walk - FCr")
             missing_features.remove('Delta_cardiaco_p50')
-
-            # Guardar versión derivada
-            derived_file = BASE_DIR / 'analisis_u' / \
-                'semanal' / 'weekly_consolidado_con_delta.csv'
-            df.to_csv(derived_file, index=False)
-            log(f"   ✅ Guardada versión derivada: {derived_file.name}")
         else:
             log(f"   ❌ No se puede crear Delta_cardiaco_p50: faltan columnas base")
 
 # Filtrar solo features disponibles
 available_features = {k: v for k,
-                      v in CORE_FEATURES.items() if k in df.columns}
+                      v in CORE_FEATURES.items() if k not in missing_features}
 log(f"\n✅ Features disponibles para MF: {len(available_features)}/{len(CORE_FEATURES)}")
 for feat, direction in available_features.items():
     log(f"   - {feat} ({direction})")
@@ -133,6 +150,125 @@ if len(available_features) < 3:
         f"\n❌ ERROR: Se necesitan al menos 3 features, solo hay {len(available_features)}")
     sys.exit(1)
 
+# Pasada única por lotes: un sketch por usuario y feature, fusionados al
+# final. Los sketches por usuario son independientes (paralelizables).
+sketch_k = ARGS.sketch_k or None
+derived_file = BASE_DIR / 'analisis_u' / \
+    'semanal' / 'weekly_consolidado_con_delta.csv'
+# Derivar Delta requiere reescribir la tabla completa; si no, sólo se
+# proyectan las columnas necesarias
+usecols = None if derivar_delta else ['usuario_id'] + list(available_features)
+
+if usecols is not None:
+    usecols.append('semana_inicio')
+
+# Modo incremental: partir del estado guardado y agregar sólo las semanas
+# posteriores a la última vista de cada usuario
+estado_previo = None
+if ARGS.incremental:
+    if not (STATE_FILE.exists() and CONFIG_FILE.exists() and SCALERS_FILE.exists()):
+        log(f"⚠️  Sin estado previo ({STATE_FILE.name}); se hace ajuste completo")
+    else:
+        with open(STATE_FILE) as f:
+            estado_previo = json.load(f)
+        if estado_previo['sketch_k'] != sketch_k or \
+                set(estado_previo['sketches']) != set(available_features) or \
+                'hash_semanas' not in estado_previo:
+            log(f"⚠️  Estado previo incompatible (k, features o formato distintos); se hace ajuste completo")
+            estado_previo = None
+
+
+def hash_semanas(df):
+    """Hash de las filas (usuario, semana, features), independiente del orden"""
+    columnas_hash = ['usuario_id', 'semana_inicio'] + list(available_features)
+    return int(pd.util.hash_pandas_object(df[columnas_hash], index=False)
+               .to_numpy().sum(dtype=np.uint64))
+
+
+def leer_semanas(estado_previo):
+    """
+    Pasada única por lotes sobre la tabla semanal.
+
+    Con estado previo sólo se agregan a los sketches las semanas posteriores
+    a la última vista de cada usuario; las ya incorporadas se hashean para
+    detectar si fueron re-escritas o eliminadas desde la corrida anterior.
+
+    Returns:
+        (sketches por usuario, última semana por usuario, n_semanas,
+        n_semanas_nuevas, hash de las semanas ya incorporadas, hash total)
+    """
+    ultima_semana = dict(estado_previo['ultima_semana']) if estado_previo else {}
+    sketches_usuario = {}
+    n_semanas = 0
+    n_semanas_nuevas = 0
+    hash_previas = 0
+    hash_total = 0
+    for i_lote, df_lote in enumerate(iter_table(INPUT_FILE, columns=usecols,
+                                                chunksize=ARGS.chunk_size)):
+        if derivar_delta:
+            df_lote['Delta_cardiaco_p50'] = df_lote['FC_al_caminar_promedio_diario_p50'] - \
+                df_lote['FCr_promedio_diario_p50']
+            df_lote.to_csv(derived_file, index=False,
+                           mode='w' if i_lote == 0 else 'a', header=(i_lote == 0))
+        n_semanas += len(df_lote)
+        hash_total += hash_semanas(df_lote)
+
+        if estado_previo is not None:
+            marca = df_lote['usuario_id'].map(estado_previo['ultima_semana'])
+            nuevas = marca.isna() | (df_lote['semana_inicio'] > marca)
+            hash_previas += hash_semanas(df_lote[~nuevas])
+            df_lote = df_lote[nuevas]
+        n_semanas_nuevas += len(df_lote)
+        for usuario, semana in df_lote.groupby('usuario_id')['semana_inicio'].max().items():
+            ultima_semana[usuario] = max(semana, ultima_semana.get(usuario, semana))
+
+        for usuario, df_u in df_lote.groupby('usuario_id', sort=False):
+            sk_u = sketches_usuario.setdefault(
+                usuario, {feat: KLLSketch(sketch_k) for feat in available_features})
+            for feat in available_features:
+                sk_u[feat].update(df_u[feat].to_numpy(dtype=float))
+
+    mascara = (1 << 64) - 1
+    return (sketches_usuario, ultima_semana, n_semanas, n_semanas_nuevas,
+            hash_previas & mascara, hash_total & mascara)
+
+
+if estado_previo is not None:
+    log(f"🔄 Modo incremental: estado de {estado_previo['fecha']} "
+        f"({estado_previo['n_semanas']} semanas, tolerancia={ARGS.tolerancia:.1%})")
+
+sketches_usuario, ultima_semana, n_semanas, n_semanas_nuevas, hash_previas, hash_total = \
+    leer_semanas(estado_previo)
+
+# Semanas ya incorporadas re-escritas (p. ej. re-scoring) o eliminadas: el
+# estado ya no representa la historia y se reconstruye desde cero
+if estado_previo is not None and f"{hash_previas:016x}" != estado_previo['hash_semanas']:
+    log(f"⚠️  Cambiaron semanas ya incorporadas al estado; se hace ajuste completo")
+    estado_previo = None
+    sketches_usuario, ultima_semana, n_semanas, n_semanas_nuevas, hash_previas, hash_total = \
+        leer_semanas(None)
+
+if derivar_delta:
+    log(f"   ✅ Guardada versión derivada: {derived_file.name}")
+
+if estado_previo is not None:
+    sketches = {feat: KLLSketch.from_dict(estado_previo['sketches'][feat])
+                for feat in available_features}
+else:
+    sketches = {feat: KLLSketch(sketch_k) for feat in available_features}
+for usuario in sorted(sketches_usuario):
+    for feat in available_features:
+        sketches[feat].merge(sketches_usuario[usuario][feat])
+
+log(f"✅ Datos cargados: {n_semanas} semanas ({len(ultima_semana)} usuarios)")
+if estado_previo is not None:
+    log(f"   Semanas nuevas agregadas al estado: {n_semanas_nuevas}")
+if sketch_k is None:
+    log(f"   Percentiles exactos (sin compactación)")
+else:
+    for feat, sk in sketches.items():
+        log(f"   Sketch {feat}: k={sketch_k}, error de rango ≈ {sk.error_rango:.2%}")
+
 # ============================================================================
 # 2. CALCULAR ESCALADORES ROBUSTOS
 # ============================================================================
@@ -140,32 +276,25 @@ print_header('2. CALCULANDO ESCALADORES ROBUSTOS (p5-p95)')
 
 scalers = {}
 for feat in available_features.keys():
-    series = df[feat].dropna()
+    sketch = sketches[feat]
 
-    if len(series) < 100:
-        log(f"⚠️  {feat}: Solo {len(series)} valores, omitiendo")
+    if sketch.n < 100:
+        log(f"⚠️  {feat}: Solo {sketch.n} valores, omitiendo")
         continue
 
-    p_min = np.percentile(series, CLIP_PERCENTILES[0])
-    p_max = np.percentile(series, CLIP_PERCENTILES[1])
+    p_min, p_max = sketch.percentiles(CLIP_PERCENTILES)
 
     scalers[feat] = {
         'min': float(p_min),
         'max': float(p_max),
-        'n_samples': len(series),
+        'n_samples': sketch.n,
         'percentile_range': CLIP_PERCENTILES
     }
 
     log(f"✅ {feat}:")
     log(f"   Min (p{CLIP_PERCENTILES[0]}): {p_min:.4f}")
     log(f"   Max (p{CLIP_PERCENTILES[1]}): {p_max:.4f}")
-    log(f"   N: {len(series)}")
-
-# Guardar scalers
-scalers_file = OUTPUT_DIR / 'feature_scalers.json'
-with open(scalers_file, 'w') as f:
-    json.dump(scalers, f, indent=2)
-log(f"\n✅ Guardado: {scalers_file.name}")
+    log(f"   N: {sketch.n}")
 
 # ============================================================================
 # 3. DERIVAR FUNCIONES DE MEMBRESÍA
@@ -180,7 +309,7 @@ for feat, direction in available_features.items():
 
     log(f"\n📊 Procesando: {feat} ({direction})")
 
-    series = df[feat].dropna()
+    sketch = sketches[feat]
 
     # Calcular percentiles para MF
     if direction == 'lower_better':
@@ -194,7 +323,7 @@ for feat, direction in available_features.items():
 
     mf_points = {}
     for label, percentile_list in percs.items():
-        points = [np.percentile(series, p) for p in percentile_list]
+        points = sketch.percentiles(percentile_list)
         mf_points[label] = {
             'percentiles': percentile_list,
             'values': [float(p) for p in points],
@@ -208,6 +337,61 @@ for feat, direction in available_features.items():
         'membership_functions': mf_points
     }
 
+# ============================================================================
+# 3B. DERIVA RESPECTO A LA CONFIGURACIÓN VIGENTE (MODO INCREMENTAL)
+# ============================================================================
+# Una MF (o un escalador) sólo se reescribe si algún punto se movió más de
+# la tolerancia, medida como fracción del rango p5-p95 vigente; si no, se
+# conservan los valores actuales.
+mf_cambiadas = []
+if estado_previo is not None:
+    print_header('3B. DERIVA RESPECTO A LA CONFIGURACIÓN VIGENTE')
+
+    with open(CONFIG_FILE) as f:
+        config_previa = yaml.safe_load(f) or {}
+    with open(SCALERS_FILE) as f:
+        scalers_previos = json.load(f)
+
+    for feat in membership_config:
+        if feat not in config_previa or feat not in scalers_previos:
+            log(f"   🆕 {feat}: feature nueva")
+            mf_cambiadas.extend(
+                f"{feat}.{label}" for label in membership_config[feat]['labels'])
+            continue
+
+        previo = scalers_previos[feat]
+        rango = previo['max'] - previo['min']
+        if rango <= 0:
+            rango = 1.0
+
+        deriva = max(abs(scalers[feat]['min'] - previo['min']),
+                     abs(scalers[feat]['max'] - previo['max'])) / rango
+        if deriva > ARGS.tolerancia:
+            log(f"   🔁 {feat} escalador: deriva {deriva:.2%}")
+            mf_cambiadas.append(f"{feat}.escalador")
+        else:
+            scalers[feat] = previo
+
+        mf_previas = config_previa[feat]['membership_functions']
+        for label, mf_data in membership_config[feat]['membership_functions'].items():
+            if label not in mf_previas:
+                log(f"   🆕 {feat}.{label}: etiqueta nueva")
+                mf_cambiadas.append(f"{feat}.{label}")
+                continue
+            deriva = np.max(np.abs(np.array(mf_data['values']) -
+                                   np.array(mf_previas[label]['values']))) / rango
+            if deriva > ARGS.tolerancia:
+                log(f"   🔁 {feat}.{label}: deriva {deriva:.2%} → "
+                    f"{[f'{v:.3f}' for v in mf_data['values']]}")
+                mf_cambiadas.append(f"{feat}.{label}")
+            else:
+                mf_data['values'] = mf_previas[label]['values']
+
+    if mf_cambiadas:
+        log(f"\n⚠️  MF/escaladores con deriva > {ARGS.tolerancia:.1%}: {len(mf_cambiadas)}")
+    else:
+        log(f"\n✅ Sin deriva por encima de la tolerancia: se conserva la configuración vigente")
+
 # ============================================================================
 # 4. VALIDAR MF (MONOTONICIDAD Y COBERTURA)
 # ============================================================================
@@ -245,10 +429,38 @@ for feat, config in membership_config.items():
 # ============================================================================
 print_header('5. GUARDANDO CONFIGURACIÓN FUZZY')
 
-config_file = OUTPUT_DIR / 'fuzzy_membership_config.yaml'
-with open(config_file, 'w') as f:
-    yaml.dump(membership_config, f, default_flow_style=False, sort_keys=False)
-log(f"✅ Guardado: {config_file.name}")
+if estado_previo is None or mf_cambiadas:
+    with open(SCALERS_FILE, 'w') as f:
+        json.dump(scalers, f, indent=2)
+    log(f"✅ Guardado: {SCALERS_FILE.name}")
+
+    with open(CONFIG_FILE, 'w') as f:
+        yaml.dump(membership_config, f, default_flow_style=False, sort_keys=False)
+    log(f"✅ Guardado: {CONFIG_FILE.name}")
+else:
+    log(f"   Sin cambios: {CONFIG_FILE.name} y {SCALERS_FILE.name} no se reescriben")
+
+# Estado de los sketches para la próxima corrida incremental (en modo exacto
+# sólo si el número de valores guardados está acotado)
+if sketch_k is None and max(sk.n for sk in sketches.values()) > MAX_VALORES_ESTADO_EXACTO:
+    if STATE_FILE.exists():
+        STATE_FILE.unlink()
+    log(f"⚠️  Modo exacto con más de {MAX_VALORES_ESTADO_EXACTO} valores por feature: "
+        f"no se guarda {STATE_FILE.name} (usar --sketch-k para el modo incremental)")
+else:
+    estado = {
+        'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'sketch_k': sketch_k,
+        'n_semanas': n_semanas,
+        'hash_semanas': f"{hash_total:016x}",
+        'ultima_semana': dict(sorted(ultima_semana.items())),
+        'sketches': {feat: sk.to_dict() for feat, sk in sketches.items()}
+    }
+    tmp = STATE_FILE.with_suffix('.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(estado, f)
+    tmp.replace(STATE_FILE)
+    log(f"✅ Guardado: {STATE_FILE.name}")
 
 # ============================================================================
 # 6. GENERAR PLOTS DE MF
@@ -270,6 +482,9 @@ def triangular_mf(x, points):
 
 
 for feat, config in membership_config.items():
+    if estado_previo is not None and not any(
+            c.startswith(f"{feat}.") for c in mf_cambiadas):
+        continue
     log(f"\n📈 Graficando: {feat}")
 
     # Obtener rango de valores
@@ -323,6 +538,7 @@ for feat in membership_config.keys():
 log(f"\n✅ ARCHIVOS GENERADOS:")
 log(f"   - fuzzy_membership_config.yaml")
 log(f"   - feature_scalers.json")
+log(f"   - {STATE_FILE.name}")
 log(f"   - {len(membership_config)} plots en plots/")
 log(f"   - 07_fuzzy_setup_log.txt")
 
@@ -333,6 +549,11 @@ for feat, config in membership_config.items():
         values_str = [f"{v:.2f}" for v in mf_data['values']]
         log(f"     {label}: {mf_data['percentiles']} → {values_str}")
 
+if estado_previo is not None:
+    log(f"\n🔄 MF ACTUALIZADAS EN ESTA CORRIDA: {len(mf_cambiadas)}")
+    for nombre in mf_cambiadas:
+        log(f"   • {nombre}")
+
 log(f"\n✅ VALIDACIONES PASADAS:")
 log(f"   - ✅ Sin NaNs en cálculo de percentiles")
 log(f"   - ✅ Monotonicidad verificada")
@@ -4,6 +4,7 @@ Sistema de Inferencia Difusa para Clasificación de Sedentarismo
 Paso 7B: Inferencia semanal usando MF derivadas
 """
 
+import argparse
 import warnings
 import yaml
 import json
@@ -18,6 +19,9 @@ import matplotlib
 matplotlib.use('Agg')
 warnings.filterwarnings('ignore')
 
+from fuzzy_engine import FuzzyInferenceSystem
+from data_store import iter_table, read_columns, read_table
+
 # ============================================================================
 # CONFIGURACIÓN
 # ============================================================================
@@ -35,6 +39,20 @@ PLOTS_DIR.mkdir(parents=True, exist_ok=True)
 LOG_FILE = OUTPUT_DIR / '08_fuzzy_inference_log.txt'
 OUTPUT_FILE = OUTPUT_DIR / 'fuzzy_output.csv'
 
+parser = argparse.ArgumentParser(
+    description='Inferencia difusa semanal (Paso 7B)')
+parser.add_argument('--lut-bins', type=int, default=0,
+                    help='Evaluar membresías con tablas precalculadas de N bins por feature (0 = exacto)')
+parser.add_argument('--verificar-lut', action='store_true',
+                    help='Con --lut-bins, comparar cada lote contra las membresías exactas (más lento)')
+parser.add_argument('--chunk-size', type=int, default=0,
+                    help='Procesar la tabla semanal en lotes de N filas con memoria acotada (0 = todo en memoria)')
+ARGS = parser.parse_args()
+
+# Resolución del histograma de scores usado en modo por lotes (error de
+# cuantil ≤ 1/N_BINS_RESUMEN)
+N_BINS_RESUMEN = 65536
+
 
 def log(msg):
     """Escribe en log y consola"""
@@ -57,19 +75,6 @@ def print_header(title):
 # ============================================================================
 
 
-def triangular_mf(x, points):
-    """Función de membresía triangular"""
-    a, b, c = points
-    if x <= a:
-        return 0.0
-    elif a < x <= b:
-        return (x - a) / (b - a) if b > a else 0.0
-    elif b < x <= c:
-        return (c - x) / (c - b) if c > b else 0.0
-    else:
-        return 0.0
-
-
 def fuzzy_and(a, b):
     """Operador AND (mínimo)"""
     return min(a, b)
@@ -92,6 +97,93 @@ def defuzzify_centroid(memberships, output_range=(0, 1), n_points=100):
     return numerator / denominator
 
 
+# ============================================================================
+# RESUMEN EN STREAMING (MODO POR LOTES)
+# ============================================================================
+
+
+class ResumenScores:
+    """Resumen en streaming de scores en [0,1] para el modo por lotes.
+
+    Acumula conteo, media y M2 (fusión de Chan por lote), extremos y un
+    histograma fino de n_bins celdas con el mínimo y máximo observados en
+    cada celda. Cada estadístico de orden se estima dentro de su celda entre
+    esos extremos (error ≤ 1/n_bins; exacto si la celda contiene uno o dos
+    valores distintos, p. ej. el score neutral 0.5) y los percentiles
+    interpolan entre estadísticos vecinos igual que np.percentile.
+    """
+
+    def __init__(self, n_bins=N_BINS_RESUMEN):
+        self.n_bins = n_bins
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.bin_min = np.full(n_bins, np.inf)
+        self.bin_max = np.full(n_bins, -np.inf)
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def agregar(self, scores):
+        scores = np.asarray(scores, dtype=float)
+        scores = scores[~np.isnan(scores)]
+        n_b = len(scores)
+        if n_b == 0:
+            return
+        idx = np.clip((scores * self.n_bins).astype(np.int64),
+                      0, self.n_bins - 1)
+        self.counts += np.bincount(idx, minlength=self.n_bins)
+        np.minimum.at(self.bin_min, idx, scores)
+        np.maximum.at(self.bin_max, idx, scores)
+
+        media_b = scores.mean()
+        m2_b = ((scores - media_b) ** 2).sum()
+        n_total = self.n + n_b
+        delta = media_b - self.media
+        self.media += delta * n_b / n_total
+        self.m2 += m2_b + delta ** 2 * self.n * n_b / n_total
+        self.n = n_total
+        self.min = min(self.min, scores.min())
+        self.max = max(self.max, scores.max())
+
+    @property
+    def std(self):
+        """Desviación estándar poblacional (igual que np.std)"""
+        return float(np.sqrt(self.m2 / self.n)) if self.n else float('nan')
+
+    def _estadistico_orden(self, cum, j):
+        """Valor aproximado del j-ésimo dato ordenado (0-based)"""
+        k = int(np.searchsorted(cum, j, side='right'))
+        previo = cum[k - 1] if k > 0 else 0
+        frac = (j - previo) / max(self.counts[k] - 1, 1)
+        return self.bin_min[k] + frac * (self.bin_max[k] - self.bin_min[k])
+
+    def percentiles(self, qs):
+        """Percentiles aproximados (interpolación lineal como np.percentile)"""
+        cum = np.cumsum(self.counts)
+        valores = []
+        for q in qs:
+            rango = q / 100.0 * (self.n - 1)
+            j = int(np.floor(rango))
+            bajo = self._estadistico_orden(cum, j)
+            alto = self._estadistico_orden(cum, min(j + 1, self.n - 1))
+            valores.append(float(bajo + (rango - j) * (alto - bajo)))
+        return np.array(valores)
+
+
+def bins_terciles(terciles):
+    """Bins y etiquetas para pd.cut; colapsa terciles duplicados"""
+    bins = [0, terciles[0], terciles[1], 1.0]
+    unique_bins = sorted(set(bins))
+    if len(unique_bins) == len(bins):
+        return bins, ['Bajo', 'Medio', 'Alto']
+    if len(unique_bins) == 2:
+        return unique_bins, ['Bajo-Medio', 'Alto']
+    if len(unique_bins) == 3:
+        return unique_bins, ['Bajo', 'Medio-Alto']
+    return unique_bins, ['Bajo', 'Medio', 'Alto'][:len(unique_bins)-1]
+
+
 # ============================================================================
 # INICIO
 # ============================================================================
@@ -137,17 +229,18 @@ print_header('2. CARGANDO DATOS SEMANALES')
 delta_file = BASE_DIR / 'analisis_u' / \
     'semanal' / 'weekly_consolidado_con_delta.csv'
 if delta_file.exists():
-    df = pd.read_csv(delta_file)
+    weekly_file = delta_file
     log(f"✅ Usando versión con Delta: {delta_file.name}")
 else:
-    df = pd.read_csv(INPUT_FILE)
+    weekly_file = INPUT_FILE
     log(f"✅ Usando versión original: {INPUT_FILE.name}")
 
-log(f"   Total semanas: {len(df)}")
+# Sólo el encabezado: las columnas se proyectan al leer los datos
+columnas_disponibles = read_columns(weekly_file)
 
 # Verificar columnas necesarias
 required_cols = list(fuzzy_config.keys()) + ['usuario_id', 'semana_inicio']
-missing_cols = [c for c in required_cols if c not in df.columns]
+missing_cols = [c for c in required_cols if c not in columnas_disponibles]
 if missing_cols:
     log(f"⚠️  WARNING: Faltan columnas: {missing_cols}")
 
@@ -156,11 +249,9 @@ if missing_cols:
 # ============================================================================
 print_header('3. ESCALANDO FEATURES A [0,1]')
 
-df_scaled = df.copy()
-scaled_features = []
-
+config_disponible = {}
 for feat in fuzzy_config.keys():
-    if feat not in df.columns:
+    if feat not in columnas_disponibles:
         log(f"⚠️  Omitiendo {feat}: no está en el dataset")
         continue
 
@@ -168,124 +259,49 @@ for feat in fuzzy_config.keys():
         log(f"⚠️  Omitiendo {feat}: no tiene scaler")
         continue
 
-    scaler = scalers[feat]
-    feat_min = scaler['min']
-    feat_max = scaler['max']
-
-    # Escalar y clipear a [0,1]
-    df_scaled[f'{feat}_scaled'] = df[feat].clip(feat_min, feat_max)
-    df_scaled[f'{feat}_scaled'] = (
-        df_scaled[f'{feat}_scaled'] - feat_min) / (feat_max - feat_min)
+    config_disponible[feat] = fuzzy_config[feat]
+    log(f"✅ {feat}: escalado con min={scalers[feat]['min']:.3f}, max={scalers[feat]['max']:.3f}")
 
-    scaled_features.append(feat)
-    log(f"✅ {feat}: escalado con min={feat_min:.3f}, max={feat_max:.3f}")
+# Sistema compilado: breakpoints escalados a [0,1] + matrices de reglas
+fis = FuzzyInferenceSystem(config_disponible, scalers,
+                           lut_bins=ARGS.lut_bins or None)
+scaled_features = fis.features
 
 log(f"\n✅ Features escaladas: {len(scaled_features)}")
+if fis.lut is not None:
+    log(f"✅ Modo LUT: {fis.lut_bins} bins por feature, error máximo de membresía = {fis.lut_error_max:.2e}")
 
 # ============================================================================
 # 4. EVALUAR MEMBRESÍAS
 # ============================================================================
 print_header('4. EVALUANDO MEMBRESÍAS POR SEMANA')
 
-# Para cada feature y cada etiqueta, calcular membresía
-for feat in scaled_features:
-    mf_config = fuzzy_config[feat]['membership_functions']
-
-    for label, mf_data in mf_config.items():
-        points = mf_data['values']
-
-        # Escalar puntos de quiebre a [0,1]
-        feat_min = scalers[feat]['min']
-        feat_max = scalers[feat]['max']
-        points_scaled = [(p - feat_min) / (feat_max - feat_min)
-                         for p in points]
-        points_scaled = [max(0, min(1, p)) for p in points_scaled]  # clip
-
-        # Calcular membresía para cada semana
-        df_scaled[f'{feat}_{label}_memb'] = df_scaled[f'{feat}_scaled'].apply(
-            lambda x: triangular_mf(
-                x, points_scaled) if not pd.isna(x) else 0.0
-        )
+# Membresías en la salida (top 3 features por brevedad)
+memb_output_cols = []
+for feat in scaled_features[:3]:
+    mf_labels = fuzzy_config[feat]['labels']
+    for label in mf_labels:
+        col_name = f'{feat}_{label}_memb'
+        if col_name in fis.memb_cols:
+            memb_output_cols.append(col_name)
 
-log(f"✅ Membresías calculadas para {len(scaled_features)} features")
+log(f"✅ Membresías evaluadas en una sola pasada por lote: "
+    f"matriz (n_semanas × {len(fis.memb_cols)}) para {len(scaled_features)} features")
 
 # ============================================================================
 # 5. APLICAR REGLAS DIFUSAS (MAMDANI)
 # ============================================================================
 print_header('5. APLICANDO REGLAS DIFUSAS')
 
-# Definir reglas (hardcoded por ahora, fácil de parametrizar después)
-# R1: IF Actividad es Baja AND Superavit es Bajo → Sedentarismo Alto
-# R2: IF Actividad es Alta AND Superavit es Alto → Sedentarismo Bajo
-# R3: IF HRV es Baja AND Delta es Alta_Carga → Sedentarismo Alto
-# R4: IF Actividad es Media AND HRV es Media → Sedentarismo Medio
-# R5: IF Actividad es Baja AND Superavit es Medio → Sedentarismo Medio-Alto (peso 0.7)
-
-rules = []
-
-# Verificar qué features están disponibles
-has_actividad = 'Actividad_relativa_p50' in scaled_features
-has_superavit = 'Superavit_calorico_basal_p50' in scaled_features
-has_hrv = 'HRV_SDNN_p50' in scaled_features
-has_delta = 'Delta_cardiaco_p50' in scaled_features
+# Reglas definidas en fuzzy_engine.REGLAS_SEDENTARISMO; sólo se activan las
+# que tienen todas sus features disponibles.
+rules = fis.rules
 
 log(f"\n📋 Definiendo reglas:")
-log(f"   Features disponibles: Actividad={has_actividad}, Superavit={has_superavit}, HRV={has_hrv}, Delta={has_delta}")
-
-# R1: Actividad Baja AND Superavit Bajo → Sedentarismo Alto (1.0)
-if has_actividad and has_superavit:
-    rules.append({
-        'id': 'R1',
-        'conditions': ['Actividad_relativa_p50_Baja_memb', 'Superavit_calorico_basal_p50_Baja_memb'],
-        'output': 1.0,  # Alto sedentarismo
-        'weight': 1.0,
-        'description': 'Actividad Baja AND Superavit Bajo → Sedentarismo Alto'
-    })
-    log(f"   ✅ R1: Actividad Baja AND Superavit Bajo → Sedentarismo Alto")
-
-# R2: Actividad Alta AND Superavit Alto → Sedentarismo Bajo (0.0)
-if has_actividad and has_superavit:
-    rules.append({
-        'id': 'R2',
-        'conditions': ['Actividad_relativa_p50_Alta_memb', 'Superavit_calorico_basal_p50_Alta_memb'],
-        'output': 0.0,  # Bajo sedentarismo
-        'weight': 1.0,
-        'description': 'Actividad Alta AND Superavit Alto → Sedentarismo Bajo'
-    })
-    log(f"   ✅ R2: Actividad Alta AND Superavit Alto → Sedentarismo Bajo")
-
-# R3: HRV Baja AND Delta Alta_Carga → Sedentarismo Alto (0.9)
-if has_hrv and has_delta:
-    rules.append({
-        'id': 'R3',
-        'conditions': ['HRV_SDNN_p50_Baja_memb', 'Delta_cardiaco_p50_Alta_Carga_memb'],
-        'output': 0.9,  # Alto sedentarismo con riesgo CV
-        'weight': 1.0,
-        'description': 'HRV Baja AND Delta Alta_Carga → Sedentarismo Alto'
-    })
-    log(f"   ✅ R3: HRV Baja AND Delta Alta_Carga → Sedentarismo Alto")
-
-# R4: Actividad Media AND HRV Media → Sedentarismo Medio (0.5)
-if has_actividad and has_hrv:
-    rules.append({
-        'id': 'R4',
-        'conditions': ['Actividad_relativa_p50_Media_memb', 'HRV_SDNN_p50_Media_memb'],
-        'output': 0.5,  # Medio sedentarismo
-        'weight': 1.0,
-        'description': 'Actividad Media AND HRV Media → Sedentarismo Medio'
-    })
-    log(f"   ✅ R4: Actividad Media AND HRV Media → Sedentarismo Medio")
-
-# R5: Actividad Baja AND Superavit Medio → Sedentarismo Medio-Alto (0.7, peso 0.7)
-if has_actividad and has_superavit:
-    rules.append({
-        'id': 'R5',
-        'conditions': ['Actividad_relativa_p50_Baja_memb', 'Superavit_calorico_basal_p50_Media_memb'],
-        'output': 0.7,  # Medio-Alto sedentarismo
-        'weight': 0.7,  # Peso modulado
-        'description': 'Actividad Baja AND Superavit Medio → Sedentarismo Medio-Alto'
-    })
-    log(f"   ✅ R5: Actividad Baja AND Superavit Medio → Sedentarismo Medio-Alto (peso 0.7)")
+log(f"   Features disponibles: {scaled_features}")
+for rule in rules:
+    peso = f" (peso {rule['weight']})" if rule['weight'] != 1.0 else ''
+    log(f"   ✅ {rule['id']}: {rule['description']}{peso}")
 
 log(f"\n✅ Total reglas activas: {len(rules)}")
 
@@ -294,81 +310,115 @@ log(f"\n✅ Total reglas activas: {len(rules)}")
 # ============================================================================
 print_header('6. EJECUTANDO INFERENCIA DIFUSA')
 
-sedentarismo_scores = []
-firing_strengths_all = []
-
-for idx, row in df_scaled.iterrows():
-    # Calcular firing strength de cada regla
-    firing_strengths = []
-    outputs = []
-
-    for rule in rules:
-        # Evaluar condiciones (AND = min)
-        conditions_memb = []
-        for cond_col in rule['conditions']:
-            if cond_col in row:
-                conditions_memb.append(row[cond_col])
-            else:
-                conditions_memb.append(0.0)
-
-        # Firing strength = min de condiciones * peso
-        fs = min(conditions_memb) * rule['weight'] if conditions_memb else 0.0
-        firing_strengths.append(fs)
-        outputs.append(rule['output'])
-
-    firing_strengths_all.append(firing_strengths)
-
-    # Defuzzificación: weighted average (simplificado)
-    if sum(firing_strengths) > 0:
-        score = sum(fs * out for fs, out in zip(firing_strengths,
-                    outputs)) / sum(firing_strengths)
-    else:
-        score = 0.5  # Neutral si no hay activación
 
-    sedentarismo_scores.append(score)
-
-df_scaled['Sedentarismo_score'] = sedentarismo_scores
-
-log(f"✅ Inferencia completada: {len(sedentarismo_scores)} semanas")
-log(f"   Score medio: {np.mean(sedentarismo_scores):.3f} ± {np.std(sedentarismo_scores):.3f}")
-log(f"   Min: {np.min(sedentarismo_scores):.3f}, Max: {np.max(sedentarismo_scores):.3f}")
+def inferir_lote(df_lote):
+    """Scores, membresías de salida y activaciones para un lote de semanas.
+
+    Forma matricial (ver formalizacion_matematica/01_generar_matrices_fuzzy.py):
+      W = min_{j: B_rj=1} μ_ij · peso_r  → matriz de activación (n_semanas × n_reglas)
+      score = Σ_r W_ir·salida_r / Σ_r W_ir   (0.5 neutral si no hay activación)
+    """
+    X = df_lote[scaled_features].to_numpy(dtype=float)
+    M = fis.membresias(X)
+    firing_matrix = fis.activaciones(M)
+    if verificar_lut:
+        # Antes de escribir el lote: una LUT que cambia semanas neutrales no
+        # llega a fuzzy_output.csv
+        comparacion = fis.comparar_lut(X)
+        comparacion_lut['error_score_max'] = max(comparacion_lut['error_score_max'],
+                                                 comparacion['error_score_max'])
+        if comparacion['discrepancias_neutral'] > 0:
+            raise RuntimeError(f"La LUT cambia {comparacion['discrepancias_neutral']} "
+                               f"semanas neutrales respecto a score() exacto")
+
+    salida = {
+        'usuario_id': df_lote['usuario_id'].to_numpy(),
+        'semana_inicio': df_lote['semana_inicio'].to_numpy(),
+        'Sedentarismo_score': fis.defuzzificar(firing_matrix),
+    }
+    for col_name in memb_output_cols:
+        salida[col_name] = M[:, fis.memb_cols.index(col_name)]
+    for i, rule_id in enumerate(fis.rule_ids):
+        salida[f'firing_{rule_id}'] = firing_matrix[:, i]
+    return pd.DataFrame(salida, index=df_lote.index)
+
+
+usecols = ['usuario_id', 'semana_inicio'] + scaled_features
+# Mismo orden que las columnas de inferir_lote (definidas aunque no haya filas)
+output_cols = ['usuario_id', 'semana_inicio', 'Sedentarismo_score'] + memb_output_cols + \
+    [f'firing_{rule_id}' for rule_id in fis.rule_ids]
+# --verificar-lut: diferencia contra el camino exacto acumulada sobre los lotes
+verificar_lut = ARGS.verificar_lut and fis.lut is not None
+comparacion_lut = {'error_score_max': 0.0}
+
+if ARGS.chunk_size > 0:
+    # Modo por lotes: memoria acotada por chunk_size, salida incremental
+    log(f"✅ Modo por lotes: {ARGS.chunk_size} filas por lote")
+    resumen = ResumenScores()
+    n_semanas = 0
+    nan_count = 0
+    # Se escribe a un temporal y se renombra al final: un error a mitad de
+    # camino no deja un fuzzy_output.csv parcial
+    salida_tmp = OUTPUT_FILE.with_name(OUTPUT_FILE.stem + '.tmp.csv')
+    for df_lote in iter_table(weekly_file, columns=usecols, chunksize=ARGS.chunk_size):
+        if df_lote.empty:
+            continue
+        df_output = inferir_lote(df_lote)
+        df_output.to_csv(salida_tmp, index=False,
+                         mode='a' if n_semanas else 'w',
+                         header=(n_semanas == 0))
+        resumen.agregar(df_output['Sedentarismo_score'].to_numpy())
+        n_semanas += len(df_output)
+        nan_count += int(df_output['Sedentarismo_score'].isna().sum())
+    if n_semanas == 0:
+        log(f"❌ ERROR: {weekly_file.name} no tiene semanas para puntuar")
+        sys.exit(1)
+    salida_tmp.replace(OUTPUT_FILE)
+
+    score_mean, score_std = resumen.media, resumen.std
+    score_min, score_max = resumen.min, resumen.max
+else:
+    # Parquet (si existe y está al día) o CSV, sólo con features + claves
+    df = read_table(weekly_file, columns=usecols)
+    if df.empty:
+        log(f"❌ ERROR: {weekly_file.name} no tiene semanas para puntuar")
+        sys.exit(1)
+    df_output = inferir_lote(df)
+    sedentarismo_scores = df_output['Sedentarismo_score'].to_numpy()
+    n_semanas = len(df_output)
+    nan_count = int(df_output['Sedentarismo_score'].isna().sum())
+
+    score_mean, score_std = np.mean(
+        sedentarismo_scores), np.std(sedentarismo_scores)
+    score_min, score_max = np.min(
+        sedentarismo_scores), np.max(sedentarismo_scores)
+
+log(f"✅ Inferencia completada: {n_semanas} semanas")
+if verificar_lut:
+    log(f"   LUT vs exacto: error máximo de score = {comparacion_lut['error_score_max']:.2e}, "
+        f"sin semanas neutrales discordantes")
+log(f"   Score medio: {score_mean:.3f} ± {score_std:.3f}")
+log(f"   Min: {score_min:.3f}, Max: {score_max:.3f}")
 
 # Validar distribución
-if np.std(sedentarismo_scores) < 0.05:
+if score_std < 0.05:
     log(f"⚠️  WARNING: Distribución degenerada (std < 0.05)")
 else:
     log(
-        f"✅ Distribución no degenerada (std = {np.std(sedentarismo_scores):.3f})")
+        f"✅ Distribución no degenerada (std = {score_std:.3f})")
 
 # ============================================================================
 # 7. GUARDAR SALIDA
 # ============================================================================
 print_header('7. GUARDANDO RESULTADOS')
 
-# Preparar DataFrame de salida
-output_cols = ['usuario_id', 'semana_inicio', 'Sedentarismo_score']
-
-# Agregar membresías opcionales (top 3 por brevedad)
-for feat in scaled_features[:3]:
-    mf_labels = fuzzy_config[feat]['labels']
-    for label in mf_labels:
-        col_name = f'{feat}_{label}_memb'
-        if col_name in df_scaled.columns:
-            output_cols.append(col_name)
-
-# Agregar firing strengths
-for i, rule in enumerate(rules):
-    df_scaled[f'firing_{rule["id"]}'] = [fs[i] for fs in firing_strengths_all]
-    output_cols.append(f'firing_{rule["id"]}')
-
-df_output = df_scaled[output_cols].copy()
-df_output.to_csv(OUTPUT_FILE, index=False)
+if ARGS.chunk_size <= 0:
+    df_output.to_csv(OUTPUT_FILE, index=False)
 log(f"✅ Guardado: {OUTPUT_FILE.name}")
 log(f"   Columnas: {len(output_cols)}")
-log(f"   Filas: {len(df_output)}")
+log(f"   Filas: {n_semanas}")
 
 # Validar NaNs
-nan_count = df_output['Sedentarismo_score'].isna().sum()
 if nan_count > 0:
     log(f"⚠️  WARNING: {nan_count} semanas con NaN en score")
 else:
@@ -379,42 +429,39 @@ else:
 # ============================================================================
 print_header('8. ANÁLISIS POR TERCILES')
 
-terciles = np.percentile(sedentarismo_scores, [33.33, 66.67])
-log(f"Terciles: p33={terciles[0]:.3f}, p67={terciles[1]:.3f}")
+if ARGS.chunk_size > 0:
+    terciles = resumen.percentiles([33.33, 66.67])
+    log(f"Terciles (histograma de {resumen.n_bins} bins, error ≤ {1 / resumen.n_bins:.1e}): "
+        f"p33={terciles[0]:.3f}, p67={terciles[1]:.3f}")
+else:
+    terciles = np.percentile(sedentarismo_scores, [33.33, 66.67])
+    log(f"Terciles: p33={terciles[0]:.3f}, p67={terciles[1]:.3f}")
 
 # Manejar caso de terciles duplicados
-bins = [0, terciles[0], terciles[1], 1.0]
-unique_bins = sorted(set(bins))
-
-if len(unique_bins) < len(bins):
-    log(f"⚠️  WARNING: Terciles duplicados, usando bins únicos: {unique_bins}")
-    # Usar bins únicos y ajustar labels
-    if len(unique_bins) == 2:
-        df_output['tercil'] = pd.cut(df_output['Sedentarismo_score'],
-                                     bins=unique_bins,
-                                     labels=['Bajo-Medio', 'Alto'],
-                                     include_lowest=True, duplicates='drop')
-    elif len(unique_bins) == 3:
-        df_output['tercil'] = pd.cut(df_output['Sedentarismo_score'],
-                                     bins=unique_bins,
-                                     labels=['Bajo', 'Medio-Alto'],
-                                     include_lowest=True, duplicates='drop')
-    else:
-        df_output['tercil'] = pd.cut(df_output['Sedentarismo_score'],
-                                     bins=unique_bins,
-                                     labels=['Bajo', 'Medio',
-                                             'Alto'][:len(unique_bins)-1],
-                                     include_lowest=True, duplicates='drop')
+tercil_bins, tercil_labels = bins_terciles(terciles)
+if len(tercil_bins) < 4:
+    log(f"⚠️  WARNING: Terciles duplicados, usando bins únicos: {tercil_bins}")
+
+if ARGS.chunk_size > 0:
+    # Segunda pasada sólo sobre la columna de score ya escrita (lectura
+    # exacta: los mismos float que en memoria en el modo sin lotes)
+    lotes_scores = (lote['Sedentarismo_score'] for lote in iter_table(
+        OUTPUT_FILE, columns=['Sedentarismo_score'], chunksize=ARGS.chunk_size))
 else:
-    df_output['tercil'] = pd.cut(df_output['Sedentarismo_score'],
-                                 bins=[0, terciles[0], terciles[1], 1.0],
-                                 labels=['Bajo', 'Medio', 'Alto'],
-                                 include_lowest=True)
+    lotes_scores = [df_output['Sedentarismo_score']]
+
+# Conteos en orden de categoría (sort=False) y orden final como
+# value_counts(): descendente, empates en orden de categoría
+tercil_counts = None
+for scores_lote in lotes_scores:
+    counts_lote = pd.cut(scores_lote, bins=tercil_bins, labels=tercil_labels,
+                         include_lowest=True, duplicates='drop').value_counts(sort=False)
+    tercil_counts = counts_lote if tercil_counts is None else tercil_counts + counts_lote
+tercil_counts = tercil_counts.sort_values(ascending=False, kind='stable')
 
-tercil_counts = df_output['tercil'].value_counts()
 log(f"\nDistribución por terciles:")
 for tercil, count in tercil_counts.items():
-    pct = count / len(df_output) * 100
+    pct = count / n_semanas * 100
     log(f"   {tercil}: {count} semanas ({pct:.1f}%)")
 
 # ============================================================================
@@ -424,8 +471,15 @@ print_header('9. GENERANDO VISUALIZACIONES')
 
 # Histograma de scores
 fig, ax = plt.subplots(figsize=(10, 6))
-ax.hist(sedentarismo_scores, bins=50,
-        edgecolor='black', alpha=0.7, color='steelblue')
+if ARGS.chunk_size > 0:
+    # Re-binning del histograma fino a 50 bins entre min y max
+    centros = (np.arange(resumen.n_bins) + 0.5) / resumen.n_bins
+    ax.hist(centros, bins=50, range=(score_min, score_max),
+            weights=resumen.counts,
+            edgecolor='black', alpha=0.7, color='steelblue')
+else:
+    ax.hist(sedentarismo_scores, bins=50,
+            edgecolor='black', alpha=0.7, color='steelblue')
 ax.axvline(terciles[0], color='orange', linestyle='--',
            linewidth=2, label=f'p33={terciles[0]:.2f}')
 ax.axvline(terciles[1], color='red', linestyle='--',
@@ -433,7 +487,7 @@ ax.axvline(terciles[1], color='red', linestyle='--',
 ax.set_xlabel('Sedentarismo Score [0=Bajo, 1=Alto]', fontsize=11)
 ax.set_ylabel('Frecuencia', fontsize=11)
 ax.set_title(
-    f'Distribución de Sedentarismo Score (N={len(sedentarismo_scores)})', fontsize=12, pad=15)
+    f'Distribución de Sedentarismo Score (N={n_semanas})', fontsize=12, pad=15)
 ax.legend()
 ax.grid(alpha=0.3)
 plt.tight_layout()
@@ -449,19 +503,19 @@ log(f"✅ Guardado: {hist_file.name}")
 print_header('10. RESUMEN EJECUTIVO')
 
 log(f"\n📊 DATOS PROCESADOS:")
-log(f"   - Semanas totales: {len(df_output)}")
+log(f"   - Semanas totales: {n_semanas}")
 log(f"   - Features usadas: {len(scaled_features)}")
 log(f"   - Reglas activas: {len(rules)}")
 
 log(f"\n📈 SEDENTARISMO SCORE:")
-log(f"   - Media: {np.mean(sedentarismo_scores):.3f}")
-log(f"   - Desv. Std: {np.std(sedentarismo_scores):.3f}")
-log(f"   - Min: {np.min(sedentarismo_scores):.3f}")
-log(f"   - Max: {np.max(sedentarismo_scores):.3f}")
+log(f"   - Media: {score_mean:.3f}")
+log(f"   - Desv. Std: {score_std:.3f}")
+log(f"   - Min: {score_min:.3f}")
+log(f"   - Max: {score_max:.3f}")
 
 log(f"\n📊 DISTRIBUCIÓN POR TERCILES:")
 for tercil, count in tercil_counts.items():
-    pct = count / len(df_output) * 100
+    pct = count / n_semanas * 100
     log(f"   - {tercil}: {count} semanas ({pct:.1f}%)")
 
 log(f"\n✅ ARCHIVOS GENERADOS:")
@@ -6,7 +6,6 @@ Paso 7C: Validación cruzada
 
 from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import confusion_matrix
-from sklearn.metrics import accuracy_score, f1_score, matthews_corrcoef, precision_score, recall_score
 import warnings
 from datetime import datetime
 import seaborn as sns
@@ -20,6 +19,8 @@ import matplotlib
 matplotlib.use('Agg')
 warnings.filterwarnings('ignore')
 
+from threshold_sweep import metricas_umbrales, tau_optimo
+
 # ============================================================================
 # CONFIGURACIÓN
 # ============================================================================
@@ -153,32 +154,12 @@ df_merged['cluster_alto_sed'] = (
 print_header('4. BÚSQUEDA DE UMBRAL ÓPTIMO (τ)')
 
 
-# Grid de umbrales
+# Grid de umbrales: métricas de todos los τ en una pasada sobre los scores
+# ordenados (mismos valores que sklearn por umbral)
 thresholds = np.linspace(0.3, 0.7, 41)
-metrics_list = []
-
-for tau in thresholds:
-    # Binarizar fuzzy
-    fuzzy_bin = (df_merged['Sedentarismo_score'] >= tau).astype(int)
-    cluster_bin = df_merged['cluster_alto_sed']
-
-    # Calcular métricas
-    acc = accuracy_score(cluster_bin, fuzzy_bin)
-    f1 = f1_score(cluster_bin, fuzzy_bin, zero_division=0)
-    mcc = matthews_corrcoef(cluster_bin, fuzzy_bin)
-    prec = precision_score(cluster_bin, fuzzy_bin, zero_division=0)
-    rec = recall_score(cluster_bin, fuzzy_bin, zero_division=0)
-
-    metrics_list.append({
-        'tau': tau,
-        'accuracy': acc,
-        'f1': f1,
-        'mcc': mcc,
-        'precision': prec,
-        'recall': rec
-    })
-
-df_metrics = pd.DataFrame(metrics_list)
+df_metrics = metricas_umbrales(df_merged['Sedentarismo_score'],
+                               df_merged['cluster_alto_sed'], thresholds)
+df_metrics = df_metrics[['tau', 'accuracy', 'f1', 'mcc', 'precision', 'recall']]
 
 # Encontrar mejor τ por F1
 best_idx = df_metrics['f1'].idxmax()
@@ -195,6 +176,11 @@ log(f"   MCC: {best_mcc:.3f}")
 log(f"   Precision: {df_metrics.loc[best_idx, 'precision']:.3f}")
 log(f"   Recall: {df_metrics.loc[best_idx, 'recall']:.3f}")
 
+# Óptimo exacto sobre todos los scores distintos (sin grilla)
+tau_exacto, f1_exacto = tau_optimo(df_merged['Sedentarismo_score'],
+                                   df_merged['cluster_alto_sed'])
+log(f"   τ exacto (todos los scores): {tau_exacto:.4f} (F1={f1_exacto:.3f})")
+
 # Advertencia si concordancia es baja
 if best_f1 < 0.60:
     log(f"\n⚠️  WARNING: Concordancia baja (F1 < 0.60)")
@@ -20,6 +20,11 @@ METODOLOGÍA:
 9. Agregar F1_fold[i]
 10. Reportar: mean(F1) ± std(F1)
 
+Los folds son independientes y pueden ejecutarse en un pool de procesos
+(--workers N). Cada fold recibe su semilla de forma explícita y el resumen
+se arma en el orden de usuarios, así que los resultados no dependen del
+número de procesos.
+
 SALIDAS:
 --------
 - louo_results/
@@ -31,6 +36,9 @@ SALIDAS:
     - confusion_matrices_grid.png
 """
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import matplotlib
 import matplotlib.pyplot as plt
 from sklearn.metrics import f1_score, accuracy_score, precision_score, recall_score, matthews_corrcoef, confusion_matrix
@@ -43,8 +51,14 @@ from datetime import datetime
 import json
 import yaml
 import warnings
+from threadpoolctl import threadpool_limits
 warnings.filterwarnings('ignore')
 
+from fuzzy_engine import FuzzyInferenceSystem
+from data_store import table_exists
+from feature_cache import feature_frame
+from threshold_sweep import tau_optimo
+
 
 matplotlib.use('Agg')
 
@@ -75,6 +89,9 @@ FEATURES_FUZZY = [
     'Delta_cardiaco_p50'
 ]
 
+# Features "lower_better" (igual que 07_fuzzy_setup.py): etiquetas de carga
+FEATURES_CARGA = ['Delta_cardiaco_p50']
+
 # Percentiles para MF
 PERCENTILES_MF = {
     'Baja': [10, 25, 40],
@@ -86,6 +103,18 @@ RANDOM_STATE = 42
 TAU_GRID = np.arange(0.10, 0.61, 0.05)
 
 LOG_LINES = []
+# En los procesos del pool la consola no se imprime: se devuelve al proceso
+# principal, que la re-emite en orden de usuario
+ECHO_CONSOLA = True
+CONSOLA_LINES = []
+
+
+def consola(msg):
+    """Imprime mensaje (o lo guarda si se ejecuta en un worker)"""
+    if ECHO_CONSOLA:
+        print(msg)
+    else:
+        CONSOLA_LINES.append(msg)
 
 
 def log(msg):
@@ -93,14 +122,14 @@ def log(msg):
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     log_msg = f"[{timestamp}] {msg}"
     LOG_LINES.append(log_msg)
-    print(msg)
+    consola(msg)
 
 
 def print_header(title):
     """Imprime encabezado visual"""
-    print('\n' + '='*80)
-    print(title)
-    print('='*80)
+    consola('\n' + '='*80)
+    consola(title)
+    consola('='*80)
     log(f"\n{'='*80}\n{title}\n{'='*80}")
 
 # ============================================================================
@@ -108,18 +137,11 @@ def print_header(title):
 # ============================================================================
 
 
-def triangular(x, a, b, c):
-    """Función de membresía triangular"""
-    if x <= a or x >= c:
-        return 0.0
-    elif a < x < b:
-        return (x - a) / (b - a) if (b - a) > 0 else 0.0
-    else:
-        return (c - x) / (c - b) if (c - b) > 0 else 0.0
-
-
 def calcular_percentiles_mf(df_train, features):
-    """Calcula percentiles para MF solo con datos de entrenamiento"""
+    """Calcula percentiles para MF solo con datos de entrenamiento.
+
+    Devuelve la misma estructura que fuzzy_membership_config.yaml.
+    """
     mf_params = {}
 
     for feat in features:
@@ -130,13 +152,18 @@ def calcular_percentiles_mf(df_train, features):
         if len(data) == 0:
             continue
 
-        mf_params[feat] = {}
+        sufijo = '_Carga' if feat in FEATURES_CARGA else ''
+        membership_functions = {}
         for label, percentiles in PERCENTILES_MF.items():
             values = [np.percentile(data, p) for p in percentiles]
-            mf_params[feat][label] = {
+            membership_functions[f'{label}{sufijo}'] = {
                 'percentiles': percentiles,
                 'values': values
             }
+        mf_params[feat] = {
+            'labels': list(membership_functions),
+            'membership_functions': membership_functions
+        }
 
     return mf_params
 
@@ -154,20 +181,7 @@ def calcular_min_max(df_train, features):
     return scalers
 
 
-def normalizar_features(df, scalers, features):
-    """Normaliza features a [0,1]"""
-    df_norm = df.copy()
-    for feat in features:
-        if feat in df.columns and feat in scalers:
-            min_val = scalers[feat]['min']
-            max_val = scalers[feat]['max']
-            df_norm[f'{feat}_norm'] = (
-                df[feat] - min_val) / (max_val - min_val)
-            df_norm[f'{feat}_norm'] = df_norm[f'{feat}_norm'].clip(0, 1)
-    return df_norm
-
-
-def clustering_train(df_train):
+def clustering_train(df_train, random_state=RANDOM_STATE):
     """Entrena clustering K=2 en datos de entrenamiento"""
     X = df_train[FEATURES_CLUSTER].values
 
@@ -176,7 +190,7 @@ def clustering_train(df_train):
     X_scaled = scaler.fit_transform(X)
 
     # K-means K=2
-    kmeans = KMeans(n_clusters=2, random_state=RANDOM_STATE,
+    kmeans = KMeans(n_clusters=2, random_state=random_state,
                     n_init=10, max_iter=500)
     labels = kmeans.fit_predict(X_scaled)
 
@@ -206,74 +220,163 @@ def clustering_predict(df_test, scaler, kmeans, cluster_alto_original):
     return labels_mapped
 
 
-def fuzzy_fuzzify(df, mf_params, scalers):
-    """Fuzzifica features"""
-    df_norm = normalizar_features(df, scalers, FEATURES_FUZZY)
+def fuzzy_scores(df, fis):
+    """Scores de sedentarismo con el sistema difuso compilado del fold"""
+    scores, _ = fis.score(df[fis.features].to_numpy(dtype=float))
+    return scores
 
-    membresias = {}
-    for feat in FEATURES_FUZZY:
-        feat_norm = f'{feat}_norm'
-        if feat_norm not in df_norm.columns or feat not in mf_params:
-            continue
 
-        for label in ['Baja', 'Media', 'Alta']:
-            if label in mf_params[feat]:
-                a, b, c = mf_params[feat][label]['values']
-                col_name = f'{feat}_{label}_memb'
-                membresias[col_name] = df_norm[feat_norm].apply(
-                    lambda x: triangular(x, a, b, c))
-
-    df_memb = pd.DataFrame(membresias, index=df.index)
-    return df_memb
-
-
-def fuzzy_inference(df_memb):
-    """Ejecuta inferencia difusa (5 reglas)"""
-    # Reglas R1-R5
-    w1 = np.minimum(df_memb['Actividad_relativa_p50_Baja_memb'],
-                    df_memb['Superavit_calorico_basal_p50_Baja_memb'])
-    w2 = np.minimum(df_memb['Actividad_relativa_p50_Alta_memb'],
-                    df_memb['Superavit_calorico_basal_p50_Alta_memb'])
-    w3 = np.minimum(df_memb['HRV_SDNN_p50_Baja_memb'],
-                    df_memb['Delta_cardiaco_p50_Baja_memb'])
-    w4 = np.minimum(df_memb['Actividad_relativa_p50_Media_memb'],
-                    df_memb['HRV_SDNN_p50_Media_memb'])
-    w5 = np.minimum(df_memb['Actividad_relativa_p50_Baja_memb'],
-                    df_memb['Superavit_calorico_basal_p50_Media_memb']) * 0.7
-
-    # Agregación
-    s_bajo = w2
-    s_medio = w4
-    s_alto = w1 + w3 + w5
-
-    # Defuzzificación
-    s_total = s_bajo + s_medio + s_alto
-    scores = np.where(s_total > 0, (0.2 * s_bajo + 0.5 *
-                      s_medio + 0.8 * s_alto) / s_total, 0.0)
+def optimizar_tau(scores_train, y_true_train, exacto=False):
+    """Optimiza umbral τ maximizando F1 en train
 
-    return scores
+    Todos los τ se evalúan en una pasada sobre los scores ordenados. Con
+    exacto=True se prueban todos los scores distintos en vez de TAU_GRID.
+    """
+    tau, f1 = tau_optimo(scores_train, y_true_train, 'f1',
+                         None if exacto else TAU_GRID)
+    if f1 <= 0.0:
+        return 0.30, 0.0
+    return tau, f1
+
+# ============================================================================
+# FOLDS LEAVE-ONE-USER-OUT
+# ============================================================================
 
 
-def optimizar_tau(scores_train, y_true_train):
-    """Optimiza umbral τ maximizando F1 en train"""
-    best_tau = 0.30
-    best_f1 = 0.0
+def run_fold(df, test_user, random_state=RANDOM_STATE, tau_exacto=False):
+    """
+    Fold LOUO: entrena con los demás usuarios y evalúa en test_user.
 
-    for tau in TAU_GRID:
-        y_pred = (scores_train >= tau).astype(int)
-        f1 = f1_score(y_true_train, y_pred, zero_division=0)
-        if f1 > best_f1:
-            best_f1 = f1
-            best_tau = tau
+    Returns:
+        dict con las métricas del fold (una fila de louo_summary.csv)
+    """
+    print_header(f'FOLD: Test User = {test_user}')
+    log(f"\nProcesando fold: test_user = {test_user}")
+
+    # Split train/test
+    df_train = df[df['usuario_id'] != test_user].copy()
+    df_test = df[df['usuario_id'] == test_user].copy()
+
+    log(
+        f"  Train: {len(df_train)} semanas ({len(df_train['usuario_id'].unique())} usuarios)")
+    log(f"  Test: {len(df_test)} semanas (1 usuario: {test_user})")
+
+    # 1. Calcular percentiles MF en train
+    log("  [1] Calculando percentiles MF en train...")
+    mf_params_train = calcular_percentiles_mf(df_train, FEATURES_FUZZY)
+    scalers_train = calcular_min_max(df_train, FEATURES_FUZZY)
+
+    # 2. Entrenar clustering en train
+    log("  [2] Entrenando clustering K=2 en train...")
+    y_cluster_train, scaler_cluster, kmeans_model = clustering_train(
+        df_train, random_state)
+    df_train['cluster_label'] = y_cluster_train
+
+    # Identificar cluster alto original
+    cluster_alto_original = kmeans_model.predict(
+        scaler_cluster.transform(df_train[FEATURES_CLUSTER].values))
+    cluster_alto_id = 1 if (cluster_alto_original ==
+                            y_cluster_train).mean() > 0.5 else 0
+
+    # 3. Fuzzy en train (sistema compilado una vez por fold)
+    log("  [3] Aplicando fuzzy en train...")
+    fis_train = FuzzyInferenceSystem(mf_params_train, scalers_train)
+    scores_train = fuzzy_scores(df_train, fis_train)
+
+    # 4. Optimizar τ en train
+    log("  [4] Optimizando τ en train...")
+    tau_opt, f1_train = optimizar_tau(scores_train, y_cluster_train, tau_exacto)
+    log(f"      τ óptimo = {tau_opt:.2f}, F1_train = {f1_train:.3f}")
+
+    # 5. Aplicar clustering a test
+    log("  [5] Aplicando clustering a test...")
+    y_cluster_test = clustering_predict(
+        df_test, scaler_cluster, kmeans_model, cluster_alto_id)
+    df_test['cluster_label'] = y_cluster_test
+
+    # 6. Fuzzy en test
+    log("  [6] Aplicando fuzzy en test...")
+    scores_test = fuzzy_scores(df_test, fis_train)
+    y_pred_test = (scores_test >= tau_opt).astype(int)
+
+    # 7. Evaluar en test
+    log("  [7] Evaluando en test...")
+    f1_test = f1_score(y_cluster_test, y_pred_test, zero_division=0)
+    acc_test = accuracy_score(y_cluster_test, y_pred_test)
+    prec_test = precision_score(
+        y_cluster_test, y_pred_test, zero_division=0)
+    rec_test = recall_score(y_cluster_test, y_pred_test, zero_division=0)
+    mcc_test = matthews_corrcoef(y_cluster_test, y_pred_test)
+    cm_test = confusion_matrix(y_cluster_test, y_pred_test)
+
+    log(f"      F1 = {f1_test:.3f}, Acc = {acc_test:.3f}, Prec = {prec_test:.3f}, Rec = {rec_test:.3f}, MCC = {mcc_test:.3f}")
+
+    return {
+        'test_user': test_user,
+        'n_train': len(df_train),
+        'n_test': len(df_test),
+        'tau_opt': tau_opt,
+        'f1_train': f1_train,
+        'f1_test': f1_test,
+        'accuracy_test': acc_test,
+        'precision_test': prec_test,
+        'recall_test': rec_test,
+        'mcc_test': mcc_test,
+        'tn': cm_test[0, 0],
+        'fp': cm_test[0, 1],
+        'fn': cm_test[1, 0],
+        'tp': cm_test[1, 1]
+    }
+
+
+def _run_fold_en_worker(test_user, df, random_state=RANDOM_STATE, tau_exacto=False):
+    """
+    Ejecuta run_fold dentro de un proceso del pool.
+
+    KMeans se limita a un hilo por proceso para no sobre-suscribir la CPU.
+
+    Returns:
+        (dict del fold, líneas de log, líneas de consola)
+    """
+    global ECHO_CONSOLA
+    ECHO_CONSOLA = False
+    LOG_LINES.clear()
+    CONSOLA_LINES.clear()
+    with threadpool_limits(limits=1):
+        resultado = run_fold(df, test_user, random_state, tau_exacto)
+    return resultado, list(LOG_LINES), list(CONSOLA_LINES)
+
+
+def iter_folds(df, usuarios, workers=1, random_state=RANDOM_STATE, tau_exacto=False):
+    """
+    Ejecuta los folds y entrega sus resultados en el orden de usuarios.
+
+    Con workers > 1 los folds se reparten en un pool de procesos; el log de
+    cada fold se re-emite aquí en orden de usuario, de modo que LOG_LINES y
+    louo_summary.csv quedan igual que en modo secuencial.
+    """
+    if workers <= 1:
+        for test_user in usuarios:
+            yield run_fold(df, test_user, random_state, tau_exacto)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        salidas = pool.map(
+            partial(_run_fold_en_worker, df=df, random_state=random_state,
+                    tau_exacto=tau_exacto), usuarios)
+        for resultado, lineas_log, lineas_consola in salidas:
+            LOG_LINES.extend(lineas_log)
+            for linea in lineas_consola:
+                print(linea)
+            yield resultado
 
-    return best_tau, best_f1
 
 # ============================================================================
 # MAIN: LEAVE-ONE-USER-OUT
 # ============================================================================
 
 
-def main():
+def main(workers=1, tau_exacto=False):
     print_header('LEAVE-ONE-USER-OUT VALIDATION - PASO 10')
     log(f"Inicio: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     log(f"Archivo entrada: {DATA_FILE}")
@@ -282,11 +385,12 @@ def main():
 
     # Cargar datos
     print_header('1. CARGANDO DATOS')
-    if not DATA_FILE.exists():
+    if not table_exists(DATA_FILE):
         log(f"❌ ERROR: No existe {DATA_FILE}")
         return
 
-    df = pd.read_csv(DATA_FILE)
+    df = feature_frame(FEATURES_CLUSTER + [f for f in FEATURES_FUZZY
+                                           if f not in FEATURES_CLUSTER])
     log(f"✅ Datos cargados: {len(df)} semanas")
     log(f"   Usuarios: {df['usuario_id'].nunique()}")
     log("")
@@ -296,93 +400,20 @@ def main():
     log(f"Usuarios encontrados: {usuarios}")
     log("")
 
-    # Resultados por fold
-    results_folds = []
-
     # ========================================================================
     # LOOP: Leave-One-User-Out
     # ========================================================================
 
-    for test_user in usuarios:
-        print_header(f'FOLD: Test User = {test_user}')
-        log(f"\nProcesando fold: test_user = {test_user}")
-
-        # Split train/test
-        df_train = df[df['usuario_id'] != test_user].copy()
-        df_test = df[df['usuario_id'] == test_user].copy()
-
-        log(
-            f"  Train: {len(df_train)} semanas ({len(df_train['usuario_id'].unique())} usuarios)")
-        log(f"  Test: {len(df_test)} semanas (1 usuario: {test_user})")
-
-        # 1. Calcular percentiles MF en train
-        log("  [1] Calculando percentiles MF en train...")
-        mf_params_train = calcular_percentiles_mf(df_train, FEATURES_FUZZY)
-        scalers_train = calcular_min_max(df_train, FEATURES_FUZZY)
-
-        # 2. Entrenar clustering en train
-        log("  [2] Entrenando clustering K=2 en train...")
-        y_cluster_train, scaler_cluster, kmeans_model = clustering_train(
-            df_train)
-        df_train['cluster_label'] = y_cluster_train
-
-        # Identificar cluster alto original
-        cluster_alto_original = kmeans_model.predict(
-            scaler_cluster.transform(df_train[FEATURES_CLUSTER].values))
-        cluster_alto_id = 1 if (cluster_alto_original ==
-                                y_cluster_train).mean() > 0.5 else 0
-
-        # 3. Fuzzy en train
-        log("  [3] Aplicando fuzzy en train...")
-        df_memb_train = fuzzy_fuzzify(df_train, mf_params_train, scalers_train)
-        scores_train = fuzzy_inference(df_memb_train)
-
-        # 4. Optimizar τ en train
-        log("  [4] Optimizando τ en train...")
-        tau_opt, f1_train = optimizar_tau(scores_train, y_cluster_train)
-        log(f"      τ óptimo = {tau_opt:.2f}, F1_train = {f1_train:.3f}")
-
-        # 5. Aplicar clustering a test
-        log("  [5] Aplicando clustering a test...")
-        y_cluster_test = clustering_predict(
-            df_test, scaler_cluster, kmeans_model, cluster_alto_id)
-        df_test['cluster_label'] = y_cluster_test
-
-        # 6. Fuzzy en test
-        log("  [6] Aplicando fuzzy en test...")
-        df_memb_test = fuzzy_fuzzify(df_test, mf_params_train, scalers_train)
-        scores_test = fuzzy_inference(df_memb_test)
-        y_pred_test = (scores_test >= tau_opt).astype(int)
-
-        # 7. Evaluar en test
-        log("  [7] Evaluando en test...")
-        f1_test = f1_score(y_cluster_test, y_pred_test, zero_division=0)
-        acc_test = accuracy_score(y_cluster_test, y_pred_test)
-        prec_test = precision_score(
-            y_cluster_test, y_pred_test, zero_division=0)
-        rec_test = recall_score(y_cluster_test, y_pred_test, zero_division=0)
-        mcc_test = matthews_corrcoef(y_cluster_test, y_pred_test)
-        cm_test = confusion_matrix(y_cluster_test, y_pred_test)
-
-        log(f"      F1 = {f1_test:.3f}, Acc = {acc_test:.3f}, Prec = {prec_test:.3f}, Rec = {rec_test:.3f}, MCC = {mcc_test:.3f}")
-
-        # Guardar resultados del fold
-        results_folds.append({
-            'test_user': test_user,
-            'n_train': len(df_train),
-            'n_test': len(df_test),
-            'tau_opt': tau_opt,
-            'f1_train': f1_train,
-            'f1_test': f1_test,
-            'accuracy_test': acc_test,
-            'precision_test': prec_test,
-            'recall_test': rec_test,
-            'mcc_test': mcc_test,
-            'tn': cm_test[0, 0],
-            'fp': cm_test[0, 1],
-            'fn': cm_test[1, 0],
-            'tp': cm_test[1, 1]
-        })
+    if workers > 1:
+        log(f"Folds en paralelo: {workers} procesos")
+        log("")
+    if tau_exacto:
+        log("τ óptimo exacto (todos los scores distintos, sin grilla)")
+        log("")
+
+    # Resultados por fold (en el orden de usuarios)
+    results_folds = list(iter_folds(df, usuarios, workers,
+                                    tau_exacto=tau_exacto))
 
     # ========================================================================
     # RESUMEN GLOBAL
@@ -487,7 +518,14 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(
+        description='Validación Leave-One-User-Out (Paso 10)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Procesos para ejecutar folds en paralelo (1 = secuencial)')
+    parser.add_argument('--tau-exacto', action='store_true',
+                        help='Optimizar τ sobre todos los scores distintos (sin TAU_GRID)')
+    args = parser.parse_args()
+    main(workers=args.workers, tau_exacto=args.tau_exacto)
 
 
 
@@ -7,30 +7,49 @@ OBJETIVO:
 Analizar la robustez del sistema difuso variando:
 1. Umbral τ (±0.05 alrededor del óptimo τ=0.30)
 2. Percentiles de MF (±5% para cada percentil)
+3. Grilla densa de shifts por feature y por etiqueta (GRID_SHIFTS)
+4. Opcional (--global sobol|morris): sensibilidad global conjunta de puntos
+   de quiebre, pesos de reglas y centroides de consecuentes (global_sensitivity)
+
+Todos los shifts se evalúan en un solo lote (FuzzyInferenceSystem.score_lote):
+los puntos de quiebre se apilan en un eje de shift sobre la misma matriz de
+features, y el cruce con cluster_assignments.csv se hace una sola vez.
 
 SALIDAS:
 --------
 - sensibilidad/
   - sensibilidad_tau.csv (F1, Acc, etc. por cada τ)
   - sensibilidad_mf_percentiles.csv
+  - sensibilidad_mf_grid.csv (feature × etiqueta × shift)
   - plots/
     - sensitivity_tau_curve.png
     - sensitivity_mf_heatmap.png
+    - sensitivity_global_{sobol|morris}.png (con --global)
+  - sensibilidad_global_{sobol|morris}.csv (con --global)
+
+USO:
+    python 11_analisis_sensibilidad.py
+    python 11_analisis_sensibilidad.py --global sobol --n-muestras 1024 --workers 4
 """
 
 import matplotlib
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.metrics import f1_score, accuracy_score, precision_score, recall_score, matthews_corrcoef
 import pandas as pd
 import numpy as np
 from pathlib import Path
 from datetime import datetime
+import argparse
 import json
 import yaml
 import warnings
 warnings.filterwarnings('ignore')
 
+from fuzzy_engine import FuzzyInferenceSystem
+from feature_cache import feature_frame
+from threshold_sweep import metricas_confusion, metricas_umbrales, tau_optimo
+from global_sensitivity import indices_sobol, efectos_morris
+
 
 matplotlib.use('Agg')
 
@@ -58,6 +77,15 @@ TAU_RANGE = np.arange(0.20, 0.41, 0.01)  # τ ∈ [0.20, 0.40] step 0.01
 
 PERCENTILES_SHIFTS = [-5, -3, 0, 3, 5]  # Shifts en %
 
+# Grilla densa por feature/etiqueta: -20% … +20% en pasos de 0.5%
+GRID_SHIFTS = np.round(np.arange(-20.0, 20.01, 0.5), 1)
+ETIQUETA_TODAS = 'todas'
+
+# Sensibilidad global: muestras base (Sobol, n·(k+2) evaluaciones) o
+# trayectorias (Morris, r·(k+1) evaluaciones)
+N_MUESTRAS_GLOBAL = {'sobol': 1024, 'morris': 200}
+TOP_GLOBAL = 8
+
 FEATURES_FUZZY = [
     'Actividad_relativa_p50',
     'Superavit_calorico_basal_p50',
@@ -88,97 +116,47 @@ def print_header(title):
 # ============================================================================
 
 
-def triangular(x, a, b, c):
-    """Función de membresía triangular"""
-    if x <= a or x >= c:
-        return 0.0
-    elif a < x < b:
-        return (x - a) / (b - a) if (b - a) > 0 else 0.0
-    else:
-        return (c - x) / (c - b) if (c - b) > 0 else 0.0
-
-
-def fuzzy_inference_with_mf(df, mf_params, scalers):
-    """Ejecuta inferencia difusa completa con parámetros MF dados"""
-    # Normalizar features
-    df_norm = df.copy()
-    for feat in FEATURES_FUZZY:
-        if feat in df.columns and feat in scalers:
-            min_val = scalers[feat]['min']
-            max_val = scalers[feat]['max']
-            df_norm[f'{feat}_norm'] = (
-                df[feat] - min_val) / (max_val - min_val)
-            df_norm[f'{feat}_norm'] = df_norm[f'{feat}_norm'].clip(0, 1)
-
-    # Fuzzificar
-    membresias = {}
-    for feat in FEATURES_FUZZY:
-        feat_norm = f'{feat}_norm'
-        if feat_norm not in df_norm.columns or feat not in mf_params:
-            continue
-
-        for label in ['Baja', 'Media', 'Alta']:
-            if label in mf_params[feat]:
-                a, b, c = mf_params[feat][label]['values']
-                col_name = f'{feat}_{label}_memb'
-                membresias[col_name] = df_norm[feat_norm].apply(
-                    lambda x: triangular(x, a, b, c))
-
-    df_memb = pd.DataFrame(membresias, index=df.index)
-
-    # Activación de reglas (R1-R5)
-    w1 = np.minimum(df_memb['Actividad_relativa_p50_Baja_memb'],
-                    df_memb['Superavit_calorico_basal_p50_Baja_memb'])
-    w2 = np.minimum(df_memb['Actividad_relativa_p50_Alta_memb'],
-                    df_memb['Superavit_calorico_basal_p50_Alta_memb'])
-    w3 = np.minimum(df_memb['HRV_SDNN_p50_Baja_memb'],
-                    df_memb['Delta_cardiaco_p50_Baja_memb'])
-    w4 = np.minimum(df_memb['Actividad_relativa_p50_Media_memb'],
-                    df_memb['HRV_SDNN_p50_Media_memb'])
-    w5 = np.minimum(df_memb['Actividad_relativa_p50_Baja_memb'],
-                    df_memb['Superavit_calorico_basal_p50_Media_memb']) * 0.7
-
-    # Agregación
-    s_bajo = w2
-    s_medio = w4
-    s_alto = w1 + w3 + w5
-
-    # Defuzzificación
-    s_total = s_bajo + s_medio + s_alto
-    scores = np.where(s_total > 0, (0.2 * s_bajo + 0.5 *
-                      s_medio + 0.8 * s_alto) / s_total, 0.0)
-
-    return scores
-
-
-def shift_percentiles(mf_params, shift_pct):
-    """Aplica shift porcentual a todos los percentiles"""
-    mf_shifted = {}
-    for feat, feat_dict in mf_params.items():
-        mf_shifted[feat] = {}
-        # Si tiene 'membership_functions', extraerlo
-        if 'membership_functions' in feat_dict:
-            labels_dict = feat_dict['membership_functions']
-        else:
-            labels_dict = feat_dict
-
-        for label, params in labels_dict.items():
-            if isinstance(params, dict) and 'values' in params:
-                values_orig = params['values']
-                # Shift multiplicativo (no aditivo, para mantener orden)
-                values_new = [v * (1 + shift_pct / 100.0) for v in values_orig]
-                mf_shifted[feat][label] = {
-                    'percentiles': params['percentiles'],
-                    'values': values_new
-                }
-    return mf_shifted
+def factores_shift(fis, shifts, feature=None, label=None):
+    """Factores multiplicativos (n_shifts × n_features × n_labels)
+
+    Shift multiplicativo (no aditivo, para mantener orden) de los puntos de
+    quiebre: v · (1 + shift/100). Con feature/label se desplaza sólo esa
+    feature o esa etiqueta; el resto queda en factor 1.
+    """
+    shifts = np.asarray(shifts, dtype=float)
+    n_feat, n_labels = fis.breakpoints_raw.shape[:2]
+    mascara = np.ones((n_feat, n_labels), dtype=bool)
+    if feature is not None:
+        mascara &= (np.arange(n_feat) == fis.features.index(feature))[:, None]
+    if label is not None:
+        mascara &= (np.array(fis.labels[feature]) == label)[None, :]
+    return np.where(mascara[None], (1 + shifts / 100.0)[:, None, None], 1.0)
+
+
+def metricas_shifts(fis, X, y_true, factores):
+    """Métricas a τ base para cada conjunto de factores, en un solo lote
+
+    X e y_true son las semanas ya cruzadas con los clusters; devuelve un
+    DataFrame con una fila por conjunto de factores.
+    """
+    breakpoints = fis.escalar_breakpoints(fis.breakpoints_raw[None] * factores[..., None])
+    y = np.asarray(y_true).astype(bool)
+    pred = fis.score_lote(X, breakpoints) >= TAU_BASE
+
+    tp = (pred & y).sum(axis=1)
+    fp = (pred & ~y).sum(axis=1)
+    fn = y.sum() - tp
+    tn = (~y).sum() - fp
+    metricas = metricas_confusion(tp, fp, fn, tn)
+    return pd.DataFrame({m: metricas[m] for m in
+                         ['f1', 'accuracy', 'precision', 'recall', 'mcc']})
 
 # ============================================================================
 # MAIN
 # ============================================================================
 
 
-def main():
+def main(modo_global=None, n_muestras=None, workers=1, semilla=42):
     print_header('ANÁLISIS DE SENSIBILIDAD - PASO 11')
     log(f"Inicio: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     log(f"Directorio salida: {OUTPUT_DIR}")
@@ -193,7 +171,7 @@ def main():
 
     df_fuzzy = pd.read_csv(FUZZY_OUTPUT)
     df_clusters = pd.read_csv(CLUSTER_ASSIGNMENTS)
-    df_weekly = pd.read_csv(WEEKLY_DATA)
+    df_weekly = feature_frame(FEATURES_FUZZY)
 
     # Merge
     df = df_fuzzy.merge(df_clusters[['usuario_id', 'semana_inicio', 'cluster']], on=[
@@ -222,28 +200,11 @@ def main():
     scores = df['Sedentarismo_score'].values
     y_true = df['cluster'].values
 
-    results_tau = []
-
-    for tau in TAU_RANGE:
-        y_pred = (scores >= tau).astype(int)
-
-        f1 = f1_score(y_true, y_pred, zero_division=0)
-        acc = accuracy_score(y_true, y_pred)
-        prec = precision_score(y_true, y_pred, zero_division=0)
-        rec = recall_score(y_true, y_pred, zero_division=0)
-        mcc = matthews_corrcoef(y_true, y_pred)
-
-        results_tau.append({
-            'tau': tau,
-            'f1': f1,
-            'accuracy': acc,
-            'precision': prec,
-            'recall': rec,
-            'mcc': mcc,
-            'delta_f1_vs_base': f1 - f1_score(y_true, (scores >= TAU_BASE).astype(int), zero_division=0)
-        })
-
-    df_tau = pd.DataFrame(results_tau)
+    # Todos los τ en una pasada sobre los scores ordenados
+    df_tau = metricas_umbrales(scores, y_true, TAU_RANGE)
+    df_tau = df_tau[['tau', 'f1', 'accuracy', 'precision', 'recall', 'mcc']]
+    f1_base = metricas_umbrales(scores, y_true, [TAU_BASE])['f1'].iloc[0]
+    df_tau['delta_f1_vs_base'] = df_tau['f1'] - f1_base
 
     # Guardar
     tau_file = OUTPUT_DIR / 'sensibilidad_tau.csv'
@@ -263,6 +224,8 @@ def main():
     log(f"   τ óptimo (F1 máximo): {tau_optimal:.2f} (F1={f1_max:.3f})")
     log(f"   τ base (0.30): F1={f1_at_base:.3f}")
     log(f"   Diferencia: ΔF1 = {f1_max - f1_at_base:.3f}")
+    tau_exacto, f1_exacto = tau_optimo(scores, y_true)
+    log(f"   τ exacto (todos los scores): {tau_exacto:.4f} (F1={f1_exacto:.3f})")
     log("")
 
     # Rango estable (F1 dentro de ±0.05 del máximo)
@@ -281,55 +244,21 @@ def main():
     log(f"Evaluando shifts: {PERCENTILES_SHIFTS} %")
     log("")
 
-    results_mf = []
-
-    for shift in PERCENTILES_SHIFTS:
-        log(f"  Procesando shift = {shift:+d}%...")
-
-        # Aplicar shift
-        mf_shifted = shift_percentiles(mf_config_base, shift)
-
-        # Recalcular scores con MF modificadas
-        scores_shifted = fuzzy_inference_with_mf(
-            df_weekly, mf_shifted, scalers)
-
-        # Evaluar con τ base
-        y_pred_shifted = (scores_shifted >= TAU_BASE).astype(int)
-
-        # Merge con clusters
-        df_eval = pd.DataFrame({
-            'usuario_id': df_weekly['usuario_id'],
-            'semana_inicio': df_weekly['semana_inicio'],
-            'score_shifted': scores_shifted,
-            'y_pred_shifted': y_pred_shifted
-        })
-
-        df_eval = df_eval.merge(df_clusters[['usuario_id', 'semana_inicio', 'cluster']],
-                                on=['usuario_id', 'semana_inicio'], how='inner')
-
-        f1 = f1_score(df_eval['cluster'],
-                      df_eval['y_pred_shifted'], zero_division=0)
-        acc = accuracy_score(df_eval['cluster'], df_eval['y_pred_shifted'])
-        prec = precision_score(
-            df_eval['cluster'], df_eval['y_pred_shifted'], zero_division=0)
-        rec = recall_score(df_eval['cluster'],
-                           df_eval['y_pred_shifted'], zero_division=0)
-        mcc = matthews_corrcoef(df_eval['cluster'], df_eval['y_pred_shifted'])
-
-        # Calcular diferencia con base (shift=0)
-        if shift == 0:
-            f1_base_mf = f1
+    # Cruce con clusters una sola vez: filas de df_weekly con etiqueta
+    claves = df_weekly[['usuario_id', 'semana_inicio']].assign(
+        fila=np.arange(len(df_weekly)))
+    df_eval = claves.merge(df_clusters[['usuario_id', 'semana_inicio', 'cluster']],
+                           on=['usuario_id', 'semana_inicio'], how='inner')
+    y_eval = df_eval['cluster'].to_numpy()
 
-        results_mf.append({
-            'shift_pct': shift,
-            'f1': f1,
-            'accuracy': acc,
-            'precision': prec,
-            'recall': rec,
-            'mcc': mcc
-        })
+    fis_base = FuzzyInferenceSystem(
+        {f: mf_config_base[f] for f in FEATURES_FUZZY if f in mf_config_base}, scalers)
+    X_eval = df_weekly[fis_base.features].to_numpy(dtype=float)[df_eval['fila'].to_numpy()]
 
-    df_mf = pd.DataFrame(results_mf)
+    # Todos los shifts en un lote (mismo shift en todas las features)
+    df_mf = metricas_shifts(fis_base, X_eval, y_eval,
+                            factores_shift(fis_base, PERCENTILES_SHIFTS))
+    df_mf.insert(0, 'shift_pct', PERCENTILES_SHIFTS)
 
     # Calcular delta respecto a base
     df_mf['delta_f1_vs_base'] = df_mf['f1'] - \
@@ -350,9 +279,74 @@ def main():
     log("")
 
     for idx, row in df_mf.iterrows():
-        log(f"   Shift {row['shift_pct']:+d}%: F1={row['f1']:.3f}, ΔF1={row['delta_f1_vs_base']:+.3f}")
+        log(f"   Shift {int(row['shift_pct']):+d}%: F1={row['f1']:.3f}, ΔF1={row['delta_f1_vs_base']:+.3f}")
     log("")
 
+    # ========================================================================
+    # PARTE 3: GRILLA DENSA POR FEATURE Y ETIQUETA
+    # ========================================================================
+
+    print_header('3B. GRILLA DE SHIFTS POR FEATURE Y ETIQUETA')
+
+    combinaciones = [(feat, label) for feat in fis_base.features
+                     for label in [None] + fis_base.labels[feat]]
+    log(f"Evaluando {len(combinaciones)} combinaciones feature/etiqueta × "
+        f"{len(GRID_SHIFTS)} shifts [{GRID_SHIFTS.min():+.1f}%, {GRID_SHIFTS.max():+.1f}%] "
+        f"= {len(combinaciones) * len(GRID_SHIFTS)} sistemas en un lote")
+
+    factores = np.concatenate([factores_shift(fis_base, GRID_SHIFTS, feat, label)
+                               for feat, label in combinaciones])
+    df_grid = metricas_shifts(fis_base, X_eval, y_eval, factores)
+    df_grid.insert(0, 'feature', np.repeat([f for f, _ in combinaciones], len(GRID_SHIFTS)))
+    df_grid.insert(1, 'label', np.repeat([lbl or ETIQUETA_TODAS for _, lbl in combinaciones],
+                                         len(GRID_SHIFTS)))
+    df_grid.insert(2, 'shift_pct', np.tile(GRID_SHIFTS, len(combinaciones)))
+    df_grid['delta_f1_vs_base'] = df_grid['f1'] - f1_base_mf
+
+    grid_file = OUTPUT_DIR / 'sensibilidad_mf_grid.csv'
+    df_grid.to_csv(grid_file, index=False)
+    log(f"✅ Guardado: {grid_file.name}")
+
+    log(f"\n📊 ΔF1 máximo por feature (todas las etiquetas):")
+    df_feat = df_grid[df_grid['label'] == ETIQUETA_TODAS]
+    for feat, grupo in df_feat.groupby('feature', sort=False):
+        en_5 = grupo[grupo['shift_pct'].abs() <= 5]
+        log(f"   {feat}: ±5% → {en_5['delta_f1_vs_base'].abs().max():.3f}, "
+            f"±{GRID_SHIFTS.max():.0f}% → {grupo['delta_f1_vs_base'].abs().max():.3f}")
+    log("")
+
+    # ========================================================================
+    # PARTE 4: SENSIBILIDAD GLOBAL (SOBOL / MORRIS)
+    # ========================================================================
+
+    df_global = None
+    if modo_global:
+        print_header(f'3C. SENSIBILIDAD GLOBAL ({modo_global.upper()})')
+
+        n_muestras = n_muestras or N_MUESTRAS_GLOBAL[modo_global]
+        inicio = datetime.now()
+        if modo_global == 'sobol':
+            df_global = indices_sobol(fis_base, X_eval, y_eval, n_base=n_muestras,
+                                      tau=TAU_BASE, seed=semilla, workers=workers)
+            columna = 'ST'
+        else:
+            df_global = efectos_morris(fis_base, X_eval, y_eval, n_trayectorias=n_muestras,
+                                       tau=TAU_BASE, seed=semilla, workers=workers)
+            columna = 'mu_star'
+        segundos = (datetime.now() - inicio).total_seconds()
+        log(f"Evaluaciones: {df_global.attrs['n_evaluaciones']} sistemas "
+            f"({segundos:.1f} s, workers={workers})")
+
+        global_file = OUTPUT_DIR / f'sensibilidad_global_{modo_global}.csv'
+        df_global.to_csv(global_file, index=False)
+        log(f"✅ Guardado: {global_file.name}")
+
+        for metrica, grupo in df_global.groupby('metrica', sort=False):
+            log(f"\n📊 Factores más influyentes ({metrica.upper()}, {columna}):")
+            for _, fila in grupo.nlargest(TOP_GLOBAL, columna).iterrows():
+                log(f"   {fila['factor']}: {fila[columna]:.4f}")
+        log("")
+
     # ========================================================================
     # VISUALIZACIONES
     # ========================================================================
@@ -442,6 +436,49 @@ def main():
     plt.close(fig)
     log(f"✅ Guardado: plots/sensitivity_mf_shifts.png")
 
+    # Plot 3: Heatmap ΔF1 por feature (todas las etiquetas) × shift
+    mapa = df_feat.pivot(index='feature', columns='shift_pct',
+                         values='delta_f1_vs_base').loc[fis_base.features]
+    fig, ax = plt.subplots(figsize=(14, 4))
+    lim = max(abs(mapa.values).max(), 1e-6)
+    im = ax.imshow(mapa.values, aspect='auto', cmap='RdBu', vmin=-lim, vmax=lim)
+    paso = max(1, len(GRID_SHIFTS) // 16)
+    ax.set_xticks(np.arange(0, len(GRID_SHIFTS), paso))
+    ax.set_xticklabels([f"{v:+.0f}%" for v in GRID_SHIFTS[::paso]], fontsize=9)
+    ax.set_yticks(range(len(mapa)))
+    ax.set_yticklabels(mapa.index, fontsize=10)
+    ax.set_xlabel('Shift de Percentiles (%)', fontsize=12, fontweight='bold')
+    ax.set_title('ΔF1 vs base por Feature (shift de todas sus MF)',
+                 fontsize=14, fontweight='bold', pad=15)
+    fig.colorbar(im, ax=ax, label='ΔF1')
+
+    plt.tight_layout()
+    plot3_file = OUTPUT_DIR / 'plots' / 'sensitivity_mf_heatmap.png'
+    fig.savefig(plot3_file, dpi=150)
+    plt.close(fig)
+    log(f"✅ Guardado: plots/sensitivity_mf_heatmap.png")
+
+    # Plot 4: Índices globales (F1)
+    if df_global is not None:
+        df_plot = df_global[df_global['metrica'] == 'f1'].nlargest(TOP_GLOBAL, columna)[::-1]
+        fig, ax = plt.subplots(figsize=(12, 7))
+        ax.barh(df_plot['factor'], df_plot[columna], color='steelblue',
+                edgecolor='black', alpha=0.7, label=columna)
+        if modo_global == 'sobol':
+            ax.barh(df_plot['factor'], df_plot['S1'].clip(lower=0), color='coral',
+                    edgecolor='black', alpha=0.7, label='S1')
+        ax.set_xlabel(f'Índice ({columna})', fontsize=12, fontweight='bold')
+        ax.set_title(f'Sensibilidad Global de F1 ({modo_global.capitalize()})',
+                     fontsize=14, fontweight='bold', pad=15)
+        ax.legend(fontsize=10)
+        ax.grid(True, alpha=0.3, axis='x')
+
+        plt.tight_layout()
+        plot4_file = OUTPUT_DIR / 'plots' / f'sensitivity_global_{modo_global}.png'
+        fig.savefig(plot4_file, dpi=150)
+        plt.close(fig)
+        log(f"✅ Guardado: plots/{plot4_file.name}")
+
     # ========================================================================
     # RESUMEN FINAL
     # ========================================================================
@@ -473,4 +510,16 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(
+        description='Análisis de sensibilidad del sistema difuso (Paso 11)')
+    parser.add_argument('--global', dest='modo_global', choices=['sobol', 'morris'],
+                        help='Agregar sensibilidad global conjunta (Sobol o Morris)')
+    parser.add_argument('--n-muestras', type=int, default=None,
+                        help='Muestras base (Sobol) o trayectorias (Morris)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Procesos para evaluar los lotes de sistemas (1 = secuencial)')
+    parser.add_argument('--semilla', type=int, default=42,
+                        help='Semilla del muestreo global')
+    args = parser.parse_args()
+    main(modo_global=args.modo_global, n_muestras=args.n_muestras,
+         workers=args.workers, semilla=args.semilla)
@@ -6,6 +6,20 @@ Herramienta operativa para:
   3) Evaluar predicción 1-paso (t->t+1) con dicha matriz
   4) Predecir el estado de la próxima semana por usuario
 
+Los conteos de transición se guardan en un almacén persistente
+(markov_store.MarkovStore: int32 por usuario, olvido exponencial opcional,
+potencias de la matriz cacheadas). Con --incremental sólo se agregan las
+semanas posteriores a la última registrada de cada usuario; si cambió una
+semana ya incorporada (hash de la historia distinto) el almacén se
+reconstruye. Con --threshold-mode global_terciles los umbrales se recalculan
+con todas las semanas y casi cualquier semana nueva los mueve, así que en la
+práctica el modo incremental reconstruye; sólo ahorra trabajo con umbrales
+fijos.
+
+Con --orden-max K se compara además, por backtest 1-paso, la cadena de
+orden 1..K (markov_high_order), sola o con covariables de cobertura
+discretizadas (--covariables).
+
 Entradas por defecto:
   - analisis_u/fuzzy/fuzzy_output.csv (columnas: usuario_id, semana_inicio, Sedentarismo_score, ...)
 
@@ -15,20 +29,27 @@ Salidas:
   - analisis_u/prediccion/matriz_transicion_por_usuario.csv
   - analisis_u/prediccion/predicciones_backtest.csv
   - analisis_u/prediccion/prediccion_proxima_semana_por_usuario.csv
+  - analisis_u/prediccion/prediccion_multihorizonte_por_usuario.csv (--horizontes)
+  - analisis_u/prediccion/markov_orden_k_grid.csv (--orden-max > 1)
   - analisis_u/prediccion/reporte_markov.txt
+  - analisis_u/prediccion/markov_store.npz
 """
 
 from __future__ import annotations
 
 import argparse
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Tuple
 
 import numpy as np
 import pandas as pd
 
+from feature_cache import load_features
+from markov_high_order import ORDEN_MAX, buscar_orden, discretizar
+from markov_store import MarkovStore
+
 
 # ======================================================================================
 # UTILIDADES DE LOG Y RUTAS
@@ -40,6 +61,15 @@ OUTPUT_DIR = BASE_DIR / 'analisis_u' / 'prediccion'
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
 REPORTE_FILE = OUTPUT_DIR / 'reporte_markov.txt'
+STORE_FILE = 'markov_store.npz'
+
+# Covariables de cobertura para la cadena de orden k (columnas del índice de
+# feature_cache) y cortes de discretización (np.digitize)
+COVARIABLES_MARKOV = {
+    'dias_monitoreados': [5, 7],          # <5, 5-6, 7 días
+    'flag_baja_cobertura': [1],           # 0 / 1
+    'pct_imputada_FC_walk': [20, 50],     # <20%, 20-50%, ≥50%
+}
 
 
 def log(msg: str) -> None:
@@ -112,69 +142,85 @@ class MatrizTransicion:
     probs: np.ndarray   # 3x3 probabilidades (filas normalizadas)
 
 
-def estimar_matriz_transicion(estado_idxs_ordenados: List[int]) -> MatrizTransicion:
-    counts = np.zeros((3, 3), dtype=int)
-    estados = [e for e in estado_idxs_ordenados if e in (0, 1, 2)]
-
-    for i in range(len(estados) - 1):
-        a = estados[i]
-        b = estados[i + 1]
-        counts[a, b] += 1
-
-    probs = counts.astype(float)
-    for i in range(3):
-        fila_sum = probs[i, :].sum()
-        if fila_sum > 0:
-            probs[i, :] /= fila_sum
-        else:
-            # si no hay transiciones observadas desde i, asumir alta persistencia
-            probs[i, i] = 1.0
-
-    return MatrizTransicion(counts=counts, probs=probs)
-
-
-def matriz_transicion_global(df: pd.DataFrame) -> MatrizTransicion:
-    counts_global = np.zeros((3, 3), dtype=int)
-
-    for _, df_u in df.groupby('usuario_id'):
-        df_u = df_u.sort_values('semana_inicio')
-        estados = df_u['estado_idx'].astype(int).tolist()
-        mt_u = estimar_matriz_transicion(estados)
-        counts_global += mt_u.counts
-
-    probs_global = counts_global.astype(float)
-    for i in range(3):
-        s = probs_global[i, :].sum()
-        if s > 0:
-            probs_global[i, :] /= s
-        else:
-            probs_global[i, i] = 1.0
-
-    return MatrizTransicion(counts=counts_global, probs=probs_global)
-
-
-def matrices_transicion_por_usuario(df: pd.DataFrame) -> Dict[str, MatrizTransicion]:
-    result: Dict[str, MatrizTransicion] = {}
-    for user_id, df_u in df.groupby('usuario_id'):
-        df_u = df_u.sort_values('semana_inicio')
-        estados = df_u['estado_idx'].astype(int).tolist()
-        result[user_id] = estimar_matriz_transicion(estados)
-    return result
-
-
-def matriz_potencia(P: np.ndarray, h: int) -> np.ndarray:
-    if h <= 1:
-        return P.copy()
-    M = np.eye(P.shape[0])
-    A = P.copy()
-    e = h
-    # exponenciación binaria
-    while e > 0:
-        if e % 2 == 1:
-            M = M @ A
-        A = A @ A
-        e //= 2
-    return M
+N_ESTADOS = len(ESTADO_TO_IDX)
+ETIQUETAS = np.array([IDX_TO_ESTADO[i] for i in range(N_ESTADOS)], dtype=object)
+
+
+def secuencias_ordenadas(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Semanas con estado válido ordenadas por (usuario_id, semana_inicio).
+
+    Returns:
+        (usuarios únicos ordenados, código de usuario por semana, estado por
+        semana, posición en df de cada semana)
+    """
+    codigo_fila, usuarios = pd.factorize(df['usuario_id'], sort=True)
+    orden = np.lexsort((df['semana_inicio'].to_numpy(), codigo_fila))
+    estados = df['estado_idx'].to_numpy().astype(int)[orden]
+    validos = (estados >= 0) & (estados < N_ESTADOS)
+    orden, estados = orden[validos], estados[validos]
+    return np.asarray(usuarios), codigo_fila[orden], estados, orden
+
+
+def codificar_transiciones(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pares (estado_t, estado_t+1) consecutivos de cada usuario, como arrays.
+
+    Las semanas se ordenan por (usuario_id, semana_inicio); los pares salen
+    de comparar el array de estados con su versión desplazada una posición,
+    conservando sólo los que pertenecen al mismo usuario.
+
+    Returns:
+        (usuarios únicos ordenados, código de usuario por par, estado_t,
+        estado_t+1, posición en df de la semana t)
+    """
+    usuarios, codigo, estados, orden = secuencias_ordenadas(df)
+    mismo_usuario = codigo[1:] == codigo[:-1]
+    return (usuarios, codigo[:-1][mismo_usuario], estados[:-1][mismo_usuario],
+            estados[1:][mismo_usuario], orden[:-1][mismo_usuario])
+
+
+def hash_historia(df: pd.DataFrame, usuarios: np.ndarray, ultima_semana: np.ndarray) -> np.ndarray:
+    """
+    Hash por usuario de sus semanas (usuario_id, semana_inicio, estado_idx)
+    hasta la última semana registrada, independiente del orden de filas.
+    """
+    ultima = pd.Series(pd.to_datetime(ultima_semana), index=usuarios)
+    incluidas = df[df['semana_inicio'] <= df['usuario_id'].map(ultima)]
+    codigo = pd.Index(usuarios).get_indexer(incluidas['usuario_id'])
+    filas = pd.util.hash_pandas_object(
+        incluidas[['usuario_id', 'semana_inicio', 'estado_idx']], index=False).to_numpy()
+    hashes = np.zeros(len(usuarios), dtype=np.uint64)
+    np.add.at(hashes, codigo, filas)
+    return hashes
+
+
+def construir_store(df: pd.DataFrame, th: Thresholds, olvido: float = 1.0) -> MarkovStore:
+    """Almacén de conteos desde la historia completa (vectorizado)"""
+    usuarios, codigo, estado_t, estado_t1, _ = codificar_transiciones(df)
+    ultima = df.sort_values(['usuario_id', 'semana_inicio'], kind='stable') \
+        .groupby('usuario_id').tail(1).set_index('usuario_id').reindex(usuarios)
+    store = MarkovStore.desde_transiciones(
+        usuarios, codigo, estado_t, estado_t1,
+        ultimo_estado=ultima['estado_idx'].to_numpy(),
+        ultima_semana=ultima['semana_inicio'].to_numpy(),
+        olvido=olvido, umbrales=th.to_tuple())
+    store.hash_historia = hash_historia(df, store.usuarios, store.ultima_semana)
+    return store
+
+
+def actualizar_store(store: MarkovStore, df: pd.DataFrame) -> int:
+    """Agrega al almacén las semanas posteriores a la última registrada de cada usuario"""
+    ultima = pd.Series(store.ultima_semana, index=store.usuarios)
+    previa = pd.to_datetime(df['usuario_id'].map(ultima))
+    nuevas = df[previa.isna() | (df['semana_inicio'] > previa)] \
+        .sort_values(['usuario_id', 'semana_inicio'], kind='stable')
+    n = 0
+    for user_id, semana, estado in zip(nuevas['usuario_id'], nuevas['semana_inicio'],
+                                       nuevas['estado_idx']):
+        n += store.actualizar(user_id, semana, int(estado))
+    store.hash_historia = hash_historia(df, store.usuarios, store.ultima_semana)
+    return n
 
 
 # ======================================================================================
@@ -196,63 +242,90 @@ def predecir_siguiente_estado(P: np.ndarray, estado_actual: int) -> Tuple[int, n
 
 
 def evaluar_backtest_un_paso(df: pd.DataFrame, P: np.ndarray) -> Tuple[pd.DataFrame, float]:
-    registros: List[Dict] = []
-
-    for user_id, df_u in df.groupby('usuario_id'):
-        df_u = df_u.sort_values('semana_inicio').reset_index(drop=True)
-        estados = df_u['estado_idx'].astype(int).tolist()
-        fechas = pd.to_datetime(df_u['semana_inicio'])
-
-        for i in range(len(estados) - 1):
-            estado_t = estados[i]
-            estado_t1_real = estados[i + 1]
-            estado_t1_pred, _ = predecir_siguiente_estado(P, estado_t)
-            registros.append({
-                'usuario_id': user_id,
-                'semana_inicio_t': fechas.iloc[i].date(),
-                'estado_t': estado_t,
-                'estado_t_label': IDX_TO_ESTADO[estado_t],
-                'estado_t1_real': estado_t1_real,
-                'estado_t1_real_label': IDX_TO_ESTADO[estado_t1_real],
-                'estado_t1_pred': estado_t1_pred,
-                'estado_t1_pred_label': IDX_TO_ESTADO[estado_t1_pred],
-                'acierto': int(estado_t1_pred == estado_t1_real),
-            })
-
-    df_bt = pd.DataFrame(registros)
+    usuarios, codigo, estado_t, estado_t1_real, pos_t = codificar_transiciones(df)
+
+    # Predicción 1-paso de todas las transiciones con un solo gather
+    estado_t1_pred = np.argmax(P, axis=1)[estado_t]
+    fechas = pd.to_datetime(df['semana_inicio'].to_numpy()[pos_t])
+
+    df_bt = pd.DataFrame({
+        'usuario_id': usuarios[codigo],
+        'semana_inicio_t': fechas.date,
+        'estado_t': estado_t,
+        'estado_t_label': ETIQUETAS[estado_t],
+        'estado_t1_real': estado_t1_real,
+        'estado_t1_real_label': ETIQUETAS[estado_t1_real],
+        'estado_t1_pred': estado_t1_pred,
+        'estado_t1_pred_label': ETIQUETAS[estado_t1_pred],
+        'acierto': (estado_t1_pred == estado_t1_real).astype(int),
+    })
     acc = float(df_bt['acierto'].mean()) if not df_bt.empty else float('nan')
     return df_bt, acc
 
 
-def predecir_proxima_semana_por_usuario(df: pd.DataFrame, P: np.ndarray, horizon_weeks: int = 1) -> pd.DataFrame:
-    filas: List[Dict] = []
-
-    for user_id, df_u in df.groupby('usuario_id'):
-        df_u = df_u.sort_values('semana_inicio')
-        if df_u.empty:
-            continue
-        last_row = df_u.iloc[-1]
-        estado_actual = int(last_row['estado_idx'])
-        fecha_ultima = pd.to_datetime(last_row['semana_inicio'])
-
-        P_h = matriz_potencia(P, horizon_weeks)
-        pred_idx, probs = predecir_siguiente_estado(P_h, estado_actual)
-
-        filas.append({
-            'usuario_id': user_id,
-            'semana_ultima_observada': fecha_ultima.date(),
-            'estado_actual_idx': estado_actual,
-            'estado_actual_label': IDX_TO_ESTADO[estado_actual],
-            'horizonte_semanas': horizon_weeks,
-            'semana_predicha_inicio': (fecha_ultima + timedelta(days=7 * horizon_weeks)).date(),
-            'estado_predicho_idx': int(pred_idx),
-            'estado_predicho_label': IDX_TO_ESTADO[int(pred_idx)],
-            'prob_verde': float(probs[0]),
-            'prob_amarillo': float(probs[1]),
-            'prob_rojo': float(probs[2]),
-        })
-
-    return pd.DataFrame(filas)
+def predecir_horizontes_por_usuario(store: MarkovStore, horizontes: List[int]) -> pd.DataFrame:
+    """
+    Estado predicho de cada usuario a cada horizonte (una fila por usuario y
+    horizonte), con un solo gather sobre la tabla cacheada P^1..P^H.
+    """
+    horizontes = np.asarray(horizontes, dtype=int)
+    tabla = store.tabla_potencias(int(horizontes.max()))[horizontes - 1]  # (n_h, 3, 3)
+
+    orden = np.argsort(store.usuarios, kind='stable')
+    estado_actual = store.ultimo_estado[orden].astype(int)
+    probs = tabla[:, estado_actual].transpose(1, 0, 2).reshape(-1, tabla.shape[-1])
+    pred_idx = np.argmax(probs, axis=1)
+
+    n_h = len(horizontes)
+    fecha_ultima = pd.to_datetime(np.repeat(store.ultima_semana[orden], n_h))
+    horizonte = np.tile(horizontes, len(orden))
+    estado_rep = np.repeat(estado_actual, n_h)
+
+    return pd.DataFrame({
+        'usuario_id': np.repeat(store.usuarios[orden], n_h).astype(object),
+        'semana_ultima_observada': fecha_ultima.date,
+        'estado_actual_idx': estado_rep,
+        'estado_actual_label': ETIQUETAS[estado_rep],
+        'horizonte_semanas': horizonte,
+        'semana_predicha_inicio': (fecha_ultima + pd.to_timedelta(7 * horizonte, unit='D')).date,
+        'estado_predicho_idx': pred_idx,
+        'estado_predicho_label': ETIQUETAS[pred_idx],
+        'prob_verde': probs[:, 0],
+        'prob_amarillo': probs[:, 1],
+        'prob_rojo': probs[:, 2],
+    })
+
+
+def predecir_proxima_semana_por_usuario(store: MarkovStore, horizon_weeks: int = 1) -> pd.DataFrame:
+    """Estado a horizon_weeks semanas desde el último estado de cada usuario"""
+    return predecir_horizontes_por_usuario(store, [horizon_weeks])
+
+
+def niveles_covariable(df: pd.DataFrame, nombre: str) -> np.ndarray:
+    """
+    Nivel discretizado de una covariable de cobertura para cada fila de df,
+    tomada del índice de feature_cache por (usuario_id, semana_inicio).
+    Semanas sin dato quedan en un nivel propio.
+    """
+    index, _ = load_features()
+    cov = index[['usuario_id', 'semana_inicio', nombre]].copy()
+    cov['semana_inicio'] = pd.to_datetime(cov['semana_inicio'], errors='coerce')
+    valores = df[['usuario_id', 'semana_inicio']].merge(
+        cov, on=['usuario_id', 'semana_inicio'], how='left')[nombre]
+    return discretizar(valores.to_numpy(dtype=float), COVARIABLES_MARKOV[nombre])
+
+
+def evaluar_orden_k(df: pd.DataFrame, orden_max: int, covariables: List[str],
+                    modo: str = 'louo') -> pd.DataFrame:
+    """
+    Grilla de órdenes 1..orden_max, sin covariable y con cada covariable
+    pedida, con el backtest 1-paso vectorizado de markov_high_order.
+    """
+    _, codigo, estados, orden = secuencias_ordenadas(df)
+    niveles = {'': None}
+    for nombre in covariables:
+        niveles[nombre] = niveles_covariable(df, nombre)[orden]
+    return buscar_orden(codigo, estados, niveles, ordenes=range(1, orden_max + 1), modo=modo)
 
 
 # ======================================================================================
@@ -267,6 +340,12 @@ def main() -> None:
     parser.add_argument('--green-max', type=float, default=0.3333, help='Umbral superior verde (cuando threshold-mode=fixed)')
     parser.add_argument('--red-min', type=float, default=0.6667, help='Umbral inferior rojo (cuando threshold-mode=fixed)')
     parser.add_argument('--horizon', type=int, default=1, help='Horizonte de predicción en semanas (para próxima semana por usuario)')
+    parser.add_argument('--horizontes', type=int, default=12, help='Tabla multi-horizonte por usuario: semanas 1..H (0 = no generar)')
+    parser.add_argument('--olvido', type=float, default=1.0, help='Factor de olvido exponencial por semana de los conteos (1 = sin olvido)')
+    parser.add_argument('--incremental', action='store_true', help='Reutilizar markov_store.npz y agregar sólo las semanas nuevas (con global_terciles casi siempre reconstruye: los umbrales se mueven)')
+    parser.add_argument('--orden-max', type=int, default=1, choices=range(1, ORDEN_MAX + 1), help='Comparar cadenas de orden 1..K por backtest (1 = sólo primer orden)')
+    parser.add_argument('--covariables', nargs='*', default=[], choices=list(COVARIABLES_MARKOV), help='Covariables de cobertura para la grilla de orden k')
+    parser.add_argument('--modo-orden', type=str, choices=['louo', 'insample'], default='louo', help='Backtest de la grilla: leave-one-user-out o in-sample')
 
     args = parser.parse_args()
 
@@ -323,7 +402,26 @@ def main() -> None:
     # ----------------------------------------------------------------------------------
     # 3) MATRIZ DE TRANSICIÓN (GLOBAL y POR USUARIO)
     # ----------------------------------------------------------------------------------
-    mt_global = matriz_transicion_global(df)
+    store_path = out_dir / STORE_FILE
+    store = MarkovStore.cargar(store_path) if args.incremental else None
+    if store is not None and (store.umbrales != th.to_tuple() or store.olvido != args.olvido):
+        log('⚠️  Almacén de transiciones con otros umbrales u olvido; se reconstruye')
+        if args.threshold_mode == 'global_terciles':
+            log('   (los terciles globales cambian con cada semana nueva; use --threshold-mode fixed para actualizar en forma incremental)')
+        store = None
+    elif store is not None and (store.hash_historia is None or not np.array_equal(
+            store.hash_historia, hash_historia(df, store.usuarios, store.ultima_semana))):
+        log('⚠️  Cambiaron semanas ya incorporadas al almacén de transiciones; se reconstruye')
+        store = None
+    if store is None:
+        store = construir_store(df, th, olvido=args.olvido)
+        log(f'✅ Almacén de transiciones construido: {len(store.usuarios)} usuarios (olvido={store.olvido:g})')
+    else:
+        n_nuevas = actualizar_store(store, df)
+        log(f'✅ Almacén de transiciones actualizado: {n_nuevas} semanas nuevas')
+    store.guardar(store_path)
+
+    mt_global = MatrizTransicion(counts=store.conteos(), probs=store.matriz())
 
     # Guardar matrices globales
     trans_counts_path = out_dir / 'matriz_transicion_global.csv'
@@ -338,14 +436,17 @@ def main() -> None:
     log(f'✅ Guardada matriz de transición global (probs): {trans_probs_path.name}')
 
     # Por usuario
-    mt_por_usuario = matrices_transicion_por_usuario(df)
+    mt_por_usuario = {user_id: MatrizTransicion(counts=store.conteos(user_id), probs=store.matriz(user_id))
+                      for user_id in sorted(store.usuarios)}
     filas_mt_u: List[Dict] = []
     for user_id, mt in mt_por_usuario.items():
         fila = {'usuario_id': user_id}
         # aplanar conteos y probs con etiquetas legibles
         for i in range(3):
             for j in range(3):
-                fila[f'count_{IDX_TO_ESTADO[i]}_to_{IDX_TO_ESTADO[j]}'] = int(mt.counts[i, j])
+                # con olvido los conteos son fraccionarios: no truncar a int
+                conteo = mt.counts[i, j]
+                fila[f'count_{IDX_TO_ESTADO[i]}_to_{IDX_TO_ESTADO[j]}'] = int(conteo) if store.olvido >= 1.0 else float(conteo)
                 fila[f'prob_{IDX_TO_ESTADO[i]}_to_{IDX_TO_ESTADO[j]}'] = float(mt.probs[i, j])
         filas_mt_u.append(fila)
 
@@ -364,14 +465,31 @@ def main() -> None:
     log(f'✅ Guardado backtest 1-paso ({n_pred} transiciones): {bt_out.name}')
     log(f'🎯 Precisión 1-paso (global): {acc:.3f}' if n_pred > 0 else '⚠️  Sin transiciones suficientes para backtest')
 
+    # ----------------------------------------------------------------------------------
+    # 4B) ORDEN SUPERIOR Y COVARIABLES (grilla de backtest)
+    # ----------------------------------------------------------------------------------
+    if args.orden_max > 1 or args.covariables:
+        df_grid = evaluar_orden_k(df, int(args.orden_max), args.covariables, modo=args.modo_orden)
+        grid_out = out_dir / 'markov_orden_k_grid.csv'
+        df_grid.to_csv(grid_out, index=False)
+        mejor = df_grid.loc[df_grid['accuracy'].idxmax()]
+        log(f'✅ Guardada grilla de orden k ({len(df_grid)} configuraciones, {args.modo_orden}): {grid_out.name}')
+        log(f"🎯 Mejor: orden {int(mejor['orden'])}, covariable {mejor['covariable']} → precisión {mejor['accuracy']:.3f}")
+
     # ----------------------------------------------------------------------------------
     # 5) PREDICCIÓN PRÓXIMA SEMANA POR USUARIO
     # ----------------------------------------------------------------------------------
-    df_next = predecir_proxima_semana_por_usuario(df, mt_global.probs, horizon_weeks=int(args.horizon))
+    df_next = predecir_proxima_semana_por_usuario(store, horizon_weeks=int(args.horizon))
     next_out = out_dir / 'prediccion_proxima_semana_por_usuario.csv'
     df_next.to_csv(next_out, index=False)
     log(f'✅ Guardado: {next_out.name}')
 
+    if args.horizontes > 0:
+        df_multi = predecir_horizontes_por_usuario(store, list(range(1, int(args.horizontes) + 1)))
+        multi_out = out_dir / 'prediccion_multihorizonte_por_usuario.csv'
+        df_multi.to_csv(multi_out, index=False)
+        log(f'✅ Guardado: {multi_out.name} (horizontes 1..{args.horizontes})')
+
     # ----------------------------------------------------------------------------------
     # 6) RESUMEN EN REPORTE
     # ----------------------------------------------------------------------------------
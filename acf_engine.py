@@ -0,0 +1,144 @@
+"""
+acf_engine.py
+ACF / PACF por Lotes con FFT (columnas con NaN enmascarados)
+
+05_missingness_y_acf.py calculaba la autocorrelación con
+Series.autocorr(lag) una vez por lag, variable y usuario, y volvía a
+calcularla (statsmodels) para los gráficos. Aquí todas las sumas por lag de
+todas las columnas de una matriz (n_semanas × n_variables) salen de unas
+pocas FFT sobre la matriz con relleno de ceros (longitud ≥ 2n - 1, sin
+correlación circular):
+
+    Σ_t a_t · b_(t+k)  para k = 0..max_lag
+
+Los NaN se enmascaran: el valor se pone en 0 y cada suma se normaliza con
+la cantidad de pares (t, t+k) observados, también calculada por FFT sobre
+la máscara. Dos definiciones:
+
+    - 'pearson': correlación de Pearson entre x_t y x_(t+k) sobre los pares
+      observados (medias y desviaciones de cada segmento); sin NaN coincide
+      con pandas.Series.autocorr(lag).
+    - 'estandar': ACF clásica (media global, autocovarianza dividida por n),
+      la de statsmodels.tsa.stattools.acf; sin NaN coincide con ella.
+
+La PACF se obtiene de la ACF estándar con la recursión de Durbin-Levinson
+(equivalente a statsmodels pacf(method='ywm')), vectorizada sobre columnas.
+
+Uso:
+    from acf_engine import acf_lote, pacf_durbin_levinson
+    rho = acf_lote(X, max_lag=20)                  # (21 × n_variables)
+    phi = pacf_durbin_levinson(rho)
+"""
+
+import numpy as np
+from scipy import fft as sp_fft
+
+Z_95 = 1.959963984540054
+
+
+def _correlaciones_fft(pares, n, max_lag):
+    """
+    Sumas Σ_t a_t · b_(t+k), k = 0..max_lag, para cada par (a, b) de
+    matrices (n × v), reutilizando la FFT de cada matriz.
+
+    Returns:
+        lista de arrays (max_lag+1 × v), uno por par
+    """
+    nfft = sp_fft.next_fast_len(2 * n - 1, real=True)
+    transformadas = {}
+
+    def espectro(a):
+        clave = id(a)
+        if clave not in transformadas:
+            transformadas[clave] = sp_fft.rfft(a, n=nfft, axis=0)
+        return transformadas[clave]
+
+    return [sp_fft.irfft(np.conj(espectro(a)) * espectro(b), n=nfft, axis=0)[:max_lag + 1]
+            for a, b in pares]
+
+
+def acf_lote(X, max_lag, metodo='estandar'):
+    """
+    Autocorrelación de cada columna de X para los lags 0..max_lag.
+
+    Args:
+        X: matriz (n_semanas × n_variables) en orden temporal; NaN = semana
+            sin dato (se enmascara, no se interpola ni se elimina)
+        max_lag: último lag (se acota a n - 1)
+        metodo: 'estandar' (ACF clásica) o 'pearson' (como Series.autocorr)
+
+    Returns:
+        array (max_lag+1 × n_variables); NaN donde hay menos de dos pares
+        observados o varianza nula
+    """
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+    n = len(X)
+    max_lag = min(max_lag, n - 1)
+    m = ~np.isnan(X)
+    n_obs = m.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.where(n_obs > 0, np.nansum(X, axis=0) / n_obs, 0.0)
+    # Centrar antes de sumar productos reduce la cancelación numérica
+    xc = np.where(m, X - media, 0.0)
+    mf = m.astype(float)
+
+    if metodo == 'estandar':
+        (gamma,) = _correlaciones_fft([(xc, xc)], n, max_lag)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rho = gamma / gamma[0]
+    elif metodo == 'pearson':
+        xc2 = xc ** 2
+        N, Sa, Sb, Saa, Sbb, Sab = _correlaciones_fft(
+            [(mf, mf), (xc, mf), (mf, xc), (xc2, mf), (mf, xc2), (xc, xc)], n, max_lag)
+        N = np.rint(N)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rho = (N * Sab - Sa * Sb) / np.sqrt((N * Saa - Sa ** 2) * (N * Sbb - Sb ** 2))
+        rho[N < 2] = np.nan
+    else:
+        raise ValueError(f"Método de ACF no válido: {metodo}")
+
+    return rho
+
+
+def pacf_durbin_levinson(rho):
+    """
+    PACF desde la ACF (lags 0..L en filas, una columna por serie) con la
+    recursión de Durbin-Levinson.
+
+    Returns:
+        array del mismo tamaño; fila 0 = 1
+    """
+    rho = np.asarray(rho, dtype=float)
+    if rho.ndim == 1:
+        return pacf_durbin_levinson(rho[:, None])[:, 0]
+    L, v = rho.shape[0] - 1, rho.shape[1]
+    pacf = np.ones_like(rho)
+    phi = np.zeros((v, L + 1))  # coeficientes φ_(k, j), j = 1..k
+    varianza = np.ones(v)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for k in range(1, L + 1):
+            previos = phi[:, 1:k]
+            phi_kk = (rho[k] - np.einsum('vj,jv->v', previos, rho[k - 1:0:-1])) / varianza
+            phi[:, 1:k] = previos - phi_kk[:, None] * previos[:, ::-1]
+            phi[:, k] = phi_kk
+            varianza = varianza * (1 - phi_kk ** 2)
+            pacf[k] = phi_kk
+    return pacf
+
+
+def bandas_confianza(rho, n_obs, tipo='acf'):
+    """
+    Semiancho del intervalo del 95% por lag (fila 0 = 0): Bartlett para la
+    ACF, 1.96/√n para la PACF (mismas bandas que statsmodels).
+    """
+    rho = np.asarray(rho, dtype=float)
+    n_obs = np.asarray(n_obs, dtype=float)
+    varianza = np.ones_like(rho) / n_obs
+    varianza[0] = 0.0
+    if tipo == 'acf':
+        varianza[2:] *= 1 + 2 * np.cumsum(rho[1:-1] ** 2, axis=0)
+    elif tipo != 'pacf':
+        raise ValueError(f"Tipo de banda no válido: {tipo}")
+    return Z_95 * np.sqrt(varianza)
@@ -18,6 +18,7 @@ SALIDAS:
 - analisis_u/semanal/weekly_consolidado.csv
 - analisis_u/semanal/cluster_inputs_weekly.csv
 - 04_agregacion_semanal_log.txt
+(cada tabla también en .parquet si está pyarrow; ver data_store.py)
 
 METODOLOGÍA:
 ------------
@@ -26,18 +27,44 @@ METODOLOGÍA:
 - ac1: autocorrelación lag-1 intra-semana (si count_dias>=5)
 - Calidad: %imputada_FC_walk desde auditoría cuando existe
 
+USO:
+----
+    python agregacion_semanal_v1.py              # secuencial
+    python agregacion_semanal_v1.py --workers 4  # usuarios en paralelo
+    python agregacion_semanal_v1.py --incremental  # sólo semanas con cambios
+
+MODO INCREMENTAL:
+-----------------
+Cada usuario guarda en weekly_u{N}_estado.json la última semana agregada, un
+hash del contenido de las filas diarias de cada semana y, para el CSV diario
+y el de auditoría (ordenados por Fecha), los bytes ya leídos, el byte donde
+empieza la última semana (abierta) y una huella (encabezado + últimos bytes
+leídos). Con --incremental, si el tamaño no bajó y la huella coincide, se
+lee sólo desde la semana abierta hasta el final: el costo es O(días nuevos).
+Si la parte ya leída cambió, se lee todo y sólo se re-agregan las semanas
+cuyo hash cambió (o que son nuevas). En ambos casos las semanas re-agregadas
+se insertan en el weekly_u{N}.csv existente.
+
 Autor: Pipeline automatizado
 Fecha: 2025-10-16
 """
 
+import argparse
+import hashlib
+import io
+import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 import pandas as pd
 import numpy as np
 import warnings
 from datetime import datetime
 
+from data_store import OPCIONES_CSV, read_table, table_exists, write_table
+
 warnings.filterwarnings('ignore')
 
 # ==============================================================================
@@ -71,8 +98,14 @@ USER_MAP = {
 MIN_DIAS_AC1 = 5
 MIN_DIAS_COBERTURA = 3  # Flag si <3 días en semana
 
+# Bytes finales de la parte ya leída de cada CSV que entran en su huella
+VENTANA_HUELLA = 4096
+
 # Log global
 LOG_LINES = []
+# En los procesos del pool el log no se imprime: se devuelve al proceso
+# principal, que lo re-emite en orden de usuario
+ECHO_CONSOLA = True
 
 # ==============================================================================
 # FUNCIONES UTILITARIAS
@@ -82,82 +115,94 @@ LOG_LINES = []
 def log(msg):
     """Registra mensaje en log y consola"""
     LOG_LINES.append(msg)
-    print(msg)
+    if ECHO_CONSOLA:
+        print(msg)
 
 
-def calculate_ac1(series):
+def aggregate_variables_vectorized(codigos, n_semanas, df):
     """
-    Calcula autocorrelación lag-1 para una serie temporal.
-    Requiere al menos 2 valores no-NaN.
-    """
-    s = pd.to_numeric(series, errors='coerce').dropna()
-    if len(s) < 2:
-        return np.nan
-    try:
-        return s.autocorr(lag=1)
-    except:
-        return np.nan
+    Métricas semanales (_count, _mean, _p25, _p50, _p75, _iqr, _std, _cv,
+    _ac1) de todas las VARIABLES para todas las semanas a la vez. CV = NaN
+    si |media| ≤ 1e-8; AC1 sólo con al menos MIN_DIAS_AC1 días válidos.
 
+    Las semanas se agrupan por número de valores válidos n; cada grupo forma
+    una matriz (semanas x n) sobre la que se aplican las mismas reducciones de
+    numpy que pandas usa en Series.mean/quantile/std/autocorr por semana
+    (sum, percentile, corrcoef), por lo que el resultado es idéntico al del
+    cálculo semana a semana.
 
-def aggregate_variable_metrics(group, var_name):
-    """
-    Calcula métricas de agregación para una variable en un grupo (semana).
+    Args:
+        codigos: índice de semana (0..n_semanas-1) por fila de df, no decreciente
+        n_semanas: número de semanas
+        df: DataFrame diario ordenado por Fecha
 
     Returns:
-        dict con sufijos: _count, _mean, _p25, _p50, _p75, _iqr, _std, _cv, _ac1
+        dict columna -> array de longitud n_semanas
     """
-    s = pd.to_numeric(group[var_name], errors='coerce').dropna()
-
-    n = len(s)
-    prefix = var_name
-
-    if n == 0:
-        return {
-            f'{prefix}_count': 0,
-            f'{prefix}_mean': np.nan,
-            f'{prefix}_p25': np.nan,
-            f'{prefix}_p50': np.nan,
-            f'{prefix}_p75': np.nan,
-            f'{prefix}_iqr': np.nan,
-            f'{prefix}_std': np.nan,
-            f'{prefix}_cv': np.nan,
-            f'{prefix}_ac1': np.nan
-        }
-
-    mean = s.mean()
-    p25, p50, p75 = s.quantile([0.25, 0.50, 0.75]).values
-    iqr = p75 - p25
-    std = s.std(ddof=1) if n > 1 else 0.0
-
-    # CV protegido
-    cv = std / abs(mean) if abs(mean) > 1e-8 else np.nan
-
-    # AC1: solo si tenemos suficientes días
-    ac1 = calculate_ac1(group[var_name]) if n >= MIN_DIAS_AC1 else np.nan
-
-    return {
-        f'{prefix}_count': n,
-        f'{prefix}_mean': mean,
-        f'{prefix}_p25': p25,
-        f'{prefix}_p50': p50,
-        f'{prefix}_p75': p75,
-        f'{prefix}_iqr': iqr,
-        f'{prefix}_std': std,
-        f'{prefix}_cv': cv,
-        f'{prefix}_ac1': ac1
-    }
-
-
-def aggregate_weekly(df, audit_df=None):
+    columnas = {}
+
+    for var in VARIABLES:
+        if var not in df.columns:
+            continue
+
+        x = pd.to_numeric(df[var], errors='coerce').to_numpy(dtype=float)
+        validos = ~np.isnan(x)
+        x = x[validos]
+        count = np.bincount(codigos[validos], minlength=n_semanas)
+        inicio = np.cumsum(count) - count
+
+        metricas = {m: np.full(n_semanas, np.nan)
+                    for m in ['mean', 'p25', 'p50', 'p75', 'iqr', 'std', 'cv', 'ac1']}
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for n in np.unique(count[count > 0]):
+                semanas = np.flatnonzero(count == n)
+                mat = x[inicio[semanas][:, None] + np.arange(n)]
+
+                mean = mat.sum(axis=1) / n
+                p25, p50, p75 = np.percentile(mat, [25, 50, 75], axis=1)
+                if n > 1:
+                    std = np.sqrt(((mean[:, None] - mat) ** 2).sum(axis=1) / (n - 1))
+                else:
+                    std = np.zeros(len(semanas))
+
+                metricas['mean'][semanas] = mean
+                metricas['p25'][semanas] = p25
+                metricas['p50'][semanas] = p50
+                metricas['p75'][semanas] = p75
+                metricas['iqr'][semanas] = p75 - p25
+                metricas['std'][semanas] = std
+                # CV protegido
+                metricas['cv'][semanas] = np.where(
+                    np.abs(mean) > 1e-8, std / np.abs(mean), np.nan)
+
+                # AC1 lag-1 (mismos pasos que np.corrcoef sobre s[1:], s[:-1])
+                if n >= MIN_DIAS_AC1:
+                    X = np.stack([mat[:, 1:], mat[:, :-1]], axis=1)
+                    X = X - X.mean(axis=2, keepdims=True)
+                    c = np.matmul(X, X.transpose(0, 2, 1)) * (1.0 / (n - 2))
+                    desv = np.sqrt(np.stack([c[:, 0, 0], c[:, 1, 1]], axis=1))
+                    metricas['ac1'][semanas] = np.clip(
+                        c[:, 0, 1] / desv[:, 0] / desv[:, 1], -1, 1)
+
+        columnas[f'{var}_count'] = count
+        for m, valores in metricas.items():
+            columnas[f'{var}_{m}'] = valores
+
+    return columnas
+
+
+def prepare_daily(df, audit_df=None):
     """
-    Agrega dataframe diario por semana (Lun-Dom).
+    Prepara el DataFrame diario para la agregación: Fecha como datetime,
+    orden cronológico, periodo semanal (Lun-Dom) y fuente de FC_walk.
 
     Args:
         df: DataFrame diario con variables
         audit_df: DataFrame de auditoría (opcional) para calidad FC_walk
 
     Returns:
-        DataFrame semanal agregado
+        DataFrame diario ordenado con columnas 'semana' y 'FC_walk_fuente'
     """
     # Asegurar Fecha como datetime
     df = df.copy()
@@ -165,9 +210,6 @@ def aggregate_weekly(df, audit_df=None):
     df = df.dropna(subset=['Fecha']).sort_values(
         'Fecha').reset_index(drop=True)
 
-    if len(df) == 0:
-        return pd.DataFrame()
-
     # Crear periodo semanal (Lun-Dom)
     df['semana'] = df['Fecha'].dt.to_period('W-MON')
 
@@ -181,46 +223,165 @@ def aggregate_weekly(df, audit_df=None):
     else:
         df['FC_walk_fuente'] = np.nan
 
-    # Agregar por semana
-    weekly_data = []
-
-    for semana, group in df.groupby('semana'):
-        n_dias = len(group)
-
-        # Inicio de semana (lunes)
-        semana_inicio = semana.start_time.date()
-
-        # Métricas por variable
-        row = {
-            'semana_inicio': semana_inicio,
-            'dias_monitoreados': n_dias,
-            'flag_baja_cobertura': 1 if n_dias < MIN_DIAS_COBERTURA else 0
-        }
-
-        # Agregar cada variable
-        for var in VARIABLES:
-            if var in group.columns:
-                metrics = aggregate_variable_metrics(group, var)
-                row.update(metrics)
-
-        # Calidad de imputación FC_walk
-        if 'FC_walk_fuente' in group.columns and group['FC_walk_fuente'].notna().any():
-            total_fuente = group['FC_walk_fuente'].notna().sum()
-            imputada = (group['FC_walk_fuente'] != 'observada').sum()
-            row['pct_imputada_FC_walk'] = (
-                imputada / total_fuente * 100) if total_fuente > 0 else np.nan
-        else:
-            row['pct_imputada_FC_walk'] = np.nan
+    return df
 
-        weekly_data.append(row)
 
-    return pd.DataFrame(weekly_data)
+def hash_weeks(df):
+    """
+    Hash del contenido de las filas diarias de cada semana (las columnas que
+    intervienen en la agregación).
 
+    Args:
+        df: DataFrame diario preparado con prepare_daily
 
-def process_user(u_id):
+    Returns:
+        dict semana_inicio ('YYYY-MM-DD') -> hash hex
+    """
+    if len(df) == 0:
+        return {}
+
+    variables = [v for v in VARIABLES if v in df.columns]
+    cols = ['Fecha'] + variables + ['FC_walk_fuente']
+    # Variables como float (como en la agregación): el hash no depende de si
+    # la lectura infirió int o float
+    datos = df[cols].assign(**{v: pd.to_numeric(df[v], errors='coerce').astype(float)
+                               for v in variables})
+    filas = pd.util.hash_pandas_object(datos, index=False).to_numpy()
+    semilla = ','.join(cols).encode()
+
+    codigos, semanas = pd.factorize(df['semana'], sort=True)
+    fin = np.cumsum(np.bincount(codigos))
+    inicio = np.concatenate([[0], fin[:-1]])
+
+    return {
+        semana: hashlib.blake2b(semilla + filas[i:j].tobytes(),
+                                digest_size=8).hexdigest()
+        for semana, i, j in zip(semanas.start_time.strftime('%Y-%m-%d'), inicio, fin)
+    }
+
+
+def aggregate_prepared(df):
+    """
+    Agrega por semana un DataFrame diario ya preparado con prepare_daily.
+
+    Returns:
+        DataFrame semanal agregado
+    """
+    if len(df) == 0:
+        return pd.DataFrame()
+
+    # Agregar por semana (df ya está ordenado por Fecha, así que los
+    # códigos de semana son no decrecientes)
+    codigos, semanas = pd.factorize(df['semana'], sort=True)
+    n_dias = np.bincount(codigos)
+
+    weekly = {
+        'semana_inicio': semanas.start_time.date,
+        'dias_monitoreados': n_dias,
+        'flag_baja_cobertura': (n_dias < MIN_DIAS_COBERTURA).astype(int)
+    }
+    weekly.update(aggregate_variables_vectorized(codigos, len(semanas), df))
+
+    # Calidad de imputación FC_walk (NaN cuenta como no observada, igual que
+    # en la versión por semana)
+    fuente = df['FC_walk_fuente']
+    total_fuente = np.bincount(codigos[fuente.notna().to_numpy()],
+                               minlength=len(semanas))
+    observada = np.bincount(codigos[(fuente == 'observada').to_numpy()],
+                            minlength=len(semanas))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weekly['pct_imputada_FC_walk'] = np.where(
+            total_fuente > 0, (n_dias - observada) / total_fuente * 100, np.nan)
+
+    return pd.DataFrame(weekly)
+
+
+def aggregate_weekly(df, audit_df=None):
+    """
+    Agrega dataframe diario por semana (Lun-Dom).
+
+    Args:
+        df: DataFrame diario con variables
+        audit_df: DataFrame de auditoría (opcional) para calidad FC_walk
+
+    Returns:
+        DataFrame semanal agregado
+    """
+    return aggregate_prepared(prepare_daily(df, audit_df))
+
+
+def derivar_delta(df):
+    """Agrega Delta_cardiaco (FC al caminar - FC reposo) si están sus columnas"""
+    if 'FC_al_caminar_promedio_diario' in df.columns and 'FCr_promedio_diario' in df.columns:
+        df['Delta_cardiaco'] = df['FC_al_caminar_promedio_diario'] - \
+            df['FCr_promedio_diario']
+        return True
+    return False
+
+
+def huella_csv(path, hasta):
+    """
+    Hash del encabezado y de los últimos VENTANA_HUELLA bytes ya leídos de un
+    CSV (hasta el byte `hasta`): detecta si la parte ya incorporada fue
+    re-escrita sin volver a leerla completa.
+    """
+    with open(path, 'rb') as f:
+        encabezado = f.readline()
+        desde = max(len(encabezado), hasta - VENTANA_HUELLA)
+        f.seek(desde)
+        cola = f.read(max(0, hasta - desde))
+    return hashlib.blake2b(encabezado + cola, digest_size=8).hexdigest()
+
+
+def leer_csv_desde(path, desde, usecols=None):
+    """Filas de un CSV a partir del byte `desde` (inicio de línea), con su encabezado"""
+    with open(path, 'rb') as f:
+        encabezado = f.readline()
+        f.seek(max(desde, len(encabezado)))
+        datos = f.read()
+    df = pd.read_csv(io.BytesIO(encabezado + datos), usecols=usecols, **OPCIONES_CSV)
+    return df, encabezado, datos
+
+
+def posicion_lectura(path, desde, semana_abierta):
+    """
+    Posición de lectura incremental de un CSV diario ordenado por Fecha.
+
+    Lee desde el byte `desde` (0 = archivo completo) y devuelve los bytes
+    leídos, el byte de la primera fila de semana_abierta (la semana se
+    vuelve a leer en la próxima corrida porque puede completarse) y la
+    huella del prefijo leído.
+
+    Returns:
+        dict, o None si el archivo no admite lectura por cola (fechas vacías
+        o desordenadas, o líneas que no corresponden una a una con filas)
+    """
+    df, encabezado, datos = leer_csv_desde(path, desde, usecols=['Fecha'])
+    inicio = max(desde, len(encabezado))
+    if datos and not datos.endswith(b'\n'):
+        return None
+    fechas = pd.to_datetime(df['Fecha'], errors='coerce')
+    saltos = np.flatnonzero(np.frombuffer(datos, dtype=np.uint8) == ord('\n'))
+    if len(saltos) != len(fechas) or fechas.isna().any() or not fechas.is_monotonic_increasing:
+        return None
+
+    inicios = inicio + np.concatenate([[0], saltos[:-1] + 1])
+    i = int(np.searchsorted(fechas.to_numpy(), np.datetime64(semana_abierta)))
+    total = inicio + len(datos)
+    return {'bytes': total,
+            'bytes_ventana': int(inicios[i]) if i < len(inicios) else total,
+            'huella': huella_csv(path, total)}
+
+
+def process_user(u_id, incremental=False):
     """
     Procesa un usuario: carga datos diarios, agrega semanalmente.
 
+    Con incremental=True y un estado previo (weekly_u{N}_estado.json) se leen
+    sólo las filas diarias agregadas desde la corrida anterior (más la semana
+    abierta), si la parte ya leída de los CSV no cambió; si cambió, se
+    re-agregan sólo las semanas cuyas filas diarias cambiaron.
+
     Returns:
         DataFrame semanal o None si falla
     """
@@ -231,16 +392,98 @@ def process_user(u_id):
 
     # Cargar dataset diario
     trabajo_path = BASE_DIR / f"DB_final_v3_u{u_id}.csv"
-    if not trabajo_path.exists():
+    if not table_exists(trabajo_path):
         log(f"  ❌ No se encontró: {trabajo_path.name}")
         return None
 
+    audit_path = AUDITORIA_DIR / f"FC_walk_imputacion_V3_u{u_id}.csv"
+    output_path = OUTPUT_DIR / f"weekly_u{u_id}.csv"
+    estado_path = OUTPUT_DIR / f"weekly_u{u_id}_estado.json"
+
+    estado = None
+    if incremental:
+        if table_exists(output_path) and estado_path.exists():
+            with open(estado_path) as f:
+                estado = json.load(f)
+        else:
+            log(f"  ⚠️  Sin estado previo: agregación completa")
+
     try:
-        df = pd.read_csv(trabajo_path)
+        resultado = agregar_cola(trabajo_path, audit_path, output_path, estado, u_id, alias) \
+            if estado is not None else None
+        if resultado is not None:
+            df_weekly, hashes, lectura = resultado
+        else:
+            df_weekly, hashes, lectura = agregar_completo(
+                trabajo_path, audit_path, output_path, estado, u_id, alias)
+        if df_weekly is None:
+            return None
+
+        if df_weekly.empty:
+            log(f"  ❌ Agregación resultó vacía")
+            return None
+
+        n_semanas = len(df_weekly)
+        n_baja_cob = df_weekly['flag_baja_cobertura'].sum()
+        dias_promedio = df_weekly['dias_monitoreados'].mean()
+
+        log(f"  ✅ Agregación completada:")
+        log(f"     - Semanas generadas: {n_semanas}")
+        log(f"     - Días promedio/semana: {dias_promedio:.1f}")
+        log(
+            f"     - Semanas baja cobertura (<{MIN_DIAS_COBERTURA} días): {n_baja_cob}")
+
+        if 'pct_imputada_FC_walk' in df_weekly.columns:
+            pct_imp_mean = df_weekly['pct_imputada_FC_walk'].mean()
+            if not np.isnan(pct_imp_mean):
+                log(
+                    f"     - % imputada FC_walk (promedio): {pct_imp_mean:.1f}%")
+
+        # Guardar archivo individual y estado para el modo incremental
+        write_table(df_weekly, output_path)
+        log(f"  ✅ Guardado: {output_path.name}")
+
+        with open(estado_path, 'w') as f:
+            json.dump({'ultima_semana': max(hashes),
+                       'columnas': list(df_weekly.columns),
+                       'hash_semanas': hashes,
+                       'lectura': lectura}, f, indent=1)
+
+        return df_weekly
+
+    except Exception as e:
+        log(f"  ❌ Error en agregación: {e}")
+        import traceback
+        log(traceback.format_exc())
+        return None
+
+
+def posiciones_fuentes(trabajo_path, audit_path, desde, semana_abierta):
+    """posicion_lectura del CSV diario y de la auditoría (None si no aplica)"""
+    if not trabajo_path.exists():
+        return None
+    diario = posicion_lectura(trabajo_path, desde['diario'], semana_abierta)
+    auditoria = posicion_lectura(audit_path, desde['auditoria'], semana_abierta) \
+        if audit_path.exists() else None
+    if diario is None or (audit_path.exists() and auditoria is None):
+        return None
+    return {'diario': diario, 'auditoria': auditoria}
+
+
+def agregar_completo(trabajo_path, audit_path, output_path, estado, u_id, alias):
+    """
+    Lee la historia diaria completa y agrega; con estado previo (modo
+    incremental) sólo re-agrega las semanas cuyo hash cambió.
+
+    Returns:
+        (DataFrame semanal o None, hash por semana, posición de lectura)
+    """
+    try:
+        df = read_table(trabajo_path)
         log(f"  ✅ Dataset cargado: {len(df)} días")
     except Exception as e:
         log(f"  ❌ Error al leer dataset: {e}")
-        return None
+        return None, None, None
 
     # Verificar columnas requeridas
     missing_vars = [v for v in VARIABLES[:-1]
@@ -249,65 +492,162 @@ def process_user(u_id):
         log(f"  ⚠️  Variables faltantes: {', '.join(missing_vars)}")
 
     # Derivar Delta_cardiaco
-    if 'FC_al_caminar_promedio_diario' in df.columns and 'FCr_promedio_diario' in df.columns:
-        df['Delta_cardiaco'] = df['FC_al_caminar_promedio_diario'] - \
-            df['FCr_promedio_diario']
+    if derivar_delta(df):
         log(f"  ✅ Delta_cardiaco derivado")
     else:
         log(f"  ⚠️  No se pudo derivar Delta_cardiaco (columnas faltantes)")
 
     # Cargar auditoría (opcional)
-    audit_path = AUDITORIA_DIR / f"FC_walk_imputacion_V3_u{u_id}.csv"
     audit_df = None
     if audit_path.exists():
         try:
-            audit_df = pd.read_csv(audit_path)
+            audit_df = pd.read_csv(audit_path, **OPCIONES_CSV)
             log(f"  ✅ Auditoría cargada: {len(audit_df)} registros")
         except Exception as e:
             log(f"  ⚠️  Error al leer auditoría: {e}")
     else:
         log(f"  ⚠️  Auditoría no encontrada (pct_imputada_FC_walk = NaN)")
 
-    # Agregación semanal
-    try:
-        df_weekly = aggregate_weekly(df, audit_df)
+    daily = prepare_daily(df, audit_df)
+    hashes = hash_weeks(daily)
 
-        if df_weekly.empty:
-            log(f"  ❌ Agregación resultó vacía")
+    df_weekly = None
+    if estado is not None:
+        df_weekly = splice_touched_weeks(daily, hashes, output_path, estado, u_id, alias)
+
+    if df_weekly is None:
+        df_weekly = aggregate_prepared(daily)
+        if not df_weekly.empty:
+            # Añadir identificador de usuario
+            df_weekly.insert(0, 'usuario_alias', alias)
+            df_weekly.insert(0, 'usuario_id', f"u{u_id}")
+
+    lectura = posiciones_fuentes(trabajo_path, audit_path, {'diario': 0, 'auditoria': 0},
+                                 max(hashes)) if hashes else None
+    return df_weekly, hashes, lectura
+
+
+def agregar_cola(trabajo_path, audit_path, output_path, estado, u_id, alias):
+    """
+    Modo incremental por cola: si la parte ya leída del CSV diario y de la
+    auditoría no cambió (tamaño y huella), lee sólo desde la primera fila de
+    la última semana agregada hasta el final, re-agrega esas semanas y las
+    reemplaza en el weekly_uN.csv existente. El costo es O(días nuevos).
+
+    Returns:
+        (DataFrame semanal, hash por semana, posición de lectura), o None si
+        hay que leer la historia completa
+    """
+    lectura = estado.get('lectura')
+    if not lectura or audit_path.exists() != (lectura['auditoria'] is not None) \
+            or not trabajo_path.exists():
+        return None
+    fuentes = [(trabajo_path, lectura['diario'])]
+    if audit_path.exists():
+        fuentes.append((audit_path, lectura['auditoria']))
+    for path, pos in fuentes:
+        if path.stat().st_size < pos['bytes'] or huella_csv(path, pos['bytes']) != pos['huella']:
+            log(f"  ⚠️  Cambió la parte ya leída de {path.name}: comparación por semana")
             return None
 
-        n_semanas = len(df_weekly)
-        n_baja_cob = df_weekly['flag_baja_cobertura'].sum()
-        dias_promedio = df_weekly['dias_monitoreados'].mean()
+    semana_abierta = estado['ultima_semana']
+    df, _, _ = leer_csv_desde(trabajo_path, lectura['diario']['bytes_ventana'])
+    derivar_delta(df)
+    audit_df = leer_csv_desde(audit_path, lectura['auditoria']['bytes_ventana'])[0] \
+        if audit_path.exists() else None
+    daily = prepare_daily(df, audit_df)
+    log(f"  🔄 Incremental por cola (última semana agregada: {semana_abierta}): "
+        f"{len(df)} días leídos desde la semana abierta")
+
+    df_previo = read_table(output_path)
+    df_nuevo = aggregate_prepared(daily)
+    if not df_nuevo.empty:
+        df_nuevo.insert(0, 'usuario_alias', alias)
+        df_nuevo.insert(0, 'usuario_id', f"u{u_id}")
+        df_nuevo['semana_inicio'] = df_nuevo['semana_inicio'].astype(str)
+        if list(df_nuevo.columns) != list(df_previo.columns):
+            log(f"  ⚠️  Columnas distintas al estado previo: agregación completa")
+            return None
 
-        log(f"  ✅ Agregación completada:")
-        log(f"     - Semanas generadas: {n_semanas}")
-        log(f"     - Días promedio/semana: {dias_promedio:.1f}")
-        log(
-            f"     - Semanas baja cobertura (<{MIN_DIAS_COBERTURA} días): {n_baja_cob}")
+    conservar = df_previo['semana_inicio'] < semana_abierta
+    df_weekly = pd.concat([df_previo[conservar], df_nuevo], ignore_index=True)
+    hashes = {s: h for s, h in estado['hash_semanas'].items() if s < semana_abierta}
+    hashes.update(hash_weeks(daily))
 
-        if 'pct_imputada_FC_walk' in df_weekly.columns:
-            pct_imp_mean = df_weekly['pct_imputada_FC_walk'].mean()
-            if not np.isnan(pct_imp_mean):
-                log(
-                    f"     - % imputada FC_walk (promedio): {pct_imp_mean:.1f}%")
+    desde = {'diario': lectura['diario']['bytes_ventana'],
+             'auditoria': lectura['auditoria']['bytes_ventana'] if audit_path.exists() else 0}
+    return df_weekly, hashes, posiciones_fuentes(trabajo_path, audit_path, desde, max(hashes))
 
-        # Añadir identificador de usuario
-        df_weekly.insert(0, 'usuario_alias', alias)
-        df_weekly.insert(0, 'usuario_id', f"u{u_id}")
 
-        # Guardar archivo individual
-        output_path = OUTPUT_DIR / f"weekly_u{u_id}.csv"
-        df_weekly.to_csv(output_path, index=False)
-        log(f"  ✅ Guardado: {output_path.name}")
+def splice_touched_weeks(daily, hashes, output_path, estado, u_id, alias):
+    """
+    Modo incremental: re-agrega sólo las semanas nuevas o modificadas
+    (según hash_weeks) y las inserta en el weekly_uN.csv existente.
 
-        return df_weekly
+    Returns:
+        DataFrame semanal completo, o None si no hay estado previo utilizable
+        (en ese caso se hace la agregación completa)
+    """
+    df_previo = read_table(output_path)
+
+    hashes_previos = estado['hash_semanas']
+    tocadas = [s for s, h in hashes.items() if hashes_previos.get(s) != h]
+    eliminadas = [s for s in hashes_previos if s not in hashes]
+    n_nuevas = sum(s > estado['ultima_semana'] for s in tocadas)
+    log(f"  🔄 Incremental (última semana agregada: {estado['ultima_semana']}): "
+        f"{n_nuevas} nuevas, {len(tocadas) - n_nuevas} modificadas, "
+        f"{len(eliminadas)} eliminadas")
+
+    semana_str = daily['semana'].dt.start_time.dt.strftime('%Y-%m-%d')
+    df_nuevo = aggregate_prepared(daily[semana_str.isin(tocadas)])
+    if not df_nuevo.empty:
+        df_nuevo.insert(0, 'usuario_alias', alias)
+        df_nuevo.insert(0, 'usuario_id', f"u{u_id}")
+        df_nuevo['semana_inicio'] = df_nuevo['semana_inicio'].astype(str)
+        if list(df_nuevo.columns) != list(df_previo.columns):
+            log(f"  ⚠️  Columnas distintas al estado previo: agregación completa")
+            return None
+
+    conservar = ~df_previo['semana_inicio'].isin(set(tocadas) | set(eliminadas))
+    partes = [df_previo[conservar]] + ([df_nuevo] if not df_nuevo.empty else [])
+    return pd.concat(partes, ignore_index=True).sort_values(
+        'semana_inicio', kind='stable').reset_index(drop=True)
 
-    except Exception as e:
-        log(f"  ❌ Error en agregación: {e}")
-        import traceback
-        log(traceback.format_exc())
-        return None
+
+def _process_user_en_worker(u_id, incremental=False):
+    """
+    Ejecuta process_user dentro de un proceso del pool.
+
+    Returns:
+        (DataFrame semanal o None, líneas de log del usuario)
+    """
+    global ECHO_CONSOLA
+    ECHO_CONSOLA = False
+    LOG_LINES.clear()
+    df_weekly = process_user(u_id, incremental)
+    return df_weekly, list(LOG_LINES)
+
+
+def iter_process_users(user_ids, workers=1, incremental=False):
+    """
+    Procesa usuarios y entrega (u_id, df_weekly) en el orden de user_ids.
+
+    Con workers > 1 los usuarios se procesan en un pool de procesos; cada
+    worker escribe su weekly_uN.csv y su log se re-emite aquí en orden de
+    usuario, de modo que LOG_LINES queda igual que en modo secuencial.
+    """
+    if workers <= 1:
+        for u_id in user_ids:
+            yield u_id, process_user(u_id, incremental)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        salidas = pool.map(
+            partial(_process_user_en_worker, incremental=incremental), user_ids)
+        for u_id, (df_weekly, lineas) in zip(user_ids, salidas):
+            for linea in lineas:
+                log(linea)
+            yield u_id, df_weekly
 
 
 def build_cluster_inputs(df_consolidado):
@@ -346,22 +686,24 @@ def build_cluster_inputs(df_consolidado):
 # MAIN
 # ==============================================================================
 
-def main():
+def main(workers=1, incremental=False):
     log("="*80)
     log("AGREGACIÓN SEMANAL - PASO 4")
     log("="*80)
     log(f"Inicio: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     log(f"Directorio base: {BASE_DIR}")
     log(f"Directorio salida: {OUTPUT_DIR}")
+    if workers > 1:
+        log(f"Procesos en paralelo: {workers}")
+    if incremental:
+        log(f"Modo incremental: sólo semanas nuevas o modificadas")
     log("")
 
     # Procesar usuarios
     weekly_frames = []
     resultados = []
 
-    for u_id in range(1, 11):
-        df_weekly = process_user(u_id)
-
+    for u_id, df_weekly in iter_process_users(range(1, 11), workers, incremental):
         if df_weekly is not None:
             weekly_frames.append(df_weekly)
             resultados.append({
@@ -397,7 +739,7 @@ def main():
 
     df_consolidado = pd.concat(weekly_frames, ignore_index=True)
     path_consolidado = OUTPUT_DIR / "weekly_consolidado.csv"
-    df_consolidado.to_csv(path_consolidado, index=False)
+    write_table(df_consolidado, path_consolidado, partition_by='usuario_id')
 
     log(f"✅ Consolidado guardado: {path_consolidado.name}")
     log(f"   Registros totales: {len(df_consolidado)} semanas")
@@ -413,7 +755,7 @@ def main():
 
     df_cluster = build_cluster_inputs(df_consolidado)
     path_cluster = OUTPUT_DIR / "cluster_inputs_weekly.csv"
-    df_cluster.to_csv(path_cluster, index=False)
+    write_table(df_cluster, path_cluster, partition_by='usuario_id')
 
     log(f"✅ Cluster inputs guardado: {path_cluster.name}")
     log(f"   Registros: {len(df_cluster)}")
@@ -498,4 +840,11 @@ def main():
 
 
 if __name__ == '__main__':
-    sys.exit(main())
+    parser = argparse.ArgumentParser(
+        description='Agregación semanal por usuario (Paso 4)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Procesos para agregar usuarios en paralelo (1 = secuencial)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Re-agregar sólo semanas nuevas o con filas diarias modificadas')
+    args = parser.parse_args()
+    sys.exit(main(workers=args.workers, incremental=args.incremental))
@@ -22,6 +22,11 @@ SALIDAS:
 - missingness_y_acf/missingness_consolidado.csv
 - missingness_y_acf/acf_consolidado.csv
 
+La ACF (todos los lags de todas las ACF_VARIABLES de un usuario) y la PACF
+(Durbin-Levinson) se calculan una sola vez por usuario con acf_engine (FFT
+sobre la matriz semanas × variables, NaN enmascarados); las estadísticas y
+los gráficos leen de ese resultado.
+
 Autor: Pipeline automatizado
 Fecha: 2025-10-16
 """
@@ -39,6 +44,9 @@ matplotlib.use('Agg')  # Backend sin GUI
 
 warnings.filterwarnings('ignore')
 
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+from acf_engine import acf_lote, bandas_confianza, pacf_durbin_levinson  # noqa: E402
+
 # ==============================================================================
 # CONFIGURACIÓN
 # ==============================================================================
@@ -67,6 +75,7 @@ USER_MAP = {
 }
 
 MIN_WEEKS_ACF = 30  # Mínimo de semanas para ACF significativo
+MAX_LAG_ACF = 20    # Último lag calculado (gráficos: min(20, n/2))
 
 LOG_LINES = []
 
@@ -112,149 +121,93 @@ def analyze_missingness(df_weekly, u_id):
     return pd.DataFrame(results)
 
 
-def compute_acf_manual(series, max_lag=20):
-    """
-    Calcula ACF manualmente usando pandas.Series.autocorr
+def calcular_acf_usuario(df_weekly, variables, max_lag=MAX_LAG_ACF):
     """
-    s = pd.Series(series)
-    acf_values = []
-    for lag in range(max_lag + 1):
-        try:
-            acf_values.append(s.autocorr(lag=lag))
-        except:
-            acf_values.append(np.nan)
-    return np.array(acf_values)
+    ACF y PACF de todas las variables de un usuario en un solo lote.
 
-
-def compute_acf_stats(series, var_name, u_id, max_lags=20):
-    """
-    Calcula estadísticas ACF (simplificado sin statsmodels).
+    Las semanas sin dato de una variable quedan enmascaradas (NaN) en la
+    matriz semanas × variables, sin desplazar el eje temporal.
 
     Returns:
-        dict con estadísticas
+        dict variable -> {'n_weeks', 'acf_pearson' (como Series.autocorr),
+        'acf' (ACF estándar), 'pacf'}; arrays indexados por lag 0..max_lag
     """
-    s = pd.to_numeric(series, errors='coerce').dropna()
+    X = df_weekly[variables].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    n_weeks = (~np.isnan(X)).sum(axis=0)
+    acf_pearson = acf_lote(X, max_lag, metodo='pearson')
+    acf_std = acf_lote(X, max_lag, metodo='estandar')
+    pacf = pacf_durbin_levinson(acf_std)
 
-    if len(s) < MIN_WEEKS_ACF:
-        return {
-            'usuario_id': f"u{u_id}",
-            'variable': var_name,
-            'n_weeks': len(s),
-            'acf_lag1': np.nan,
-            'acf_lag2': np.nan,
-            'acf_lag4': np.nan,
-            'status': 'insuficiente'
-        }
+    return {var: {'n_weeks': int(n_weeks[j]),
+                  'acf_pearson': acf_pearson[:, j],
+                  'acf': acf_std[:, j],
+                  'pacf': pacf[:, j]}
+            for j, var in enumerate(variables)}
 
-    try:
-        # ACF manual para lags específicos
-        acf_lag1 = pd.Series(s).autocorr(lag=1) if len(s) > 1 else np.nan
-        acf_lag2 = pd.Series(s).autocorr(lag=2) if len(s) > 2 else np.nan
-        acf_lag4 = pd.Series(s).autocorr(lag=4) if len(s) > 4 else np.nan
-
-        return {
-            'usuario_id': f"u{u_id}",
-            'variable': var_name,
-            'n_weeks': len(s),
-            'acf_lag1': acf_lag1,
-            'acf_lag2': acf_lag2,
-            'acf_lag4': acf_lag4,
-            'status': 'OK'
-        }
-    except Exception as e:
-        log(f"    ⚠️  Error en ACF stats para {var_name}: {e}")
-        return {
-            'usuario_id': f"u{u_id}",
-            'variable': var_name,
-            'n_weeks': len(s),
-            'acf_lag1': np.nan,
-            'acf_lag2': np.nan,
-            'acf_lag4': np.nan,
-            'status': 'error'
-        }
 
+def compute_acf_stats(acf_res, var_name, u_id):
+    """
+    Estadísticas ACF (lags 1, 2 y 4) desde el resultado cacheado del usuario.
 
-def plot_acf_pacf(series, var_name, u_id, alias):
+    Returns:
+        dict con estadísticas
     """
-    Genera gráficos ACF y PACF usando statsmodels.
+    n_weeks = acf_res['n_weeks']
+    suficiente = n_weeks >= MIN_WEEKS_ACF
+    acf = acf_res['acf_pearson']
+
+    def en_lag(lag):
+        return acf[lag] if suficiente and lag < len(acf) else np.nan
+
+    return {
+        'usuario_id': f"u{u_id}",
+        'variable': var_name,
+        'n_weeks': n_weeks,
+        'acf_lag1': en_lag(1),
+        'acf_lag2': en_lag(2),
+        'acf_lag4': en_lag(4),
+        'status': 'OK' if suficiente else 'insuficiente'
+    }
+
+
+def _graficar_correlacion(ax, valores, banda, titulo):
+    """Barras por lag con banda de confianza del 95% (estilo statsmodels)"""
+    lags = np.arange(len(valores))
+    ax.vlines(lags, [0], valores)
+    ax.axhline()
+    ax.margins(0.05)
+    ax.plot(lags, valores, marker='o', markersize=5, linestyle='None')
+    ax.set_title(titulo, fontsize=10)
+    ax.set_ylim(-1, 1)
+
+    lags_banda = lags[1:].astype(float)
+    lags_banda[0] -= 0.5
+    lags_banda[-1] += 0.5
+    ax.fill_between(lags_banda, -banda[1:], banda[1:], alpha=0.25)
+    ax.set_xlabel('Lag (semanas)')
+
+
+def plot_acf_pacf(acf_res, var_name, u_id, alias):
     """
-    s = pd.to_numeric(series, errors='coerce').dropna()
-
-    if len(s) < MIN_WEEKS_ACF:
-        log(f"    ⚠️  {var_name}: solo {len(s)} semanas, se omite gráfico ACF")
+    Genera gráficos ACF y PACF desde el resultado cacheado del usuario.
+    """
+    n_weeks = acf_res['n_weeks']
+    if n_weeks < MIN_WEEKS_ACF:
+        log(f"    ⚠️  {var_name}: solo {n_weeks} semanas, se omite gráfico ACF")
         return False
 
     try:
-        # Intentar importar statsmodels
-        try:
-            from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
-            from statsmodels.tsa.stattools import acf, pacf
-            HAS_STATSMODELS = True
-        except ImportError:
-            HAS_STATSMODELS = False
-            log(f"    ⚠️  statsmodels no disponible, usando método manual")
-
-        max_lag = min(20, len(s)//2)
-
-        if HAS_STATSMODELS:
-            # ACF con statsmodels
-            fig_acf, ax_acf = plt.subplots(figsize=(10, 4))
-            plot_acf(s, lags=max_lag, ax=ax_acf, alpha=0.05)
-            ax_acf.set_title(
-                f'ACF: {var_name} - {alias} (u{u_id})', fontsize=10)
-            ax_acf.set_xlabel('Lag (semanas)')
-            plt.tight_layout()
-            acf_path = OUTPUT_DIR / 'acf_plots' / f'acf_{var_name}_u{u_id}.png'
-            fig_acf.savefig(acf_path, dpi=100)
-            plt.close(fig_acf)
-
-            # PACF con statsmodels
-            fig_pacf, ax_pacf = plt.subplots(figsize=(10, 4))
-            plot_pacf(s, lags=max_lag, ax=ax_pacf, alpha=0.05, method='ywm')
-            ax_pacf.set_title(
-                f'PACF: {var_name} - {alias} (u{u_id})', fontsize=10)
-            ax_pacf.set_xlabel('Lag (semanas)')
-            plt.tight_layout()
-            pacf_path = OUTPUT_DIR / 'pacf_plots' / \
-                f'pacf_{var_name}_u{u_id}.png'
-            fig_pacf.savefig(pacf_path, dpi=100)
-            plt.close(fig_pacf)
-
-        else:
-            # Fallback manual (ACF)
-            acf_values = compute_acf_manual(s, max_lag)
-            conf_int = 1.96 / np.sqrt(len(s))
-
-            fig_acf, ax_acf = plt.subplots(figsize=(10, 4))
-            lags = np.arange(len(acf_values))
-            ax_acf.stem(lags, acf_values, linefmt='C0-',
-                        markerfmt='C0o', basefmt=' ')
-            ax_acf.axhline(y=conf_int, linestyle='--', color='gray', alpha=0.5)
-            ax_acf.axhline(y=-conf_int, linestyle='--',
-                           color='gray', alpha=0.5)
-            ax_acf.axhline(y=0, linestyle='-', color='black', linewidth=0.8)
-            ax_acf.set_title(
-                f'ACF: {var_name} - {alias} (u{u_id})', fontsize=10)
-            ax_acf.set_xlabel('Lag (semanas)')
-            ax_acf.set_ylabel('Autocorrelación')
-            ax_acf.set_ylim([-1, 1])
-            plt.tight_layout()
-            acf_path = OUTPUT_DIR / 'acf_plots' / f'acf_{var_name}_u{u_id}.png'
-            fig_acf.savefig(acf_path, dpi=100)
-            plt.close(fig_acf)
-
-            # PACF placeholder si no hay statsmodels
-            pacf_path = OUTPUT_DIR / 'pacf_plots' / \
-                f'pacf_{var_name}_u{u_id}.png'
-            fig_dummy, ax_dummy = plt.subplots(figsize=(10, 4))
-            ax_dummy.text(0.5, 0.5, 'PACF omitido\n(requiere statsmodels)',
-                          ha='center', va='center', fontsize=12)
-            ax_dummy.set_title(
-                f'PACF: {var_name} - {alias} (u{u_id})', fontsize=10)
-            ax_dummy.axis('off')
+        max_lag = min(MAX_LAG_ACF, n_weeks // 2)
+        acf = acf_res['acf'][:max_lag + 1]
+        pacf = acf_res['pacf'][:max_lag + 1]
+
+        for tipo, valores, carpeta in [('acf', acf, 'acf_plots'), ('pacf', pacf, 'pacf_plots')]:
+            fig, ax = plt.subplots(figsize=(10, 4))
+            _graficar_correlacion(ax, valores, bandas_confianza(acf, n_weeks, tipo),
+                                  f'{tipo.upper()}: {var_name} - {alias} (u{u_id})')
             plt.tight_layout()
-            fig_dummy.savefig(pacf_path, dpi=100)
-            plt.close(fig_dummy)
+            fig.savefig(OUTPUT_DIR / carpeta / f'{tipo}_{var_name}_u{u_id}.png', dpi=100)
+            plt.close(fig)
 
         return True
 
@@ -317,15 +270,17 @@ def process_user(u_id):
     for var in ACF_VARIABLES:
         if var not in df_weekly.columns:
             log(f"    ⚠️  Variable {var} no encontrada")
-            continue
+    variables = [var for var in ACF_VARIABLES if var in df_weekly.columns]
+    acf_usuario = calcular_acf_usuario(df_weekly, variables)
 
+    for var in variables:
         # Estadísticas ACF
-        stats = compute_acf_stats(df_weekly[var], var, u_id)
+        stats = compute_acf_stats(acf_usuario[var], var, u_id)
         acf_stats_list.append(stats)
 
         # Gráficos
         if stats['status'] == 'OK':
-            if plot_acf_pacf(df_weekly[var], var, u_id, alias):
+            if plot_acf_pacf(acf_usuario[var], var, u_id, alias):
                 n_plots += 2  # ACF + PACF
 
     df_acf_stats = pd.DataFrame(acf_stats_list)
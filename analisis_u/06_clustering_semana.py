@@ -9,7 +9,8 @@ evaluar K∈{2..6}, y generar asignaciones + visualizaciones.
 
 INSUMOS:
 --------
-- analisis_u/semanal/cluster_inputs_weekly.csv
+- analisis_u/semanal/weekly_consolidado.csv vía feature_cache.py
+  (mismas filas y columnas que cluster_inputs_weekly.csv)
 
 SALIDAS:
 --------
@@ -20,6 +21,10 @@ SALIDAS:
 - clustering/cluster_profiles.csv
 - cluster_viz/pca_scatter.png
 - cluster_viz/umap_scatter.png (opcional)
+- clustering/stability_cache/ (ARI por réplica bootstrap, reutilizable)
+
+USO:
+    python analisis_u/06_clustering_semana.py [--workers 4] [--silhouette muestra]
 
 Autor: Pipeline automatizado
 Fecha: 2025-10-16
@@ -27,8 +32,13 @@ Fecha: 2025-10-16
 
 import seaborn as sns
 import matplotlib.pyplot as plt
+import argparse
+import hashlib
+import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 import pandas as pd
 import numpy as np
@@ -38,9 +48,10 @@ from datetime import datetime
 # ML imports
 from sklearn.preprocessing import RobustScaler
 from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score, davies_bouldin_score, adjusted_rand_score
+from sklearn.metrics import adjusted_rand_score
 from sklearn.decomposition import PCA
 from sklearn.utils import resample
+from threadpoolctl import threadpool_limits
 
 # Plots
 import matplotlib
@@ -48,12 +59,17 @@ matplotlib.use('Agg')
 
 warnings.filterwarnings('ignore')
 
+sys.path.insert(0, str(Path(__file__).parent.parent.resolve()))
+from data_store import table_exists  # noqa: E402
+from feature_cache import SOURCE_FILE, feature_frame, load_scaled  # noqa: E402
+from k_sweep import barrer_k  # noqa: E402
+
 # ==============================================================================
 # CONFIGURACIÓN
 # ==============================================================================
 
 BASE_DIR = Path(__file__).parent.resolve()  # analisis_u/
-INPUT_FILE = BASE_DIR / 'semanal' / 'cluster_inputs_weekly.csv'
+INPUT_FILE = SOURCE_FILE
 OUTPUT_DIR = BASE_DIR / 'clustering'
 VIZ_DIR = BASE_DIR / 'cluster_viz'
 
@@ -71,6 +87,9 @@ FEATURE_COLS = [
 
 # Rango de K
 K_RANGE = [2, 3, 4, 5, 6]
+KSWEEP_MINIBATCH = 'auto'  # MiniBatchKMeans sólo para cohortes grandes
+KSWEEP_WARM_START = False  # True: K+1 arranca de la solución de K dividida
+SILHOUETTE_METODO = 'auto'  # 'exacta' (por bloques), 'muestra' (con IC) o 'auto'
 
 # Filtros de calidad
 MIN_DIAS = 3
@@ -79,6 +98,16 @@ MAX_PCT_IMPUTADA = 60
 # Bootstrap para estabilidad
 N_BOOTSTRAP = 20
 BOOTSTRAP_FRAC = 0.8
+BOOTSTRAP_N_INIT = 10
+BOOTSTRAP_MAX_ITER = 300
+
+# Caché de ARI por réplica: por contexto (K, hash de la matriz escalada, de
+# las etiquetas de referencia y de la configuración de KMeans) y semilla.
+# Se conservan los STABILITY_CACHE_MAX_CONTEXTOS usados más recientemente.
+STABILITY_CACHE_DIR = OUTPUT_DIR / 'stability_cache'
+STABILITY_CACHE_FILE = STABILITY_CACHE_DIR / 'bootstrap_ari.json'
+STABILITY_CACHE_VERSION = 2
+STABILITY_CACHE_MAX_CONTEXTOS = 50
 
 LOG_LINES = []
 
@@ -124,64 +153,180 @@ def filter_quality(df):
     return df
 
 
-def compute_stability(X, k, n_iter=N_BOOTSTRAP, frac=BOOTSTRAP_FRAC):
+def hash_matriz(X, frac=BOOTSTRAP_FRAC):
+    """Hash del contenido de la matriz escalada (y de la fracción bootstrap)"""
+    X = np.ascontiguousarray(X)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str((X.shape, X.dtype.str, frac)).encode())
+    h.update(X.tobytes())
+    return h.hexdigest()
+
+
+def hash_contexto(labels_ref, frac=BOOTSTRAP_FRAC):
+    """Hash de las etiquetas de referencia y de la configuración de KMeans"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps({
+        'frac': frac,
+        'n_init': BOOTSTRAP_N_INIT,
+        'max_iter': BOOTSTRAP_MAX_ITER,
+        'ksweep_minibatch': KSWEEP_MINIBATCH,
+        'ksweep_warm_start': KSWEEP_WARM_START,
+    }, sort_keys=True).encode())
+    h.update(np.ascontiguousarray(labels_ref, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def _cargar_cache_stability():
+    """Caché de ARI: {'contador', 'contextos': {contexto: {'uso', 'ari'}}}"""
+    if STABILITY_CACHE_FILE.exists():
+        with open(STABILITY_CACHE_FILE) as f:
+            cache = json.load(f)
+        # Formato anterior (claves planas sin etiquetas ni configuración): se descarta
+        if cache.get('version') == STABILITY_CACHE_VERSION:
+            return cache
+    return {'version': STABILITY_CACHE_VERSION, 'contador': 0, 'contextos': {}}
+
+
+def _guardar_cache_stability(cache):
+    """Guarda la caché conservando sólo los contextos usados más recientemente"""
+    contextos = cache['contextos']
+    recientes = sorted(contextos, key=lambda c: contextos[c]['uso'],
+                       reverse=True)[:STABILITY_CACHE_MAX_CONTEXTOS]
+    cache['contextos'] = {c: contextos[c] for c in recientes}
+
+    STABILITY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = STABILITY_CACHE_FILE.with_name(
+        f'{STABILITY_CACHE_FILE.stem}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp, STABILITY_CACHE_FILE)
+
+
+def _matriz_compartida(X):
     """
-    Calcula estabilidad del clustering mediante bootstrap.
+    Guarda X en un .npy propio del proceso para que los workers lo abran con
+    mmap_mode='r' en lugar de recibir una copia serializada por tarea. Quien
+    la crea la elimina al terminar (compute_stability); no se tocan archivos
+    de otros procesos.
+    """
+    STABILITY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = STABILITY_CACHE_DIR / f'X_scaled_{os.getpid()}.npy'
+    np.save(path, np.ascontiguousarray(X))
+    return path
 
-    Returns:
-        ARI promedio entre remuestreos
+
+def bootstrap_ari(seed, X, labels_ref, k, frac=BOOTSTRAP_FRAC):
+    """
+    ARI de una réplica bootstrap: KMeans sobre un remuestreo (semilla seed)
+    contra las etiquetas de referencia del mismo subconjunto.
     """
     n_samples = len(X)
-    aris = []
+    idx_boot = resample(range(n_samples), n_samples=int(
+        n_samples*frac), random_state=seed)
+    X_boot = X[idx_boot]
 
-    # Clustering de referencia
-    kmeans_ref = KMeans(n_clusters=k, random_state=42, n_init=10)
-    labels_ref = kmeans_ref.fit_predict(X)
+    kmeans_boot = KMeans(n_clusters=k, random_state=seed, n_init=BOOTSTRAP_N_INIT,
+                         max_iter=BOOTSTRAP_MAX_ITER)
+    labels_boot = kmeans_boot.fit_predict(X_boot)
 
-    for i in range(n_iter):
-        # Resample
-        idx_boot = resample(range(n_samples), n_samples=int(
-            n_samples*frac), random_state=i)
-        X_boot = X[idx_boot]
+    return adjusted_rand_score(labels_ref[idx_boot], labels_boot)
 
-        # Clustering en bootstrap
-        kmeans_boot = KMeans(n_clusters=k, random_state=i, n_init=10)
-        labels_boot = kmeans_boot.fit_predict(X_boot)
 
-        # ARI entre ref (subset) y boot
-        labels_ref_subset = labels_ref[idx_boot]
-        ari = adjusted_rand_score(labels_ref_subset, labels_boot)
-        aris.append(ari)
+def _bootstrap_ari_en_worker(seed, path_x, labels_ref, k, frac):
+    """bootstrap_ari dentro del pool: X compartida vía memmap, KMeans a 1 hilo"""
+    X = np.load(path_x, mmap_mode='r')
+    with threadpool_limits(limits=1):
+        return bootstrap_ari(seed, X, labels_ref, k, frac)
 
-    return np.mean(aris)
 
+def compute_stability(X, k, n_iter=N_BOOTSTRAP, frac=BOOTSTRAP_FRAC,
+                      labels_ref=None, workers=1, usar_cache=True):
+    """
+    Calcula estabilidad del clustering mediante bootstrap.
+
+    Cada réplica i usa la semilla i (remuestreo y KMeans), de modo que el
+    resultado no depende de workers ni del orden de ejecución. Los ARI ya
+    calculados para el mismo contexto (K, X, etiquetas de referencia y
+    configuración de KMeans) y semilla se leen de la caché.
+
+    Args:
+        labels_ref: etiquetas del clustering de referencia (KMeans con
+            random_state=42); se calculan si no se pasan
+        workers: procesos para las réplicas pendientes (1 = secuencial)
+        usar_cache: leer/escribir STABILITY_CACHE_FILE
 
-def evaluate_k(X, k):
+    Returns:
+        ARI promedio entre remuestreos
     """
-    Evalúa clustering para un K específico.
+    if labels_ref is None:
+        kmeans_ref = KMeans(n_clusters=k, random_state=42, n_init=10)
+        labels_ref = kmeans_ref.fit_predict(X)
+
+    contexto = f'{k}|{hash_matriz(X, frac)}|{hash_contexto(labels_ref, frac)}'
+    cache = _cargar_cache_stability() if usar_cache else \
+        {'contador': 0, 'contextos': {}}
+    entrada = cache['contextos'].setdefault(contexto, {'uso': 0, 'ari': {}})
+    ari = entrada['ari']
+    pendientes = [seed for seed in range(n_iter) if str(seed) not in ari]
+
+    if pendientes and workers > 1:
+        path_x = _matriz_compartida(X)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                aris = pool.map(partial(_bootstrap_ari_en_worker, path_x=path_x,
+                                        labels_ref=labels_ref, k=k, frac=frac),
+                                pendientes)
+                ari.update(zip(map(str, pendientes), aris))
+        finally:
+            path_x.unlink(missing_ok=True)
+    else:
+        for seed in pendientes:
+            ari[str(seed)] = bootstrap_ari(seed, X, labels_ref, k, frac)
+
+    if usar_cache:
+        cache['contador'] += 1
+        entrada['uso'] = cache['contador']
+        _guardar_cache_stability(cache)
+    if n_iter > len(pendientes):
+        log(f"    - Réplicas desde caché: {n_iter - len(pendientes)}/{n_iter}")
+
+    return np.mean([ari[str(seed)] for seed in range(n_iter)])
+
+
+def evaluate_k(X, k, kmeans, metricas, workers=1):
+    """
+    Completa la evaluación de un K del barrido (k_sweep.barrer_k).
+
+    El modelo de K (random_state=42) es también la referencia del bootstrap
+    de estabilidad.
+
+    Args:
+        kmeans: modelo ajustado para K
+        metricas: fila del barrido (silhouette_mean, davies_bouldin)
 
     Returns:
         dict con métricas
     """
     log(f"\n  Evaluando K={k}...")
 
-    # KMeans
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(X)
+    labels = kmeans.labels_
 
-    # Métricas
-    sil = silhouette_score(X, labels)
-    db = davies_bouldin_score(X, labels)
+    # Métricas (calculadas en el barrido)
+    sil = metricas['silhouette_mean']
+    db = metricas['davies_bouldin']
 
     # Estabilidad
     log(f"    - Calculando estabilidad ({N_BOOTSTRAP} bootstraps)...")
-    stability = compute_stability(X, k)
+    stability = compute_stability(X, k, labels_ref=labels, workers=workers)
 
     # Tamaños de clusters
     unique, counts = np.unique(labels, return_counts=True)
     sizes = dict(zip(unique, counts))
 
     log(f"    - Silhouette: {sil:.3f}")
+    if 'silhouette_ic95_inf' in metricas:
+        log(f"      IC95% (muestra): [{metricas['silhouette_ic95_inf']:.3f}, "
+            f"{metricas['silhouette_ic95_sup']:.3f}]")
     log(f"    - Davies-Bouldin: {db:.3f}")
     log(f"    - Estabilidad (ARI promedio): {stability:.3f}")
     log(f"    - Tamaños: {sizes}")
@@ -350,7 +495,7 @@ def plot_umap_clusters(X_scaled, labels, k):
 # MAIN
 # ==============================================================================
 
-def main():
+def main(workers=1, silhouette=SILHOUETTE_METODO):
     log("="*80)
     log("CLUSTERING SEMANAL - PASO 6")
     log("="*80)
@@ -363,12 +508,12 @@ def main():
     # =========================================================================
     log("📂 Cargando datos...")
 
-    if not INPUT_FILE.exists():
+    if not table_exists(INPUT_FILE):
         log(f"❌ ERROR: No se encontró {INPUT_FILE}")
         return 1
 
-    df = pd.read_csv(INPUT_FILE)
-    log(f"✅ Datos cargados: {len(df)} semanas")
+    df = feature_frame(FEATURE_COLS)
+    log(f"✅ Datos cargados: {len(df)} semanas (caché de features)")
     log(f"   Columnas: {list(df.columns)}")
 
     # Verificar features
@@ -410,9 +555,12 @@ def main():
         imputer = SimpleImputer(strategy='median')
         X = imputer.fit_transform(X)
 
-    # Escalado robusto
-    scaler = RobustScaler()
-    X_scaled = scaler.fit_transform(X)
+        # Escalado robusto
+        scaler = RobustScaler()
+        X_scaled = scaler.fit_transform(X)
+    else:
+        # Escalado robusto (cacheado para estas filas en la caché de features)
+        X_scaled, scaler = load_scaled(FEATURE_COLS, filas=df_filt.index.to_numpy())
 
     log(f"✅ Features escaladas con RobustScaler")
     log(f"   Shape: {X_scaled.shape}")
@@ -424,10 +572,17 @@ def main():
     log(f"BÚSQUEDA DE K ÓPTIMO")
     log(f"{'='*80}")
 
+    # Un solo barrido: KMeans, silhouette y Davies-Bouldin para todos los K
+    df_sweep, modelos = barrer_k(X_scaled, K_RANGE, random_state=42, n_init=10,
+                                 minibatch=KSWEEP_MINIBATCH,
+                                 warm_start=KSWEEP_WARM_START,
+                                 silhouette=silhouette)
+
     metrics_list = []
 
-    for k in K_RANGE:
-        result = evaluate_k(X_scaled, k)
+    for _, fila in df_sweep.iterrows():
+        k = int(fila['k'])
+        result = evaluate_k(X_scaled, k, modelos[k], fila, workers=workers)
         metrics_list.append(result)
 
     # Selección de K
@@ -552,4 +707,11 @@ def main():
 
 
 if __name__ == '__main__':
-    sys.exit(main())
+    parser = argparse.ArgumentParser(description='Clustering semanal (Paso 6)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Procesos para las réplicas bootstrap (1 = secuencial)')
+    parser.add_argument('--silhouette', choices=['auto', 'exacta', 'muestra'],
+                        default=SILHOUETTE_METODO,
+                        help='Silhouette exacto por bloques o por muestra estratificada')
+    args = parser.parse_args()
+    sys.exit(main(workers=args.workers, silhouette=args.silhouette))
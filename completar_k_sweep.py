@@ -1,12 +1,10 @@
 """Completar K-Sweep del análisis pre-clustering"""
-import pandas as pd
-import numpy as np
 from pathlib import Path
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score, silhouette_samples
-from sklearn.preprocessing import RobustScaler
 import matplotlib.pyplot as plt
 
+from feature_cache import load_scaled
+from k_sweep import barrer_k
+
 BASE_DIR = Path(__file__).parent.resolve()
 INPUT_FILE = BASE_DIR / 'analisis_u' / 'semanal' / 'cluster_inputs_weekly.csv'
 OUTPUT_DIR = BASE_DIR / 'analisis_u' / 'semanal' / 'precluster'
@@ -18,42 +16,19 @@ FEATURES = [
     'Delta_cardiaco_p50', 'Delta_cardiaco_iqr'
 ]
 
-print("Cargando datos...")
-df = pd.read_csv(INPUT_FILE)
-X = df[FEATURES].values
-
-print("Escalando con RobustScaler...")
-scaler = RobustScaler()
-X_scaled = scaler.fit_transform(X)
+print("Cargando matriz escalada...")
+# Matriz escalada (RobustScaler) memory-mapped desde la caché de features
+# de cluster_inputs_weekly.csv, compartida con 06_precluster_qc.py
+X_scaled, _ = load_scaled(FEATURES, source=INPUT_FILE)
 
 print("\nEjecutando K-Sweep (K=2..6)...")
-k_metrics = []
-
-for k in range(2, 7):
-    print(f"  K={k}...", end='', flush=True)
-
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10, max_iter=500)
-    labels = kmeans.fit_predict(X_scaled)
-
-    inertia = kmeans.inertia_
-    sil_scores = silhouette_samples(X_scaled, labels)
-    sil_mean = sil_scores.mean()
-    sil_std = sil_scores.std()
-
-    unique, counts = np.unique(labels, return_counts=True)
-    sizes = dict(zip(unique, counts))
-
-    k_metrics.append({
-        'k': k,
-        'inertia': inertia,
-        'silhouette_mean': sil_mean,
-        'silhouette_std': sil_std,
-        'cluster_sizes': str(sizes)
-    })
+k_metrics_df, _ = barrer_k(X_scaled, range(2, 7), random_state=42,
+                           n_init=10, max_iter=500)
 
-    print(f" Inertia={inertia:.2f}, Sil={sil_mean:.3f}")
+for _, fila in k_metrics_df.iterrows():
+    print(f"  K={fila['k']}... Inertia={fila['inertia']:.2f}, "
+          f"Sil={fila['silhouette_mean']:.3f}, DB={fila['davies_bouldin']:.3f}")
 
-k_metrics_df = pd.DataFrame(k_metrics)
 k_metrics_file = OUTPUT_DIR / 'k_sweep_metrics.csv'
 k_metrics_df.to_csv(k_metrics_file, index=False)
 print(f"\n✅ Guardado: {k_metrics_file}")
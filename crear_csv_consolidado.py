@@ -5,7 +5,8 @@ Crear archivo CSV consolidado con todos los usuarios
 """
 
 import pandas as pd
-import os
+
+from data_store import read_table, table_exists, write_table
 
 
 def crear_csv_consolidado():
@@ -30,8 +31,8 @@ def crear_csv_consolidado():
     resumen_data = []
 
     for archivo in archivos:
-        if os.path.exists(archivo):
-            df = pd.read_csv(archivo)
+        if table_exists(archivo):
+            df = read_table(archivo)
             numero_usuario = archivo.split('_u')[1].split('.')[0]
             df['Usuario'] = f"Usuario_{numero_usuario}"
             dataframes.append(df)
@@ -66,7 +67,7 @@ def crear_csv_consolidado():
 
     try:
         # Guardar archivo principal
-        df_consolidado.to_csv(archivo_consolidado, index=False)
+        write_table(df_consolidado, archivo_consolidado, partition_by='Usuario')
         print(f"✅ Archivo principal: {archivo_consolidado}")
         print(f"   📈 Total registros: {len(df_consolidado):,}")
 
@@ -0,0 +1,311 @@
+"""
+data_store.py
+Capa de Almacenamiento Columnar (Parquet) con Respaldo CSV
+
+Las tablas diarias (DB_final_v3_u*.csv, DB_usuarios_consolidada*.csv) y
+semanales (analisis_u/semanal/weekly_*.csv) se guardan también en Parquet
+junto al CSV (mismo nombre con extensión .parquet): tipado, columnar y, en
+las tablas con varios usuarios, particionado por usuario (un archivo por
+usuario dentro de un directorio .parquet).
+
+La lectura usa el Parquet cuando existe y corresponde al CSV actual (el
+Parquet guarda en sus metadatos el tamaño y el hash del CSV escrito a la
+vez; la fecha de modificación no se usa porque git checkout o una copia la
+cambian sin cambiar el contenido), y lee sólo las columnas pedidas. Si no
+hay motor Parquet (pyarrow), el Parquet no existe o no corresponde, se lee
+el CSV. El CSV se lee con float_precision='round_trip': pandas escribe los
+float con repr, así que se recuperan los mismos valores que guarda el
+Parquet y los resultados no dependen de que pyarrow esté instalado.
+
+iter_table() lee la tabla por lotes (grupos de filas del Parquet o
+chunksize del CSV) con el mismo contenido y orden de filas que read_table().
+
+Uso:
+    from data_store import read_table, write_table
+    write_table(df_consolidado, OUTPUT_DIR / 'weekly_consolidado.csv',
+                partition_by='usuario_id')
+    df = read_table(OUTPUT_DIR / 'weekly_consolidado.csv',
+                    columns=['usuario_id', 'semana_inicio', 'HRV_SDNN_p50'])
+    for df_lote in iter_table(OUTPUT_DIR / 'weekly_consolidado.csv',
+                              chunksize=50000):
+        ...
+"""
+
+import hashlib
+import importlib.util
+import json
+import shutil
+from pathlib import Path
+from urllib.parse import unquote
+
+import pandas as pd
+
+PARQUET_DISPONIBLE = importlib.util.find_spec('pyarrow') is not None
+
+# Exportar también CSV al escribir (para Excel y revisión manual)
+EXPORTAR_CSV = True
+
+# Opciones de lectura CSV comunes a read_table, iter_table y lecturas
+# parciales de otros módulos: float exactos, iguales a los del Parquet
+OPCIONES_CSV = {'float_precision': 'round_trip'}
+
+# Clave de los metadatos Parquet con el tamaño y hash del CSV de origen
+CLAVE_FUENTE = b'data_store.fuente_csv'
+
+# Hashes ya calculados en este proceso: (ruta, tamaño, mtime_ns) -> firma
+_firmas = {}
+
+
+def parquet_path(csv_path):
+    """Ruta del Parquet asociado a un CSV"""
+    return Path(csv_path).with_suffix('.parquet')
+
+
+def _firma_csv(csv_path):
+    """Tamaño y hash blake2b del contenido del CSV"""
+    csv = Path(csv_path)
+    st = csv.stat()
+    clave = (str(csv.resolve()), st.st_size, st.st_mtime_ns)
+    if clave not in _firmas:
+        h = hashlib.blake2b(digest_size=16)
+        with open(csv, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloque)
+        _firmas[clave] = {'bytes': st.st_size, 'blake2b': h.hexdigest()}
+    return _firmas[clave]
+
+
+def _esquema(pq):
+    """Esquema Parquet del archivo o de la primera partición"""
+    import pyarrow.parquet as pa_pq
+    archivo = pq if pq.is_file() else next(pq.rglob('*.parquet'))
+    return pa_pq.read_schema(archivo)
+
+
+def _usar_parquet(csv_path):
+    """True si hay motor Parquet y el Parquet corresponde al CSV actual"""
+    pq = parquet_path(csv_path)
+    if not (PARQUET_DISPONIBLE and pq.exists()):
+        return False
+    csv = Path(csv_path)
+    if not csv.exists():
+        return True
+    # Se compara primero el tamaño (sin leer el CSV) y luego el hash
+    fuente = (_esquema(pq).metadata or {}).get(CLAVE_FUENTE)
+    if fuente is None:
+        return False
+    fuente = json.loads(fuente)
+    if fuente is None or fuente['bytes'] != csv.stat().st_size:
+        return False
+    return fuente == _firma_csv(csv)
+
+
+def _metadatos_pandas(pq):
+    """Metadatos pandas (orden de columnas, índice) del Parquet o partición"""
+    return _esquema(pq).pandas_metadata or {}
+
+
+def _columnas_metadatos(meta):
+    indices = [c for c in meta.get('index_columns', []) if isinstance(c, str)]
+    return [c['name'] for c in meta.get('columns', [])
+            if c['name'] is not None and c['name'] not in indices]
+
+
+def table_exists(csv_path):
+    """True si la tabla existe en CSV o en Parquet legible"""
+    return Path(csv_path).exists() or (
+        PARQUET_DISPONIBLE and parquet_path(csv_path).exists())
+
+
+def read_columns(csv_path):
+    """Nombres de columna de la tabla, sin leer los datos"""
+    if _usar_parquet(csv_path):
+        return _columnas_metadatos(_metadatos_pandas(parquet_path(csv_path)))
+    return list(pd.read_csv(csv_path, nrows=0, **OPCIONES_CSV).columns)
+
+
+def read_table(csv_path, columns=None, **kwargs_csv):
+    """
+    Lee una tabla guardada con write_table (o un CSV existente).
+
+    Args:
+        csv_path: ruta del CSV de la tabla
+        columns: columnas a leer (proyección); None = todas
+        **kwargs_csv: argumentos extra para pd.read_csv (sólo respaldo CSV;
+            se suman a OPCIONES_CSV)
+
+    Returns:
+        DataFrame con las columnas en el orden pedido (o el original)
+    """
+    if columns is not None:
+        columns = list(columns)
+
+    if not _usar_parquet(csv_path):
+        df = pd.read_csv(csv_path, usecols=columns, **{**OPCIONES_CSV, **kwargs_csv})
+        return df if columns is None else df[columns]
+
+    pq = parquet_path(csv_path)
+    df = pd.read_parquet(pq, columns=columns)
+    if pq.is_dir():
+        # Tabla particionada: la columna de partición vuelve como categoría y
+        # las filas agrupadas por directorio; se restauran tipo texto, orden
+        # original de filas (índice guardado) y de columnas
+        for col in df.columns[df.dtypes == 'category']:
+            df[col] = df[col].astype(str)
+        df = df.sort_index().reset_index(drop=True)
+        orden = columns if columns is not None else \
+            _columnas_metadatos(_metadatos_pandas(pq))
+        df = df[[c for c in orden if c in df.columns]]
+    return df
+
+
+def _particiones_en_orden(pq):
+    """
+    Archivos de un Parquet particionado en el orden original de filas.
+
+    Cada partición conserva el índice guardado por write_table. Si las
+    particiones ocupan rangos de filas contiguos y ordenados (tablas
+    concatenadas por usuario), leerlas una tras otra reproduce el orden de
+    read_table; si no, devuelve None.
+    """
+    import pyarrow.parquet as pa_pq
+    indices = [c for c in _metadatos_pandas(pq).get('index_columns', [])
+               if isinstance(c, str)]
+    if len(indices) != 1:
+        return None
+    rangos = []
+    for archivo in pq.rglob('*.parquet'):
+        idx = pa_pq.read_table(archivo, columns=indices).column(0).to_numpy()
+        if len(idx) == 0:
+            continue
+        if (idx[1:] <= idx[:-1]).any():
+            return None
+        rangos.append((int(idx[0]), int(idx[-1]), archivo))
+    rangos.sort(key=lambda r: r[0])
+    if any(r[0] <= previo[1] for previo, r in zip(rangos, rangos[1:])):
+        return None
+    return [archivo for _, _, archivo in rangos]
+
+
+def _lotes_parquet(csv_path, columns):
+    """Lotes (DataFrames) del Parquet en el orden original de filas"""
+    import pyarrow.parquet as pa_pq
+    pq = parquet_path(csv_path)
+    if pq.is_file():
+        for lote in pa_pq.ParquetFile(pq).iter_batches(columns=columns):
+            yield lote.to_pandas()
+        return
+
+    archivos = _particiones_en_orden(pq)
+    if archivos is None:
+        yield read_table(csv_path, columns=columns)
+        return
+    meta = _metadatos_pandas(pq)
+    orden = columns if columns is not None else _columnas_metadatos(meta)
+    indices = [c for c in meta['index_columns'] if isinstance(c, str)]
+    for archivo in archivos:
+        # Columnas de partición: vienen del nombre del directorio (clave=valor)
+        particion = dict(unquote(parte).split('=', 1)
+                         for parte in archivo.relative_to(pq).parts[:-1])
+        leer = None if columns is None else \
+            [c for c in columns if c not in particion] + indices
+        for lote in pa_pq.ParquetFile(archivo).iter_batches(columns=leer):
+            df = lote.to_pandas()
+            for col, valor in particion.items():
+                df[col] = pd.Series(valor, index=df.index, dtype=str)
+            yield df[[c for c in orden if c in df.columns]]
+
+
+def iter_table(csv_path, columns=None, chunksize=50000):
+    """
+    Lee una tabla guardada con write_table (o un CSV existente) por lotes.
+
+    Concatenar los lotes da lo mismo que read_table(csv_path, columns), sea
+    cual sea el origen (Parquet o CSV); todos los lotes tienen chunksize
+    filas salvo el último, como pd.read_csv(chunksize=...).
+
+    Args:
+        csv_path: ruta del CSV de la tabla
+        columns: columnas a leer (proyección); None = todas
+        chunksize: filas por lote
+
+    Yields:
+        DataFrame por lote, con índice correlativo entre lotes
+    """
+    if columns is not None:
+        columns = list(columns)
+
+    if not _usar_parquet(csv_path):
+        for df in pd.read_csv(csv_path, usecols=columns, chunksize=chunksize,
+                              **OPCIONES_CSV):
+            yield df if columns is None else df[columns]
+        return
+
+    # Los grupos de filas del Parquet no tienen el tamaño pedido: se
+    # re-empaquetan en lotes de chunksize filas
+    pendientes = []
+    n_pendientes = 0
+    inicio = 0
+    for df in _lotes_parquet(csv_path, columns):
+        pendientes.append(df)
+        n_pendientes += len(df)
+        while n_pendientes >= chunksize:
+            bloque = pd.concat(pendientes, ignore_index=True)
+            lote, resto = bloque.iloc[:chunksize], bloque.iloc[chunksize:]
+            yield lote.set_axis(pd.RangeIndex(inicio, inicio + chunksize))
+            inicio += chunksize
+            pendientes = [resto]
+            n_pendientes = len(resto)
+    if n_pendientes:
+        bloque = pd.concat(pendientes, ignore_index=True)
+        yield bloque.set_axis(pd.RangeIndex(inicio, inicio + n_pendientes))
+
+
+def _fechas_a_texto(df):
+    """Columnas con objetos date/datetime -> texto ISO (como quedan en CSV)"""
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) in ('date', 'datetime', 'mixed'):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def write_table(df, csv_path, partition_by=None, csv=None):
+    """
+    Guarda una tabla en CSV y, si hay motor, en Parquet.
+
+    Args:
+        df: DataFrame a guardar
+        csv_path: ruta del CSV; el Parquet va al lado con extensión .parquet
+        partition_by: columna de partición (p. ej. 'usuario_id'); el Parquet
+            queda como directorio con un archivo por valor
+        csv: exportar CSV (por defecto EXPORTAR_CSV; siempre si no hay Parquet)
+    """
+    csv_path = Path(csv_path)
+    if csv is None:
+        csv = EXPORTAR_CSV
+
+    # CSV primero: el Parquet registra su tamaño y hash para ser leído en
+    # su lugar. Sin exportar CSV se registra el que haya (o ninguno), de
+    # modo que el Parquet recién escrito siga teniendo prioridad
+    if csv or not PARQUET_DISPONIBLE:
+        df.to_csv(csv_path, index=False)
+    if not PARQUET_DISPONIBLE:
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pa_pq
+    fuente = _firma_csv(csv_path) if csv_path.exists() else None
+
+    pq = parquet_path(csv_path)
+    if pq.is_dir():
+        shutil.rmtree(pq)
+    elif pq.exists():
+        pq.unlink()
+
+    tabla = pa.Table.from_pandas(_fechas_a_texto(df.reset_index(drop=True)),
+                                 preserve_index=bool(partition_by))
+    tabla = tabla.replace_schema_metadata(
+        {**tabla.schema.metadata, CLAVE_FUENTE: json.dumps(fuente).encode()})
+    if partition_by:
+        pa_pq.write_to_dataset(tabla, pq, partition_cols=[partition_by])
+    else:
+        pa_pq.write_table(tabla, pq)
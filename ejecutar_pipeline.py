@@ -0,0 +1,473 @@
+"""
+ejecutar_pipeline.py
+Ejecutor del Pipeline (DAG) con Caché por Hash de Contenido
+
+Declara los pasos numerados (00 … 12) con sus entradas y salidas, tal como
+aparecen en el docstring de cada script, y deduce de ahí las dependencias:
+un paso depende de otro si lee alguno de sus archivos de salida.
+
+Antes de ejecutar un paso se calcula su huella: hash del script, de los
+módulos compartidos que usa y del contenido de todas sus entradas. El paso
+se omite si la huella coincide con la de su última ejecución correcta y sus
+salidas siguen siendo las que dejó; si un paso se re-ejecuta pero produce
+salidas idénticas, los pasos siguientes tampoco se repiten.
+
+Las ramas independientes se ejecutan en paralelo (--workers), p. ej. 05
+(missingness/ACF) junto a 06 (QC y clustering), o 07/08 junto a 10.
+
+Los pasos 00, 00b y 01 preparan la zona de trabajo desde las exportaciones
+originales (fuera del repositorio) y 01 modifica DB_final_v3_u*.csv en el
+mismo archivo; sólo se incluyen con --preparacion. Sin esa opción los
+DB_final_v3_u*.csv y las auditorías FC_walk son los insumos del DAG.
+
+Uso:
+    python ejecutar_pipeline.py                    # todo lo desactualizado
+    python ejecutar_pipeline.py --workers 3        # ramas en paralelo
+    python ejecutar_pipeline.py --pasos 09 12      # sólo esos y sus previos
+    python ejecutar_pipeline.py --plan             # mostrar qué se ejecutaría
+    python ejecutar_pipeline.py --pasos 07 --forzar
+
+Estado y logs por paso en analisis_u/pipeline/.
+
+Autor: Pipeline automatizado
+"""
+
+import argparse
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+from data_store import parquet_path
+
+# ==============================================================================
+# CONFIGURACIÓN
+# ==============================================================================
+
+BASE_DIR = Path(__file__).parent.resolve()
+PIPELINE_DIR = BASE_DIR / 'analisis_u' / 'pipeline'
+ESTADO_FILE = PIPELINE_DIR / 'pipeline_estado.json'
+LOGS_DIR = PIPELINE_DIR / 'logs'
+
+AUDITORIAS = 'analisis_u/FC_walk_imputacion_V3_u*.csv'
+WEEKLY_CONSOLIDADO = 'analisis_u/semanal/weekly_consolidado.csv'
+FEATURE_CACHE = ['analisis_u/semanal/feature_cache/weekly_consolidado_features.npy',
+                 'analisis_u/semanal/feature_cache/weekly_consolidado_features_index.csv']
+FUZZY_CONFIG = ['fuzzy_config/fuzzy_membership_config.yaml',
+                'fuzzy_config/feature_scalers.json']
+FUZZY_OUTPUT = 'analisis_u/fuzzy/fuzzy_output.csv'
+CLUSTER_ASSIGNMENTS = 'analisis_u/clustering/cluster_assignments.csv'
+
+# Pasos en orden del pipeline. Rutas relativas a BASE_DIR (admiten comodines);
+# 'modulos' son los módulos compartidos que el script importa.
+PASOS = {
+    '00': {
+        'nombre': 'Control de insumos (copiar auditorías FC_walk)',
+        'script': '00_control_insumos.py',
+        'entradas': ['../apple_health_export/apple_health_export_*/FC_walk_imputacion_V3.csv'],
+        'salidas': [f'analisis_u/FC_walk_imputacion_V3_u{i}.csv'
+                    for i in range(1, 11) if i != 5],
+        'preparacion': True
+    },
+    '00b': {
+        'nombre': 'Copiar auditoría FC_walk de u5',
+        'script': '00b_copiar_auditoria_esmeralda.py',
+        'entradas': ['../apple_health_export/apple_health_export_esmeralda/'
+                     'apple_health_export/FC_walk_imputacion_V3.csv'],
+        'salidas': ['analisis_u/FC_walk_imputacion_V3_u5.csv'],
+        'preparacion': True
+    },
+    '01': {
+        'nombre': 'Variables derivadas (DB_final_v3, en el mismo archivo)',
+        'script': '01_agregar_variables_derivadas.py',
+        'modulos': ['data_store.py'],
+        'entradas': ['DB_final_v3_u*.csv'],
+        'salidas': ['DB_final_v3_u*.csv'],
+        'preparacion': True
+    },
+    '04': {
+        'nombre': 'Agregación semanal',
+        'script': 'agregacion_semanal_v1.py',
+        'modulos': ['data_store.py'],
+        'entradas': ['DB_final_v3_u*.csv', AUDITORIAS],
+        'salidas': ['analisis_u/semanal/weekly_u*.csv', WEEKLY_CONSOLIDADO,
+                    'analisis_u/semanal/cluster_inputs_weekly.csv']
+    },
+    '04c': {
+        'nombre': 'Caché de features',
+        'script': 'feature_cache.py',
+        'modulos': ['data_store.py'],
+        'entradas': [WEEKLY_CONSOLIDADO],
+        'salidas': FEATURE_CACHE
+    },
+    '05': {
+        'nombre': 'Missingness y ACF',
+        'script': 'analisis_u/05_missingness_y_acf.py',
+        'modulos': ['acf_engine.py'],
+        'entradas': ['analisis_u/semanal/weekly_u*.csv', AUDITORIAS],
+        'salidas': ['analisis_u/missingness_y_acf/*.csv']
+    },
+    '06': {
+        'nombre': 'QC pre-clustering',
+        'script': '06_precluster_qc.py',
+        'modulos': ['data_store.py', 'feature_cache.py', 'k_sweep.py', 'silhouette.py'],
+        'entradas': ['analisis_u/semanal/cluster_inputs_weekly.csv'],
+        'salidas': ['analisis_u/semanal/precluster/*.csv']
+    },
+    '06c': {
+        'nombre': 'Clustering semanal (K-means)',
+        'script': 'analisis_u/06_clustering_semana.py',
+        'modulos': ['data_store.py', 'feature_cache.py', 'k_sweep.py', 'silhouette.py'],
+        'entradas': FEATURE_CACHE,
+        'salidas': ['analisis_u/clustering/*.csv']
+    },
+    '07': {
+        'nombre': 'Configuración difusa (MF y escaladores)',
+        'script': '07_fuzzy_setup.py',
+        'modulos': ['quantile_sketch.py'],
+        'entradas': [WEEKLY_CONSOLIDADO],
+        'salidas': FUZZY_CONFIG
+    },
+    '08': {
+        'nombre': 'Inferencia difusa',
+        'script': '08_fuzzy_inference.py',
+        'modulos': ['fuzzy_engine.py', 'data_store.py'],
+        'entradas': ['analisis_u/semanal/weekly_consolidado*.csv'] + FUZZY_CONFIG,
+        'salidas': [FUZZY_OUTPUT]
+    },
+    '09': {
+        'nombre': 'Evaluación difuso vs clusters',
+        'script': '09_fuzzy_vs_clusters_eval.py',
+        'modulos': ['threshold_sweep.py'],
+        'entradas': [FUZZY_OUTPUT, CLUSTER_ASSIGNMENTS],
+        'salidas': ['analisis_u/fuzzy/09_eval_fuzzy_vs_cluster.txt',
+                    'analisis_u/fuzzy/discordancias_top20.csv']
+    },
+    '10': {
+        'nombre': 'Validación LOUO',
+        'script': '10_leave_one_user_out_validation.py',
+        'modulos': ['fuzzy_engine.py', 'data_store.py', 'feature_cache.py',
+                    'threshold_sweep.py'],
+        'entradas': FEATURE_CACHE,
+        'salidas': ['analisis_u/louo_results/louo_summary.csv']
+    },
+    '11': {
+        'nombre': 'Análisis de sensibilidad',
+        'script': '11_analisis_sensibilidad.py',
+        'modulos': ['fuzzy_engine.py', 'data_store.py', 'feature_cache.py',
+                    'threshold_sweep.py', 'global_sensitivity.py'],
+        'entradas': [FUZZY_OUTPUT, CLUSTER_ASSIGNMENTS] + FUZZY_CONFIG + FEATURE_CACHE,
+        'salidas': ['analisis_u/sensibilidad/*.csv']
+    },
+    '12': {
+        'nombre': 'Predicción Markov (semáforo)',
+        'script': '12_prediccion_markov_semaforo.py',
+        'modulos': ['markov_store.py', 'markov_high_order.py', 'feature_cache.py'],
+        'entradas': [FUZZY_OUTPUT],
+        'salidas': ['analisis_u/prediccion/*.csv']
+    }
+}
+
+# Log global
+LOG_LINES = []
+
+# ==============================================================================
+# FUNCIONES UTILITARIAS
+# ==============================================================================
+
+
+def log(msg):
+    """Registra mensaje en log y consola"""
+    LOG_LINES.append(msg)
+    print(msg, flush=True)
+
+
+def _coincide(patron_a, patron_b):
+    """True si dos rutas/patrones pueden referirse al mismo archivo"""
+    return fnmatch.fnmatch(patron_a, patron_b) or fnmatch.fnmatch(patron_b, patron_a)
+
+
+def dependencias(pasos):
+    """Pasos previos de cada paso: los que escriben algo que el paso lee"""
+    deps = {}
+    for p_id, paso in pasos.items():
+        deps[p_id] = [
+            otro_id for otro_id, otro in pasos.items()
+            if otro_id != p_id and list(pasos).index(otro_id) < list(pasos).index(p_id)
+            and any(_coincide(e, s) for e in paso['entradas'] for s in otro['salidas'])
+        ]
+    return deps
+
+
+def expandir(patrones):
+    """Archivos (relativos a BASE_DIR) que corresponden a los patrones"""
+    archivos = set()
+    for patron in patrones:
+        for ruta in glob.glob(str(BASE_DIR / patron)):
+            if os.path.isfile(ruta):
+                archivos.add(os.path.relpath(ruta, BASE_DIR).replace(os.sep, '/'))
+    return sorted(archivos)
+
+
+def _archivos_contenido(rel):
+    """Archivo más su Parquet asociado (data_store lee el que esté al día)"""
+    ruta = BASE_DIR / rel
+    archivos = [ruta]
+    if ruta.suffix == '.csv':
+        pq = parquet_path(ruta)
+        if pq.is_dir():
+            archivos += sorted(pq.rglob('*.parquet'))
+        elif pq.exists():
+            archivos.append(pq)
+    return archivos
+
+
+class HashArchivos:
+    """Hash de contenido por archivo, recalculado sólo si cambia tamaño o fecha"""
+
+    def __init__(self, cache=None):
+        self.cache = dict(cache or {})
+
+    def __call__(self, rel):
+        h = hashlib.blake2b(digest_size=16)
+        for archivo in _archivos_contenido(rel):
+            st = archivo.stat()
+            clave = str(archivo)
+            previo = self.cache.get(clave)
+            if previo and previo[0] == st.st_size and previo[1] == st.st_mtime_ns:
+                digest = previo[2]
+            else:
+                ha = hashlib.blake2b(digest_size=16)
+                with open(archivo, 'rb') as f:
+                    for bloque in iter(lambda: f.read(1 << 20), b''):
+                        ha.update(bloque)
+                digest = ha.hexdigest()
+                self.cache[clave] = [st.st_size, st.st_mtime_ns, digest]
+            h.update(digest.encode())
+        return h.hexdigest()
+
+
+def huella(paso, hash_archivo):
+    """Hash de script, módulos, argumentos y contenido de las entradas"""
+    h = hashlib.blake2b(digest_size=16)
+    for rel in [paso['script']] + paso.get('modulos', []):
+        h.update(f"{rel}:{hash_archivo(rel)}\n".encode())
+    h.update(json.dumps(paso.get('args', [])).encode())
+    for rel in expandir(paso['entradas']):
+        h.update(f"{rel}:{hash_archivo(rel)}\n".encode())
+    return h.hexdigest()
+
+
+def hashes_salidas(paso, hash_archivo):
+    return {rel: hash_archivo(rel) for rel in expandir(paso['salidas'])}
+
+
+def al_dia(p_id, paso, estado, hash_archivo):
+    """Motivo para ejecutar el paso, o None si está al día"""
+    previo = estado['pasos'].get(p_id)
+    if previo is None:
+        return 'sin ejecución previa'
+    if previo['huella'] != huella(paso, hash_archivo):
+        return 'entradas o código modificados'
+    if previo['salidas'] != hashes_salidas(paso, hash_archivo):
+        return 'salidas ausentes o modificadas'
+    return None
+
+
+def cargar_estado():
+    if ESTADO_FILE.exists():
+        with open(ESTADO_FILE, encoding='utf-8') as f:
+            return json.load(f)
+    return {'pasos': {}, 'archivos': {}}
+
+
+def guardar_estado(estado):
+    PIPELINE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = ESTADO_FILE.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, ESTADO_FILE)
+
+
+def ejecutar_paso(p_id, paso):
+    """Ejecuta el script en un proceso aparte; salida completa al log del paso"""
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    log_file = LOGS_DIR / f"{p_id}_{Path(paso['script']).stem}.log"
+    env = dict(os.environ, MPLBACKEND='Agg', PYTHONIOENCODING='utf-8')
+    inicio = time.perf_counter()
+    with open(log_file, 'w', encoding='utf-8') as f:
+        proc = subprocess.run([sys.executable, paso['script']] + paso.get('args', []),
+                              cwd=BASE_DIR, stdout=f, stderr=subprocess.STDOUT, env=env)
+    return proc.returncode, time.perf_counter() - inicio, log_file
+
+
+# ==============================================================================
+# EJECUCIÓN
+# ==============================================================================
+
+
+def seleccionar(objetivos, preparacion):
+    """Pasos a considerar: los pedidos más todos sus previos"""
+    pasos = {p_id: p for p_id, p in PASOS.items()
+             if preparacion or not p.get('preparacion')}
+    deps = dependencias(pasos)
+    if not objetivos:
+        return pasos, deps
+
+    desconocidos = [o for o in objetivos if o not in pasos]
+    if desconocidos:
+        raise SystemExit(f"❌ Pasos desconocidos: {desconocidos} "
+                         f"(disponibles: {', '.join(pasos)})")
+    elegidos = set()
+    pila = list(objetivos)
+    while pila:
+        p_id = pila.pop()
+        if p_id not in elegidos:
+            elegidos.add(p_id)
+            pila.extend(deps[p_id])
+    pasos = {p_id: p for p_id, p in pasos.items() if p_id in elegidos}
+    return pasos, {p_id: deps[p_id] for p_id in pasos}
+
+
+def mostrar_plan(pasos, deps, estado, hash_archivo, forzados):
+    """Qué se ejecutaría, sin ejecutar nada"""
+    log(f"{'Paso':<5} {'Script':<38} {'Depende de':<14} Estado")
+    a_ejecutar = set()
+    for p_id, paso in pasos.items():
+        motivo = 'forzado' if p_id in forzados else \
+            al_dia(p_id, paso, estado, hash_archivo)
+        previos = [d for d in deps[p_id] if d in a_ejecutar]
+        if motivo is None and previos:
+            motivo = f"si cambian las salidas de {', '.join(previos)}"
+        if motivo is not None:
+            a_ejecutar.add(p_id)
+        log(f"{p_id:<5} {paso['script']:<38} {','.join(deps[p_id]) or '-':<14} "
+            f"{'EJECUTAR: ' + motivo if motivo else 'al día'}")
+
+
+def ejecutar(pasos, deps, estado, hash_archivo, forzados, workers):
+    """Planificación topológica: lanza cada paso cuando terminan sus previos"""
+    resultado = {}
+    pendientes = list(pasos)
+    en_curso = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pendientes or en_curso:
+            avance = True
+            while avance and len(en_curso) < workers:
+                avance = False
+                for p_id in list(pendientes):
+                    if any(d not in resultado for d in deps[p_id]):
+                        continue
+                    pendientes.remove(p_id)
+                    avance = True
+                    fallidos = [d for d in deps[p_id]
+                                if resultado[d] in ('error', 'bloqueado')]
+                    if fallidos:
+                        resultado[p_id] = 'bloqueado'
+                        log(f"⛔ {p_id}: no se ejecuta (falló {', '.join(fallidos)})")
+                        continue
+                    motivo = 'forzado' if p_id in forzados else \
+                        al_dia(p_id, pasos[p_id], estado, hash_archivo)
+                    if motivo is None:
+                        resultado[p_id] = 'omitido'
+                        log(f"⏭️  {p_id}: al día ({pasos[p_id]['script']})")
+                        continue
+                    log(f"▶️  {p_id}: {pasos[p_id]['nombre']} [{motivo}]")
+                    en_curso[pool.submit(ejecutar_paso, p_id, pasos[p_id])] = p_id
+                    if len(en_curso) >= workers:
+                        break
+
+            if not en_curso:
+                continue
+            terminados, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminados:
+                p_id = en_curso.pop(futuro)
+                codigo, segundos, log_file = futuro.result()
+                if codigo != 0:
+                    resultado[p_id] = 'error'
+                    log(f"❌ {p_id}: terminó con código {codigo} ({segundos:.1f}s); "
+                        f"ver {log_file.relative_to(BASE_DIR)}")
+                    continue
+                # Huella después de ejecutar: un paso que reescribe sus
+                # entradas (01) queda al día con el contenido que dejó
+                estado['pasos'][p_id] = {
+                    'huella': huella(pasos[p_id], hash_archivo),
+                    'salidas': hashes_salidas(pasos[p_id], hash_archivo),
+                    'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'segundos': round(segundos, 1)
+                }
+                estado['archivos'] = hash_archivo.cache
+                guardar_estado(estado)
+                resultado[p_id] = 'ok'
+                log(f"✅ {p_id}: completado en {segundos:.1f}s")
+
+    return resultado
+
+
+def main(objetivos=None, workers=1, forzar=False, plan=False, preparacion=False):
+    log("="*80)
+    log("EJECUCIÓN DEL PIPELINE (DAG)")
+    log("="*80)
+    log(f"Inicio: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+
+    pasos, deps = seleccionar(objetivos, preparacion)
+    estado = cargar_estado()
+    hash_archivo = HashArchivos(estado.get('archivos'))
+    if forzar:
+        forzados = set(objetivos) if objetivos else set(pasos)
+    else:
+        forzados = set()
+
+    log(f"Pasos considerados: {', '.join(pasos)}")
+    if workers > 1:
+        log(f"Pasos en paralelo: hasta {workers}")
+    log("")
+
+    if plan:
+        mostrar_plan(pasos, deps, estado, hash_archivo, forzados)
+        return 0
+
+    inicio = time.perf_counter()
+    resultado = ejecutar(pasos, deps, estado, hash_archivo, forzados, workers)
+    estado['archivos'] = hash_archivo.cache
+    guardar_estado(estado)
+
+    log("")
+    log("="*80)
+    log("RESUMEN")
+    log("="*80)
+    for clave, etiqueta in [('ok', 'Ejecutados'), ('omitido', 'Al día (omitidos)'),
+                            ('error', 'Con error'), ('bloqueado', 'Bloqueados')]:
+        ids = [p_id for p_id in pasos if resultado.get(p_id) == clave]
+        if ids:
+            log(f"{etiqueta}: {', '.join(ids)}")
+    log(f"Tiempo total: {time.perf_counter() - inicio:.1f}s")
+    log("="*80)
+
+    return 1 if any(r in ('error', 'bloqueado') for r in resultado.values()) else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Ejecuta el pipeline omitiendo los pasos al día')
+    parser.add_argument('--pasos', nargs='+', default=None,
+                        help='Pasos objetivo (se incluyen sus previos); por defecto todos')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Pasos independientes en paralelo (1 = secuencial)')
+    parser.add_argument('--forzar', action='store_true',
+                        help='Re-ejecutar los pasos objetivo aunque estén al día')
+    parser.add_argument('--plan', action='store_true',
+                        help='Mostrar qué pasos se ejecutarían, sin ejecutarlos')
+    parser.add_argument('--preparacion', action='store_true',
+                        help='Incluir los pasos 00, 00b y 01 (preparación de insumos)')
+    args = parser.parse_args()
+    sys.exit(main(objetivos=args.pasos, workers=args.workers, forzar=args.forzar,
+                  plan=args.plan, preparacion=args.preparacion))
@@ -0,0 +1,294 @@
+"""
+feature_cache.py
+Caché en Disco de la Matriz de Features (memory-mapped)
+
+Las 8 features de clustering (que incluyen las 4 del sistema difuso) se
+extraen una sola vez de weekly_consolidado.csv y se guardan como una matriz
+contigua .npy (semanas x features, float64) más un índice con las claves
+(usuario_id, semana_inicio) y las columnas de calidad. Los pasos 06, 10 y 11
+abren la matriz con np.load(mmap_mode='r'), sin volver a parsear el CSV.
+
+Los valores crudos se guardan en float64 para que las columnas originales
+que los pasos publican (p. ej. scaled_matrix.csv, cluster_centroids.csv)
+coincidan con la fuente. load_scaled guarda además la matriz escalada con
+RobustScaler (y el escalador ajustado) para un subconjunto de filas, de
+modo que los K-sweeps de 06_precluster_qc.py, completar_k_sweep.py y
+06_clustering_semana.py no re-ajustan el escalador en cada ejecución. La
+matriz escalada también queda en float64, tal como sale del escalador:
+los pasos publican sus valores (scaled_matrix.csv, pca_2d.csv, centroides,
+inertia del K-sweep) y deben coincidir con un ajuste directo.
+
+La fuente por defecto es weekly_consolidado.csv; cualquier tabla con las
+mismas columnas (p. ej. cluster_inputs_weekly.csv) tiene su propia caché.
+
+La caché se invalida por un hash del contenido de la fuente (CSV y, si
+existe, su Parquet); el tamaño y la fecha de modificación sólo se usan para
+evitar recalcular el hash cuando el archivo no cambió.
+
+Uso:
+    from feature_cache import load_features, feature_frame
+    index, X = load_features()              # X: memmap (n_semanas x 8)
+    df = feature_frame(FEATURES_FUZZY)      # DataFrame claves + features
+    X_scaled, scaler = load_scaled(CLUSTER_FEATURES)
+"""
+
+import hashlib
+import json
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from data_store import parquet_path, read_columns, read_table, write_table
+
+BASE_DIR = Path(__file__).parent.resolve()
+SOURCE_FILE = BASE_DIR / 'analisis_u' / 'semanal' / 'weekly_consolidado.csv'
+CACHE_DIR = BASE_DIR / 'analisis_u' / 'semanal' / 'feature_cache'
+
+CLUSTER_FEATURES = [
+    'Actividad_relativa_p50', 'Actividad_relativa_iqr',
+    'Superavit_calorico_basal_p50', 'Superavit_calorico_basal_iqr',
+    'HRV_SDNN_p50', 'HRV_SDNN_iqr',
+    'Delta_cardiaco_p50', 'Delta_cardiaco_iqr'
+]
+
+FUZZY_FEATURES = [
+    'Actividad_relativa_p50',
+    'Superavit_calorico_basal_p50',
+    'HRV_SDNN_p50',
+    'Delta_cardiaco_p50'
+]
+
+CACHE_FEATURES = CLUSTER_FEATURES + \
+    [f for f in FUZZY_FEATURES if f not in CLUSTER_FEATURES]
+
+# Claves y columnas de calidad (mismas que cluster_inputs_weekly.csv)
+INDEX_COLS = ['usuario_id', 'usuario_alias', 'semana_inicio',
+              'dias_monitoreados', 'flag_baja_cobertura', 'pct_imputada_FC_walk']
+
+CACHE_DTYPE = np.float64    # features crudas
+SCALED_DTYPE = np.float64   # matriz escalada (load_scaled), se publica
+
+
+def _tmp_unico(path):
+    """Ruta temporal propia del proceso, para escribir y luego os.replace"""
+    path = Path(path)
+    return path.with_name(f'{path.stem}.{os.getpid()}.tmp{path.suffix}')
+
+
+def _guardar_meta(meta, meta_path):
+    tmp = _tmp_unico(meta_path)
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, meta_path)
+
+
+def _rutas(source):
+    stem = Path(source).stem
+    return (CACHE_DIR / f'{stem}_features.npy',
+            CACHE_DIR / f'{stem}_features_index.csv',
+            CACHE_DIR / f'{stem}_features_meta.json')
+
+
+def _archivos_fuente(source):
+    pq = parquet_path(source)
+    archivos = [Path(source)] if Path(source).exists() else []
+    if pq.is_dir():
+        archivos += sorted(pq.rglob('*.parquet'))
+    elif pq.exists():
+        archivos.append(pq)
+    return archivos
+
+
+def _stat_fuente(source):
+    return [[str(a), a.stat().st_size, a.stat().st_mtime_ns]
+            for a in _archivos_fuente(source)]
+
+
+def hash_fuente(source=SOURCE_FILE):
+    """Hash del contenido de la fuente (CSV y Parquet asociado)"""
+    h = hashlib.blake2b(digest_size=16)
+    for archivo in _archivos_fuente(source):
+        with open(archivo, 'rb') as f:
+            for bloque in iter(lambda: f.read(1 << 20), b''):
+                h.update(bloque)
+    return h.hexdigest()
+
+
+def build_cache(source=SOURCE_FILE):
+    """Extrae las features de la fuente y escribe matriz, índice y metadatos"""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    npy_path, index_path, meta_path = _rutas(source)
+
+    columnas = read_columns(source)
+    index_cols = [c for c in INDEX_COLS if c in columnas]
+    features = [f for f in CACHE_FEATURES if f in columnas]
+    df = read_table(source, columns=index_cols + features)
+
+    X = np.ascontiguousarray(df[features].to_numpy(dtype=CACHE_DTYPE))
+    tmp = _tmp_unico(npy_path)
+    np.save(tmp, X)
+    os.replace(tmp, npy_path)
+    # Índice a un temporal y renombrado: Parquet primero y CSV al final, de
+    # modo que un lector ve el índice anterior completo o el nuevo
+    tmp = _tmp_unico(index_path)
+    write_table(df[index_cols], tmp)
+    if parquet_path(tmp).exists():
+        os.replace(parquet_path(tmp), parquet_path(index_path))
+    os.replace(tmp, index_path)
+
+    # Matrices escaladas de versiones anteriores de la fuente. Se limpian
+    # aquí (paso 04c del pipeline, antes de que 06/06c corran en paralelo)
+    # y no en load_scaled, donde otro proceso podría estar por abrirlas.
+    hash_actual = hash_fuente(source)
+    prefijo = f"{Path(source).stem}_scaled_{hash_actual[:12]}"
+    for viejo in CACHE_DIR.glob(f'{Path(source).stem}_scaled_*'):
+        if not viejo.name.startswith(prefijo):
+            viejo.unlink(missing_ok=True)
+
+    meta = {
+        'fuente': str(source),
+        'hash': hash_actual,
+        'stat': _stat_fuente(source),
+        'features': features,
+        'index_cols': index_cols,
+        'dtype': np.dtype(CACHE_DTYPE).name,
+        'shape': list(X.shape)
+    }
+    _guardar_meta(meta, meta_path)
+    return meta
+
+
+def _cache_valida(source):
+    """Metadatos si la caché corresponde al contenido actual de la fuente"""
+    npy_path, index_path, meta_path = _rutas(source)
+    if not (npy_path.exists() and meta_path.exists()):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('dtype') != np.dtype(CACHE_DTYPE).name:
+        return None
+
+    stat = _stat_fuente(source)
+    if meta['stat'] == stat:
+        return meta
+    if meta['hash'] != hash_fuente(source):
+        return None
+    # Mismo contenido (p. ej. archivo reescrito igual): actualizar stat
+    meta['stat'] = stat
+    _guardar_meta(meta, meta_path)
+    return meta
+
+
+def _abrir(features, source):
+    meta = _cache_valida(source) or build_cache(source)
+    npy_path, index_path, _ = _rutas(source)
+
+    X = np.load(npy_path, mmap_mode='r')
+    index = read_table(index_path, columns=meta['index_cols'])
+    if features is None:
+        return index, X, meta['features']
+
+    faltantes = [f for f in features if f not in meta['features']]
+    if faltantes:
+        raise KeyError(f"Features no disponibles en la caché: {faltantes}")
+    cols = [meta['features'].index(f) for f in features]
+    if cols == list(range(cols[0], cols[0] + len(cols))):
+        X = X[:, cols[0]:cols[0] + len(cols)]
+    else:
+        X = X[:, cols]
+    return index, X, list(features)
+
+
+def load_features(features=None, source=SOURCE_FILE):
+    """
+    Abre la matriz de features (reconstruyendo la caché si es necesario).
+
+    Args:
+        features: lista de features (None = todas las de la caché)
+        source: tabla semanal de origen
+
+    Returns:
+        (DataFrame índice, matriz n_semanas x n_features). Con features=None
+        o un bloque contiguo de columnas la matriz es una vista del memmap
+        (sin copia); en otro caso, una copia con las columnas pedidas.
+    """
+    index, X, _ = _abrir(features, source)
+    return index, X
+
+
+def feature_frame(features=None, source=SOURCE_FILE):
+    """DataFrame con las columnas del índice más las features pedidas"""
+    index, X, columnas = _abrir(features, source)
+    return pd.concat([index, pd.DataFrame(X, columns=columnas)], axis=1)
+
+
+def load_scaled(features=None, filas=None, source=SOURCE_FILE):
+    """
+    Matriz de features escalada con RobustScaler (ajustado sobre esas filas).
+
+    El resultado se guarda junto a la caché, identificado por el hash de la
+    fuente, las features y las filas (las versiones de fuentes anteriores se
+    eliminan al reconstruir la caché). Escalador y matriz se escriben en
+    archivos temporales del proceso y se renombran, la matriz al final: si
+    el .npy existe, el .pkl está completo, aunque otro proceso (p. ej. 06 y
+    06c en paralelo) esté escribiendo la misma entrada.
+
+    Args:
+        features: lista de features (None = todas las de la caché)
+        filas: posiciones o máscara booleana de filas (None = todas)
+        source: tabla semanal de origen
+
+    Returns:
+        (matriz escalada memory-mapped, RobustScaler ajustado)
+    """
+    from sklearn.preprocessing import RobustScaler
+
+    meta = _cache_valida(source) or build_cache(source)
+    _, X = load_features(features, source)
+    features = list(features) if features is not None else meta['features']
+    if filas is not None:
+        filas = np.asarray(filas)
+        if filas.dtype == bool:
+            filas = np.flatnonzero(filas)
+        if np.array_equal(filas, np.arange(len(X))):
+            filas = None
+
+    h = hashlib.blake2b(digest_size=8)
+    h.update(json.dumps(features).encode())
+    h.update(np.dtype(CACHE_DTYPE).name.encode())
+    h.update(np.dtype(SCALED_DTYPE).name.encode())
+    h.update(b'' if filas is None else filas.astype(np.int64).tobytes())
+    prefijo = f"{Path(source).stem}_scaled_{meta['hash'][:12]}"
+    npy_path = CACHE_DIR / f'{prefijo}_{h.hexdigest()}.npy'
+    scaler_path = npy_path.with_suffix('.pkl')
+
+    if not (npy_path.exists() and scaler_path.exists()):
+        X_sel = np.asarray(X if filas is None else X[filas])
+        scaler = RobustScaler()
+        X_scaled = np.ascontiguousarray(scaler.fit_transform(X_sel), dtype=SCALED_DTYPE)
+        tmp = _tmp_unico(scaler_path)
+        with open(tmp, 'wb') as f:
+            pickle.dump(scaler, f)
+        os.replace(tmp, scaler_path)
+        tmp = _tmp_unico(npy_path)
+        np.save(tmp, X_scaled)
+        os.replace(tmp, npy_path)
+
+    with open(scaler_path, 'rb') as f:
+        scaler = pickle.load(f)
+    return np.load(npy_path, mmap_mode='r'), scaler
+
+
+if __name__ == '__main__':
+    # Paso del pipeline: construir la caché (si no está al día) antes de que
+    # 06, 10 y 11 la abran en paralelo
+    meta = _cache_valida(SOURCE_FILE)
+    if meta is None:
+        meta = build_cache(SOURCE_FILE)
+        print(f"✅ Caché construida: {meta['shape'][0]} semanas x {meta['shape'][1]} features")
+    else:
+        print(f"✅ Caché al día: {meta['shape'][0]} semanas x {meta['shape'][1]} features")
+    print(f"   {CACHE_DIR}")
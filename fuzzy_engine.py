@@ -0,0 +1,425 @@
+"""
+fuzzy_engine.py
+Motor de Inferencia Difusa Compartido (Mamdani, AND = mínimo)
+
+Construye una sola vez, a partir de fuzzy_membership_config.yaml y
+feature_scalers.json, los puntos de quiebre escalados a [0,1], la matriz de
+antecedentes B y los vectores de pesos/salidas de la base de reglas. La
+evaluación trabaja sólo con arreglos NumPy:
+
+    escalar   X (n_semanas × n_features)  → [0,1] (clip p5-p95)
+    membresías                            → M (n_semanas × n_features*n_labels)
+    activación  W_ir = min_{j: B_rj=1} M_ij · peso_r
+    score_i   = Σ_r W_ir·salida_r / Σ_r W_ir   (neutral si Σ_r W_ir = 0)
+
+Modo LUT opcional (lut_bins=N): como las entradas escaladas viven en [0,1],
+las membresías se precalculan en una grilla de N+1 nodos por feature y se
+evalúan con un solo gather por (semana, feature) del valor y la pendiente
+de la celda, sin ramas. En las celdas que contienen un punto de quiebre la
+interpolación no es exacta (y dejaría una membresía > 0 fuera de (a, c],
+activando reglas en semanas que deberían quedar neutrales), así que esas
+celdas se evalúan con la triangular exacta. En el resto cada MF es lineal
+y la interpolación sólo difiere por redondeo: lut_error_max, medido en una
+grilla densa entre nodos, queda en ~1e-16. Con N = 4096 las membresías
+salen ~2x más rápido que las exactas y score() ~20% (el resto es la
+activación de reglas). La LUT sólo sirve para los breakpoints del sistema:
+score_lote() usa siempre las membresías exactas. comparar_lut() mide la
+diferencia a nivel de score y de semanas neutrales contra score().
+
+Modo lote (score_lote): evalúa muchos conjuntos de puntos de quiebre sobre
+la misma X en una sola pasada, con un eje adicional de conjunto
+(n_conjuntos × n_semanas × n_memb); p. ej. todos los shifts de un análisis
+de sensibilidad. Cada fila coincide exactamente con score() de un sistema
+construido con esos puntos de quiebre (sin LUT).
+
+Uso:
+    from fuzzy_engine import FuzzyInferenceSystem
+    fis = FuzzyInferenceSystem.from_files(CONFIG_FILE, SCALERS_FILE)
+    scores, firing = fis.score(df[fis.features].to_numpy(dtype=float))
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+BASE_DIR = Path(__file__).parent.resolve()
+CONFIG_DIR = BASE_DIR / 'fuzzy_config'
+CONFIG_FILE = CONFIG_DIR / 'fuzzy_membership_config.yaml'
+SCALERS_FILE = CONFIG_DIR / 'feature_scalers.json'
+
+# ============================================================================
+# BASE DE REGLAS
+# ============================================================================
+# Cada condición es (feature, etiqueta); la regla se activa sólo si todas sus
+# features están disponibles en el sistema.
+REGLAS_SEDENTARISMO = [
+    {
+        'id': 'R1',
+        'conditions': [('Actividad_relativa_p50', 'Baja'),
+                       ('Superavit_calorico_basal_p50', 'Baja')],
+        'output': 1.0,  # Alto sedentarismo
+        'weight': 1.0,
+        'description': 'Actividad Baja AND Superavit Bajo → Sedentarismo Alto'
+    },
+    {
+        'id': 'R2',
+        'conditions': [('Actividad_relativa_p50', 'Alta'),
+                       ('Superavit_calorico_basal_p50', 'Alta')],
+        'output': 0.0,  # Bajo sedentarismo
+        'weight': 1.0,
+        'description': 'Actividad Alta AND Superavit Alto → Sedentarismo Bajo'
+    },
+    {
+        'id': 'R3',
+        'conditions': [('HRV_SDNN_p50', 'Baja'),
+                       ('Delta_cardiaco_p50', 'Alta_Carga')],
+        'output': 0.9,  # Alto sedentarismo con riesgo CV
+        'weight': 1.0,
+        'description': 'HRV Baja AND Delta Alta_Carga → Sedentarismo Alto'
+    },
+    {
+        'id': 'R4',
+        'conditions': [('Actividad_relativa_p50', 'Media'),
+                       ('HRV_SDNN_p50', 'Media')],
+        'output': 0.5,  # Medio sedentarismo
+        'weight': 1.0,
+        'description': 'Actividad Media AND HRV Media → Sedentarismo Medio'
+    },
+    {
+        'id': 'R5',
+        'conditions': [('Actividad_relativa_p50', 'Baja'),
+                       ('Superavit_calorico_basal_p50', 'Media')],
+        'output': 0.7,  # Medio-Alto sedentarismo
+        'weight': 0.7,  # Peso modulado
+        'description': 'Actividad Baja AND Superavit Medio → Sedentarismo Medio-Alto'
+    },
+]
+
+SCORE_NEUTRAL = 0.5  # Score cuando ninguna regla se activa
+LUT_PUNTOS_POR_CELDA = 8  # Grilla densa para medir lut_error_max
+
+
+# ============================================================================
+# FUNCIONES DE MEMBRESÍA
+# ============================================================================
+
+
+def triangular_mf(x, points):
+    """Función de membresía triangular (referencia escalar)"""
+    a, b, c = points
+    if x <= a:
+        return 0.0
+    elif a < x <= b:
+        return (x - a) / (b - a) if b > a else 0.0
+    elif b < x <= c:
+        return (c - x) / (c - b) if c > b else 0.0
+    else:
+        return 0.0
+
+
+def triangular_mf_matrix(X, breakpoints):
+    """Membresías triangulares vectorizadas para todas las features y etiquetas.
+
+    X: matriz (n_semanas × n_features) ya escalada a [0,1].
+    breakpoints: arreglo (n_features × n_labels × 3) con los puntos (a, b, c).
+    Devuelve una matriz (n_semanas × n_features*n_labels) en orden
+    feature-mayor (feat1_lab1, feat1_lab2, ..., feat2_lab1, ...).
+
+    Replica exactamente triangular_mf: mismos tramos, mismas divisiones y
+    NaN → 0.0 (las comparaciones con NaN son falsas).
+    """
+    X = np.asarray(X, dtype=float)
+    bp = np.asarray(breakpoints, dtype=float)
+    memb = _triangular(X[:, :, None], bp[None, :, :, 0], bp[None, :, :, 1],
+                       bp[None, :, :, 2])
+    return memb.reshape(X.shape[0], -1)
+
+
+def triangular_mf_lote(X, breakpoints):
+    """triangular_mf_matrix para un lote de conjuntos de puntos de quiebre.
+
+    X: matriz (n_semanas × n_features) ya escalada a [0,1].
+    breakpoints: arreglo (n_conjuntos × n_features × n_labels × 3).
+    Devuelve (n_conjuntos × n_semanas × n_features*n_labels).
+    """
+    X = np.asarray(X, dtype=float)
+    bp = np.asarray(breakpoints, dtype=float)
+    memb = _triangular(X[None, :, :, None], bp[:, None, :, :, 0],
+                       bp[:, None, :, :, 1], bp[:, None, :, :, 2])
+    return memb.reshape(bp.shape[0], X.shape[0], -1)
+
+
+def _triangular(x, a, b, c):
+    """Tramos de la triangular con broadcasting entre x y (a, b, c)"""
+    # Denominadores seguros: los tramos degenerados se anulan con la máscara
+    ab = np.where(b > a, b - a, 1.0)
+    bc = np.where(c > b, c - b, 1.0)
+
+    subida = (x > a) & (x <= b) & (b > a)
+    bajada = (x > b) & (x <= c) & (c > b)
+    memb = np.where(subida, (x - a) / ab, 0.0)
+    return np.where(bajada, (c - x) / bc, memb)
+
+
+# ============================================================================
+# SISTEMA DE INFERENCIA
+# ============================================================================
+
+
+class FuzzyInferenceSystem:
+    """Sistema difuso compilado: breakpoints escalados + matrices de reglas.
+
+    mf_config: dict con la estructura de fuzzy_membership_config.yaml
+        {feature: {'labels': [...], 'membership_functions': {label: {'values': [a, b, c]}}}}
+    scalers: dict con la estructura de feature_scalers.json {feature: {'min', 'max'}}
+    rules: lista de reglas (ver REGLAS_SEDENTARISMO)
+
+    Sólo se usan las features presentes tanto en mf_config como en scalers,
+    en el orden de mf_config; ese es el orden de columnas que espera score().
+    """
+
+    def __init__(self, mf_config, scalers, rules=None, neutral=SCORE_NEUTRAL,
+                 lut_bins=None):
+        if rules is None:
+            rules = REGLAS_SEDENTARISMO
+
+        self.features = [f for f in mf_config if f in scalers]
+        self.labels = {f: list(mf_config[f]['membership_functions'])
+                       for f in self.features}
+        n_labels = {len(lbls) for lbls in self.labels.values()}
+        if len(n_labels) > 1:
+            raise ValueError(
+                f"Todas las features deben tener el mismo número de etiquetas: {self.labels}")
+
+        self.feat_min = np.array([scalers[f]['min'] for f in self.features],
+                                 dtype=float)
+        self.feat_max = np.array([scalers[f]['max'] for f in self.features],
+                                 dtype=float)
+
+        # Puntos de quiebre escalados a [0,1] y clipeados
+        breakpoints = []
+        self.memb_cols = []
+        self.breakpoints_raw = np.array(
+            [[mf_data['values'] for mf_data in mf_config[f]['membership_functions'].values()]
+             for f in self.features], dtype=float).reshape(len(self.features), -1, 3)
+        for feat in self.features:
+            feat_min = scalers[feat]['min']
+            feat_max = scalers[feat]['max']
+            bp_feat = []
+            for label, mf_data in mf_config[feat]['membership_functions'].items():
+                points_scaled = [(p - feat_min) / (feat_max - feat_min)
+                                 for p in mf_data['values']]
+                bp_feat.append([max(0, min(1, p)) for p in points_scaled])
+                self.memb_cols.append(f'{feat}_{label}_memb')
+            breakpoints.append(bp_feat)
+        self.breakpoints = np.array(breakpoints, dtype=float).reshape(
+            len(self.features), -1, 3)
+
+        # Reglas activas y matriz de antecedentes B (n_reglas × n_memb + 1).
+        # La última columna es de ceros: condiciones con etiqueta inexistente.
+        self.rules = [r for r in rules
+                      if all(feat in self.features for feat, _ in r['conditions'])]
+        self.B = np.zeros((len(self.rules), len(self.memb_cols) + 1),
+                          dtype=bool)
+        for r, rule in enumerate(self.rules):
+            for feat, label in rule['conditions']:
+                col = f'{feat}_{label}_memb'
+                j = self.memb_cols.index(col) if col in self.memb_cols else -1
+                self.B[r, j] = True
+        self.rule_ids = [r['id'] for r in self.rules]
+        self.weights = np.array([r['weight'] for r in self.rules], dtype=float)
+        self.outputs = np.array([r['output'] for r in self.rules], dtype=float)
+        self.neutral = float(neutral)
+
+        self.lut = None
+        self.lut_bins = None
+        self.lut_error_max = 0.0
+        if lut_bins:
+            self._construir_lut(int(lut_bins))
+
+    def _construir_lut(self, n_bins):
+        """Precalcula membresías en la grilla k/n_bins, k = 0..n_bins.
+
+        lut: tabla (n_features·n_bins × 2 × n_labels) con, por celda, el
+        valor en el nodo izquierdo y la pendiente hasta el derecho (un solo
+        gather por semana y feature). lut_exacta (n_features·n_bins) marca
+        las celdas que contienen algún quiebre de la feature (con una celda
+        de margen a cada lado por redondeo de p·n_bins); ésas se evalúan de
+        forma exacta en _membresias_lut. lut_error_max es el error de
+        membresía medido en una grilla densa (LUT_PUNTOS_POR_CELDA puntos por
+        celda) más los quiebres y su vecino derecho.
+        """
+        if n_bins < 1:
+            raise ValueError(f"lut_bins debe ser >= 1, recibido {n_bins}")
+        n_feat = len(self.features)
+        grid = np.linspace(0.0, 1.0, n_bins + 1)
+        G = np.repeat(grid[:, None], n_feat, axis=1)
+        nodos = triangular_mf_matrix(G, self.breakpoints).reshape(
+            n_bins + 1, n_feat, -1).transpose(1, 0, 2)
+        self.lut = np.stack([nodos[:, :-1], np.diff(nodos, axis=1)], axis=2) \
+            .reshape(n_feat * n_bins, 2, -1)
+        self.lut_bins = n_bins
+        self.lut_offset = np.arange(n_feat) * n_bins
+
+        celda = np.floor(self.breakpoints * n_bins).astype(np.intp)  # (feat × labels × 3)
+        exacta = np.zeros((n_feat, n_bins), dtype=bool)
+        f_idx = np.broadcast_to(np.arange(n_feat)[:, None, None], celda.shape)
+        for desplazamiento in (-1, 0, 1):
+            exacta[f_idx, np.clip(celda + desplazamiento, 0, n_bins - 1)] = True
+        self.lut_exacta = exacta.ravel()
+
+        # Error máximo: grilla densa entre nodos + cada quiebre y su vecino
+        densa = (np.arange(n_bins)[:, None] +
+                 np.arange(LUT_PUNTOS_POR_CELDA) / LUT_PUNTOS_POR_CELDA) / n_bins
+        quiebres = np.unique(self.breakpoints)
+        puntos = np.concatenate([densa.ravel(), [1.0], quiebres,
+                                 np.nextafter(quiebres, 2.0)])
+        puntos = puntos[(puntos >= 0.0) & (puntos <= 1.0)]
+        P = np.repeat(puntos[:, None], n_feat, axis=1)
+        exacto = triangular_mf_matrix(P, self.breakpoints)
+        self.lut_error_max = float(np.abs(exacto - self._membresias_lut(P)).max())
+
+    @classmethod
+    def from_files(cls, config_file=CONFIG_FILE, scalers_file=SCALERS_FILE,
+                   **kwargs):
+        """Construye el sistema desde el YAML de MF y el JSON de escaladores"""
+        with open(config_file, 'r') as f:
+            mf_config = yaml.safe_load(f)
+        with open(scalers_file, 'r') as f:
+            scalers = json.load(f)
+        return cls(mf_config, scalers, **kwargs)
+
+    def escalar_breakpoints(self, valores):
+        """Puntos de quiebre crudos (... × n_features × n_labels × 3) a [0,1]
+
+        Misma normalización y clip que en la construcción del sistema; sirve
+        para preparar lotes de breakpoints modificados para score_lote().
+        """
+        v = np.asarray(valores, dtype=float)
+        feat_min = self.feat_min[:, None, None]
+        feat_max = self.feat_max[:, None, None]
+        return np.clip((v - feat_min) / (feat_max - feat_min), 0.0, 1.0)
+
+    def escalar(self, X):
+        """Clip a [min, max] de cada feature y normalización a [0,1]"""
+        X = np.asarray(X, dtype=float)
+        X = np.clip(X, self.feat_min, self.feat_max)
+        return (X - self.feat_min) / (self.feat_max - self.feat_min)
+
+    def membresias(self, X):
+        """Matriz de membresías (n × n_memb) desde features crudas"""
+        X_scaled = self.escalar(X)
+        if self.lut is not None:
+            return self._membresias_lut(X_scaled)
+        return triangular_mf_matrix(X_scaled, self.breakpoints)
+
+    def _membresias_lut(self, X_scaled):
+        """Membresías por gather en la LUT + interpolación lineal (NaN → 0);
+        triangular exacta en las celdas con un quiebre de la feature"""
+        n_bins = self.lut_bins
+        nan = np.isnan(X_scaled)
+        pos = np.where(nan, 0.0, X_scaled) * n_bins
+        i0 = np.minimum(pos.astype(np.intp), n_bins - 1)
+        t = pos - i0
+        celda = i0 + self.lut_offset
+
+        tabla = self.lut.take(celda, axis=0)  # (n × n_features × 2 × n_labels)
+        memb = tabla[:, :, 0] + tabla[:, :, 1] * t[:, :, None]
+
+        fila, feat = np.nonzero(self.lut_exacta.take(celda))
+        bp = self.breakpoints[feat]
+        memb[fila, feat] = _triangular(X_scaled[fila, feat][:, None],
+                                       bp[..., 0], bp[..., 1], bp[..., 2])
+        memb[nan] = 0.0
+        return memb.reshape(X_scaled.shape[0], -1)
+
+    def comparar_lut(self, X):
+        """Diferencia LUT vs membresías exactas a nivel de score.
+
+        Returns:
+            dict con error_score_max (máximo |score_LUT - score_exacto|) y
+            discrepancias_neutral (semanas neutrales, sin activación, en un
+            camino y no en el otro)
+        """
+        if self.lut is None:
+            return {'error_score_max': 0.0, 'discrepancias_neutral': 0}
+        X_scaled = self.escalar(X)
+        firing_lut = self.activaciones(self._membresias_lut(X_scaled))
+        firing_exacto = self.activaciones(triangular_mf_matrix(X_scaled, self.breakpoints))
+        diferencia = np.abs(self.defuzzificar(firing_lut) - self.defuzzificar(firing_exacto))
+        return {
+            'error_score_max': float(np.nanmax(diferencia, initial=0.0)),
+            'discrepancias_neutral': int(((firing_lut.sum(axis=1) > 0) !=
+                                          (firing_exacto.sum(axis=1) > 0)).sum())
+        }
+
+    def activaciones(self, M):
+        """Matriz de activación (n × n_reglas): mínimo enmascarado × peso"""
+        M_ext = np.hstack([M, np.zeros((M.shape[0], 1))])
+        firing = np.where(self.B[None, :, :], M_ext[:, None, :],
+                          np.inf).min(axis=2)
+        return np.where(self.B.any(axis=1), firing * self.weights, 0.0)
+
+    def defuzzificar(self, firing, salidas=None):
+        """Promedio ponderado de salidas; neutral si no hay activación.
+
+        El producto punto se reduce por filas para conservar el orden de
+        suma regla a regla. salidas reemplaza a self.outputs (p. ej. un
+        lote de centroides con forma (n_conjuntos × 1 × n_reglas)).
+        """
+        if salidas is None:
+            salidas = self.outputs
+        firing_sum = firing.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(firing_sum > 0,
+                            (firing * salidas).sum(axis=-1) / firing_sum,
+                            self.neutral)
+
+    def score(self, X):
+        """Scores de sedentarismo y activaciones para X (n × n_features).
+
+        Devuelve (scores (n,), firing (n × n_reglas)).
+        """
+        firing = self.activaciones(self.membresias(X))
+        return self.defuzzificar(firing), firing
+
+    def score_lote(self, X, breakpoints, pesos=None, salidas=None, bloque=128):
+        """Scores de X para un lote de conjuntos de puntos de quiebre.
+
+        breakpoints: (n_conjuntos × n_features × n_labels × 3) ya escalados
+        (ver escalar_breakpoints). pesos y salidas (n_conjuntos × n_reglas)
+        reemplazan, por conjunto, los pesos y centroides de las reglas; si
+        se omiten se usan los del sistema. Siempre usa las membresías
+        exactas (no la LUT). Los conjuntos se procesan en bloques para
+        acotar la memoria.
+
+        Devuelve scores (n_conjuntos × n_semanas).
+        """
+        X_scaled = self.escalar(X)
+        bp = np.asarray(breakpoints, dtype=float)
+        if pesos is not None:
+            pesos = np.asarray(pesos, dtype=float)[:, None, :]
+        if salidas is not None:
+            salidas = np.asarray(salidas, dtype=float)[:, None, :]
+        # Índices de antecedentes por regla. Una condición con etiqueta
+        # inexistente apunta a la última columna de B, que en M_ext es la
+        # columna de ceros: la regla no se activa, igual que en activaciones().
+        columnas = [np.flatnonzero(fila) for fila in self.B]
+        activa = self.B.any(axis=1)
+
+        scores = np.empty((bp.shape[0], X_scaled.shape[0]))
+        for i in range(0, bp.shape[0], bloque):
+            M = triangular_mf_lote(X_scaled, bp[i:i + bloque])
+            M_ext = np.concatenate([M, np.zeros(M.shape[:2] + (1,))], axis=2)
+            # Mínimo por regla sobre sus antecedentes (sin el tensor de B)
+            firing = np.zeros(M.shape[:2] + (len(columnas),))
+            for r, cols in enumerate(columnas):
+                if len(cols):
+                    firing[:, :, r] = M_ext[:, :, cols].min(axis=2)
+            w = self.weights if pesos is None else pesos[i:i + bloque]
+            firing = np.where(activa, firing * w, 0.0)
+            scores[i:i + bloque] = self.defuzzificar(
+                firing, None if salidas is None else salidas[i:i + bloque])
+        return scores
@@ -0,0 +1,251 @@
+"""
+global_sensitivity.py
+Sensibilidad Global (Sobol / Morris) del Sistema Difuso
+
+El paso 11 desplaza los puntos de quiebre uno a la vez. Aquí se muestrea
+el espacio conjunto de:
+
+    - MF:    factor multiplicativo de los 3 puntos de quiebre de cada
+             (feature, etiqueta), 1 ± RANGO_BREAKPOINT
+    - peso:  peso de cada regla (p. ej. R5 = 0.7), ± RANGO_PESO en [0, 1]
+    - salida: centroide del consecuente de cada regla, ± RANGO_SALIDA en [0, 1]
+
+y se calculan índices de Sobol (S1 de Saltelli 2010, ST de Jansen, con IC
+bootstrap) o efectos elementales de Morris (mu, mu*, sigma) para F1 y MCC
+del score binarizado a τ contra los clusters.
+
+Cada muestra es un sistema difuso completo. Se evalúan por lotes con
+FuzzyInferenceSystem.score_lote (un eje de muestra sobre la misma matriz de
+features) y los lotes se reparten en un pool de procesos (workers), de modo
+que decenas de miles de evaluaciones toman minutos.
+
+Uso:
+    from global_sensitivity import indices_sobol, efectos_morris
+    df_sobol = indices_sobol(fis, X, y_true, n_base=1024, workers=4)
+    df_morris = efectos_morris(fis, X, y_true, n_trayectorias=200)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from threshold_sweep import metricas_confusion
+
+RANGO_BREAKPOINT = 0.10
+RANGO_PESO = 0.30
+RANGO_SALIDA = 0.10
+
+METRICAS_GLOBAL = ['f1', 'mcc']
+
+# Niveles de la grilla de Morris (Δ = p / (2(p-1)))
+NIVELES_MORRIS = 4
+
+
+def espacio_factores(fis):
+    """
+    Factores del análisis global con sus rangos.
+
+    Returns:
+        DataFrame con columnas factor, tipo, feature, label, regla, base,
+        min, max (una fila por factor, en el orden de las columnas de las
+        muestras)
+    """
+    filas = []
+    for feat in fis.features:
+        for label in fis.labels[feat]:
+            filas.append({'factor': f'MF:{feat}:{label}', 'tipo': 'MF',
+                          'feature': feat, 'label': label, 'regla': None,
+                          'base': 1.0, 'min': 1.0 - RANGO_BREAKPOINT,
+                          'max': 1.0 + RANGO_BREAKPOINT})
+    for tipo, valores, rango in [('peso', fis.weights, RANGO_PESO),
+                                 ('salida', fis.outputs, RANGO_SALIDA)]:
+        for regla, valor in zip(fis.rule_ids, valores):
+            filas.append({'factor': f'{tipo}:{regla}', 'tipo': tipo,
+                          'feature': None, 'label': None, 'regla': regla,
+                          'base': float(valor), 'min': max(0.0, valor - rango),
+                          'max': min(1.0, valor + rango)})
+    return pd.DataFrame(filas)
+
+
+def _a_parametros(fis, muestras):
+    """Muestras (n × n_factores, unidades físicas) → breakpoints, pesos, salidas"""
+    n_feat, n_labels = fis.breakpoints_raw.shape[:2]
+    n_mf = n_feat * n_labels
+    n_reglas = len(fis.rule_ids)
+
+    factores = muestras[:, :n_mf].reshape(-1, n_feat, n_labels)
+    breakpoints = fis.escalar_breakpoints(fis.breakpoints_raw[None] * factores[..., None])
+    pesos = muestras[:, n_mf:n_mf + n_reglas]
+    salidas = muestras[:, n_mf + n_reglas:n_mf + 2 * n_reglas]
+    return breakpoints, pesos, salidas
+
+
+def evaluar_muestras(muestras, fis, X, y_true, tau):
+    """
+    F1 y MCC (score >= τ contra y_true) para cada muestra de parámetros.
+
+    Args:
+        muestras: (n × n_factores) en unidades físicas (ver espacio_factores)
+        fis: FuzzyInferenceSystem base (features, reglas, escaladores)
+        X: features crudas (n_semanas × n_features) en el orden de fis
+        y_true: etiquetas 0/1 de cluster para las mismas semanas
+        tau: umbral de binarización
+
+    Returns:
+        (n × len(METRICAS_GLOBAL))
+    """
+    breakpoints, pesos, salidas = _a_parametros(fis, np.asarray(muestras, dtype=float))
+    pred = fis.score_lote(X, breakpoints, pesos=pesos, salidas=salidas) >= tau
+
+    y = np.asarray(y_true).astype(bool)
+    tp = (pred & y).sum(axis=1)
+    fp = (pred & ~y).sum(axis=1)
+    metricas = metricas_confusion(tp, fp, y.sum() - tp, (~y).sum() - fp)
+    return np.column_stack([metricas[m] for m in METRICAS_GLOBAL])
+
+
+def evaluar_paralelo(muestras, fis, X, y_true, tau=0.30, workers=1, lote=2048):
+    """evaluar_muestras repartido en lotes sobre un pool de procesos (orden conservado)"""
+    lotes = [muestras[i:i + lote] for i in range(0, len(muestras), lote)]
+    evaluar = partial(evaluar_muestras, fis=fis, X=X, y_true=y_true, tau=tau)
+    if workers <= 1 or len(lotes) == 1:
+        return np.vstack([evaluar(m) for m in lotes])
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.vstack(list(pool.map(evaluar, lotes)))
+
+
+def _escalar_unitarias(U, espacio):
+    return espacio['min'].to_numpy() + U * (espacio['max'] - espacio['min']).to_numpy()
+
+
+# ============================================================================
+# SOBOL
+# ============================================================================
+
+
+def _estimadores_sobol(fA, fB, fAB):
+    """S1 (Saltelli 2010) y ST (Jansen) para cada factor; fAB: (k × n)"""
+    varianza = np.var(np.concatenate([fA, fB]))
+    if varianza == 0:
+        ceros = np.zeros(len(fAB))
+        return ceros, ceros
+    s1 = np.mean(fB * (fAB - fA), axis=1) / varianza
+    st = 0.5 * np.mean((fA - fAB) ** 2, axis=1) / varianza
+    return s1, st
+
+
+def indices_sobol(fis, X, y_true, n_base=1024, tau=0.30, seed=0, workers=1,
+                  n_bootstrap=200):
+    """
+    Índices de Sobol de primer orden y totales para F1 y MCC.
+
+    Esquema de Saltelli con matrices A, B (muestreo Sobol aleatorizado) y
+    AB_i (A con la columna i de B): n_base·(k+2) evaluaciones.
+
+    Returns:
+        DataFrame con factor, tipo, metrica, S1, S1_ic95, ST, ST_ic95 y el
+        número de evaluaciones en el atributo attrs['n_evaluaciones']
+    """
+    espacio = espacio_factores(fis)
+    k = len(espacio)
+    U = qmc.Sobol(d=2 * k, scramble=True, seed=seed).random(n_base)
+    A, B = U[:, :k], U[:, k:]
+    AB = np.repeat(A[None], k, axis=0)
+    AB[np.arange(k), :, np.arange(k)] = B.T
+
+    muestras = _escalar_unitarias(np.vstack([A, B, AB.reshape(-1, k)]), espacio)
+    Y = evaluar_paralelo(muestras, fis, X, y_true, tau, workers)
+
+    rng = np.random.default_rng(seed)
+    remuestras = rng.integers(0, n_base, size=(n_bootstrap, n_base))
+    filas = []
+    for j, metrica in enumerate(METRICAS_GLOBAL):
+        fA, fB = Y[:n_base, j], Y[n_base:2 * n_base, j]
+        fAB = Y[2 * n_base:, j].reshape(k, n_base)
+        s1, st = _estimadores_sobol(fA, fB, fAB)
+
+        boot = [_estimadores_sobol(fA[r], fB[r], fAB[:, r]) for r in remuestras]
+        s1_ic = 1.96 * np.std([b[0] for b in boot], axis=0)
+        st_ic = 1.96 * np.std([b[1] for b in boot], axis=0)
+        for i, fila in espacio.iterrows():
+            filas.append({'factor': fila['factor'], 'tipo': fila['tipo'],
+                          'metrica': metrica, 'S1': s1[i], 'S1_ic95': s1_ic[i],
+                          'ST': st[i], 'ST_ic95': st_ic[i]})
+
+    df = pd.DataFrame(filas)
+    df.attrs['n_evaluaciones'] = len(muestras)
+    return df
+
+
+# ============================================================================
+# MORRIS
+# ============================================================================
+
+
+def trayectorias_morris(k, n_trayectorias, niveles=NIVELES_MORRIS, seed=0):
+    """
+    Trayectorias de Morris en [0,1]^k: (r × (k+1) × k) y el paso con signo.
+
+    Cada trayectoria parte de un punto de la grilla de p niveles y mueve un
+    factor por vez (orden aleatorio) en ±Δ, Δ = p / (2(p-1)).
+    """
+    rng = np.random.default_rng(seed)
+    delta = niveles / (2.0 * (niveles - 1))
+    grilla = np.arange(niveles) / (niveles - 1)
+
+    puntos = np.empty((n_trayectorias, k + 1, k))
+    pasos = np.empty((n_trayectorias, k))
+    ordenes = np.empty((n_trayectorias, k), dtype=int)
+    for t in range(n_trayectorias):
+        x = rng.choice(grilla, size=k)
+        signo = np.where(x + delta <= 1.0 + 1e-12, 1.0, -1.0)
+        orden = rng.permutation(k)
+        puntos[t, 0] = x
+        for paso, i in enumerate(orden, start=1):
+            x = x.copy()
+            x[i] += signo[i] * delta
+            puntos[t, paso] = x
+        pasos[t] = signo * delta
+        ordenes[t] = orden
+    return puntos, pasos, ordenes
+
+
+def efectos_morris(fis, X, y_true, n_trayectorias=200, tau=0.30, seed=0,
+                   workers=1):
+    """
+    Efectos elementales de Morris (mu, mu*, sigma) para F1 y MCC.
+
+    r·(k+1) evaluaciones. Los efectos se expresan por unidad del rango de
+    cada factor (escala [0,1]).
+
+    Returns:
+        DataFrame con factor, tipo, metrica, mu, mu_star, sigma
+    """
+    espacio = espacio_factores(fis)
+    k = len(espacio)
+    puntos, pasos, ordenes = trayectorias_morris(k, n_trayectorias, seed=seed)
+
+    muestras = _escalar_unitarias(puntos.reshape(-1, k), espacio)
+    Y = evaluar_paralelo(muestras, fis, X, y_true, tau, workers).reshape(
+        n_trayectorias, k + 1, -1)
+
+    # Efecto del factor movido en cada paso de cada trayectoria
+    filas_t = np.arange(n_trayectorias)[:, None]
+    ee = np.empty((n_trayectorias, k, Y.shape[2]))
+    ee[filas_t, ordenes] = (Y[:, 1:] - Y[:, :-1]) / \
+        pasos[filas_t, ordenes][:, :, None]
+
+    filas = []
+    for j, metrica in enumerate(METRICAS_GLOBAL):
+        for i, fila in espacio.iterrows():
+            filas.append({'factor': fila['factor'], 'tipo': fila['tipo'],
+                          'metrica': metrica, 'mu': ee[:, i, j].mean(),
+                          'mu_star': np.abs(ee[:, i, j]).mean(),
+                          'sigma': ee[:, i, j].std(ddof=1)})
+
+    df = pd.DataFrame(filas)
+    df.attrs['n_evaluaciones'] = len(muestras)
+    return df
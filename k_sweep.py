@@ -0,0 +1,128 @@
+"""
+k_sweep.py
+Barrido de K para K-Means (completo, mini-batch y arranque en caliente)
+
+Los K-sweeps de 06_precluster_qc.py, completar_k_sweep.py y
+06_clustering_semana.py ajustaban un KMeans completo desde cero para cada K
+(n_init=10). Aquí el barrido se hace en una sola función sobre la matriz ya
+escalada (ver feature_cache.load_scaled) y devuelve, por K, inertia,
+silhouette (media y desviación) y Davies-Bouldin en la misma pasada. El
+silhouette se calcula con silhouette.py (exacto por bloques o por muestra
+estratificada con IC 95%, según el argumento silhouette).
+
+Opciones:
+    - minibatch: MiniBatchKMeans en lugar de KMeans. 'auto' lo activa sólo
+      cuando n supera UMBRAL_MINIBATCH (con la cohorte actual, ~1.4k semanas,
+      se usa KMeans completo y los resultados no cambian).
+    - warm_start: K+1 se inicializa con la solución de K, dividiendo el
+      cluster de mayor SSE a lo largo de su primera componente principal
+      (centroide ± desviación en esa dirección), con n_init=1.
+
+Uso:
+    from k_sweep import barrer_k
+    df_k, modelos = barrer_k(X_scaled, range(2, 7), random_state=42)
+    labels = modelos[3].labels_
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import davies_bouldin_score
+
+from silhouette import resumen_silhouette
+
+# A partir de este número de filas, minibatch='auto' usa MiniBatchKMeans
+UMBRAL_MINIBATCH = 100_000
+MINIBATCH_BATCH = 4096
+
+
+def dividir_centroides(X, labels, centros):
+    """
+    Centroides iniciales para K+1 a partir de una solución con K.
+
+    El cluster con mayor suma de cuadrados se reemplaza por dos centroides
+    desplazados ± una desviación estándar sobre su primera componente
+    principal; el resto se conserva.
+
+    Returns:
+        (K+1 × n_features)
+    """
+    centros = np.asarray(centros, dtype=float)
+    sse = np.array([((X[labels == c] - centros[c]) ** 2).sum()
+                    for c in range(len(centros))])
+    c = int(np.argmax(sse))
+    miembros = np.asarray(X[labels == c], dtype=float)
+
+    if len(miembros) < 2:
+        direccion = np.zeros(X.shape[1])
+    else:
+        _, s, vt = np.linalg.svd(miembros - centros[c], full_matrices=False)
+        direccion = vt[0] * s[0] / np.sqrt(len(miembros))
+
+    return np.vstack([np.delete(centros, c, axis=0),
+                      centros[c] - direccion, centros[c] + direccion])
+
+
+def _modelo(k, init, n_init, max_iter, random_state, minibatch, batch_size):
+    if minibatch:
+        return MiniBatchKMeans(n_clusters=k, init=init, n_init=n_init,
+                               max_iter=max_iter, batch_size=batch_size,
+                               random_state=random_state)
+    return KMeans(n_clusters=k, init=init, n_init=n_init,
+                  max_iter=max_iter, random_state=random_state)
+
+
+def barrer_k(X, k_range, random_state=42, n_init=10, max_iter=300,
+             minibatch='auto', warm_start=False, batch_size=MINIBATCH_BATCH,
+             silhouette='auto'):
+    """
+    Ajusta K-Means para cada K y calcula las métricas de selección.
+
+    Args:
+        X: matriz escalada (n × n_features); no se re-escala
+        k_range: valores de K (crecientes si warm_start)
+        random_state, n_init, max_iter: parámetros de KMeans (sin warm
+            start, cada K reproduce KMeans(k, random_state, n_init, max_iter))
+        minibatch: True, False o 'auto' (n > UMBRAL_MINIBATCH)
+        warm_start: inicializar K+1 dividiendo la solución de K
+        batch_size: tamaño de lote de MiniBatchKMeans
+        silhouette: 'exacta', 'muestra' o 'auto' (ver resumen_silhouette)
+
+    Returns:
+        (DataFrame con k, inertia, silhouette_mean, silhouette_std,
+        davies_bouldin, cluster_sizes y, si el silhouette es muestral,
+        silhouette_ic95_inf/sup; dict K -> modelo ajustado)
+    """
+    if minibatch == 'auto':
+        minibatch = len(X) > UMBRAL_MINIBATCH
+
+    filas = []
+    modelos = {}
+    anterior = None
+    for k in k_range:
+        if warm_start and anterior is not None and anterior.n_clusters == k - 1:
+            init = dividir_centroides(X, anterior.labels_, anterior.cluster_centers_)
+            modelo = _modelo(k, init, 1, max_iter, random_state, minibatch, batch_size)
+        else:
+            modelo = _modelo(k, 'k-means++', n_init, max_iter, random_state,
+                             minibatch, batch_size)
+        labels = modelo.fit_predict(X)
+
+        sil = resumen_silhouette(X, labels, metodo=silhouette, seed=random_state)
+        unique, counts = np.unique(labels, return_counts=True)
+        fila = {
+            'k': k,
+            'inertia': modelo.inertia_,
+            'silhouette_mean': sil['mean'],
+            'silhouette_std': sil['std'],
+            'davies_bouldin': davies_bouldin_score(X, labels),
+            'cluster_sizes': str(dict(zip(unique, counts)))
+        }
+        if sil['metodo'] == 'muestra':
+            fila['silhouette_ic95_inf'] = sil['ic95_inf']
+            fila['silhouette_ic95_sup'] = sil['ic95_sup']
+        filas.append(fila)
+        modelos[k] = modelo
+        anterior = modelo
+
+    return pd.DataFrame(filas), modelos
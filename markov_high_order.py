@@ -0,0 +1,211 @@
+"""
+markov_high_order.py
+Cadena de Markov de Orden k (k = 1..4) con Covariables y Conteos Dispersos
+
+El paso 12 usa una cadena de primer orden sobre 3 estados. Aquí el contexto
+de la semana t+1 son los k estados previos (t-k+1..t) y, opcionalmente, el
+nivel de una covariable discretizada de la semana t (p. ej. cobertura:
+dias_monitoreados o flag_baja_cobertura). Cada (contexto, siguiente estado)
+se codifica como un entero int64 y los conteos se guardan en una tabla
+dispersa (claves ordenadas + conteos, búsqueda con searchsorted): la
+memoria es proporcional a las secuencias observadas, no a 3^k · niveles.
+
+Predicción con back-off: si el contexto de orden k no se observó, se usa el
+de orden k-1, ..., 1; sin ningún dato, persistencia (mismo estado), igual
+que la fila vacía de la matriz de primer orden. Con k = 1 y sin covariable
+las predicciones coinciden con las de argmax(P).
+
+El backtest es vectorizado sobre todas las transiciones, en modo 'insample'
+(conteos de toda la cohorte, como el backtest del paso 12) o 'louo'
+(conteos de la cohorte menos los del propio usuario), de modo que la
+grilla de k y covariables sobre toda la cohorte toma segundos.
+
+Uso:
+    from markov_high_order import buscar_orden, discretizar
+    df_grid = buscar_orden(codigo, estados, {'': None, 'cobertura': niveles},
+                           ordenes=[1, 2, 3, 4], modo='louo')
+"""
+
+import numpy as np
+import pandas as pd
+
+N_ESTADOS = 3
+ORDEN_MAX = 4
+
+
+class TablaDispersa:
+    """Conteos por clave int64: claves únicas ordenadas y sus conteos"""
+
+    def __init__(self, claves):
+        self.claves, conteos = np.unique(np.asarray(claves, dtype=np.int64),
+                                         return_counts=True)
+        self.conteos = conteos.astype(np.int32)
+
+    def __len__(self):
+        return len(self.claves)
+
+    def contar(self, claves):
+        """Conteo de cada clave (0 si no se observó)"""
+        claves = np.asarray(claves, dtype=np.int64)
+        if len(self.claves) == 0:
+            return np.zeros(claves.shape, dtype=np.int32)
+        pos = np.minimum(np.searchsorted(self.claves, claves), len(self.claves) - 1)
+        return np.where(self.claves[pos] == claves, self.conteos[pos], 0)
+
+
+def claves_contexto(codigo, estados, orden, niveles=None):
+    """
+    Contexto de orden k para predecir el estado de cada posición t.
+
+    Args:
+        codigo: código de usuario por semana (ordenado por usuario y fecha)
+        estados: estado 0..2 por semana
+        orden: k (número de estados previos)
+        niveles: nivel de covariable por semana (None = sin covariable); se
+            usa el de la semana t-1, la última observada al predecir
+
+    Returns:
+        (clave de contexto int64 por posición, máscara de posiciones con k
+        estados previos del mismo usuario)
+    """
+    codigo = np.asarray(codigo)
+    estados = np.asarray(estados, dtype=np.int64)
+    n = len(estados)
+    clave = np.zeros(n, dtype=np.int64)
+    valido = np.zeros(n, dtype=bool)
+    valido[orden:] = codigo[orden:] == codigo[:n - orden]
+
+    for j in range(1, orden + 1):
+        clave[j:] += estados[:n - j] * N_ESTADOS ** (j - 1)
+    if niveles is not None:
+        niveles = np.asarray(niveles, dtype=np.int64)
+        clave[1:] += niveles[:-1] * N_ESTADOS ** orden
+    return clave, valido
+
+
+class MarkovOrdenK:
+    """
+    Predictor de orden k con back-off a órdenes menores.
+
+    Las tablas de conteo se guardan por orden (1..k) y, para el backtest
+    leave-one-user-out, también por (usuario, contexto).
+    """
+
+    def __init__(self, orden, por_usuario=False):
+        if not 1 <= orden <= ORDEN_MAX:
+            raise ValueError(f"Orden no soportado: {orden} (1..{ORDEN_MAX})")
+        self.orden = orden
+        self.por_usuario = por_usuario
+
+    def ajustar(self, codigo, estados, niveles=None):
+        self.codigo = np.asarray(codigo)
+        self.estados = np.asarray(estados, dtype=np.int64)
+        self.niveles = niveles
+        self.tablas = {}
+        self.tablas_usuario = {}
+        self.rango = {}
+        self.contextos = {}
+
+        for k in range(1, self.orden + 1):
+            ctx, valido = claves_contexto(self.codigo, self.estados, k, niveles)
+            self.contextos[k] = (ctx, valido)
+            claves = ctx[valido] * N_ESTADOS + self.estados[valido]
+            self.tablas[k] = TablaDispersa(claves)
+            if self.por_usuario:
+                # clave (usuario, contexto, siguiente) = usuario · rango + clave
+                self.rango[k] = int(ctx.max(initial=0) + 1) * N_ESTADOS
+                self.tablas_usuario[k] = TablaDispersa(
+                    self.codigo[valido].astype(np.int64) * self.rango[k] + claves)
+        return self
+
+    def conteos_siguiente(self, k, posiciones, excluir_usuario=False):
+        """Conteos (n × 3) del siguiente estado para el contexto de orden k de cada posición"""
+        ctx = self.contextos[k][0][posiciones]
+        claves = ctx[:, None] * N_ESTADOS + np.arange(N_ESTADOS)
+        conteos = self.tablas[k].contar(claves)
+        if excluir_usuario:
+            propio = self.codigo[posiciones].astype(np.int64)[:, None] * self.rango[k] + claves
+            conteos = conteos - self.tablas_usuario[k].contar(propio)
+        return conteos
+
+    def predecir(self, posiciones, excluir_usuario=False):
+        """
+        Estado predicho en cada posición t (con al menos un estado previo del
+        mismo usuario) usando el mayor orden con datos.
+        """
+        posiciones = np.asarray(posiciones)
+        pred = self.estados[posiciones - 1].copy()  # persistencia
+        resuelto = np.zeros(len(posiciones), dtype=bool)
+        for k in range(self.orden, 0, -1):
+            disponible = ~resuelto & self.contextos[k][1][posiciones]
+            if not disponible.any():
+                continue
+            conteos = self.conteos_siguiente(k, posiciones[disponible], excluir_usuario)
+            con_datos = conteos.sum(axis=1) > 0
+            idx = np.flatnonzero(disponible)[con_datos]
+            pred[idx] = np.argmax(conteos[con_datos], axis=1)
+            resuelto[idx] = True
+        return pred
+
+
+def posiciones_transicion(codigo):
+    """Posiciones t con un estado previo del mismo usuario (las transiciones)"""
+    codigo = np.asarray(codigo)
+    return np.flatnonzero(np.r_[False, codigo[1:] == codigo[:-1]])
+
+
+def backtest_orden_k(codigo, estados, orden, niveles=None, modo='insample'):
+    """
+    Backtest 1-paso vectorizado del predictor de orden k.
+
+    Args:
+        codigo: código de usuario por semana (ordenado por usuario y fecha)
+        estados: estado 0..2 por semana
+        orden: k
+        niveles: nivel de covariable por semana (None = sin covariable)
+        modo: 'insample' (conteos de toda la cohorte) o 'louo' (sin los
+            conteos del propio usuario)
+
+    Returns:
+        (posiciones t evaluadas, estado predicho, modelo ajustado)
+    """
+    if modo not in ('insample', 'louo'):
+        raise ValueError(f"Modo de backtest no válido: {modo}")
+    modelo = MarkovOrdenK(orden, por_usuario=(modo == 'louo')).ajustar(codigo, estados, niveles)
+    pos = posiciones_transicion(codigo)
+    return pos, modelo.predecir(pos, excluir_usuario=(modo == 'louo')), modelo
+
+
+def buscar_orden(codigo, estados, covariables, ordenes=range(1, ORDEN_MAX + 1), modo='louo'):
+    """
+    Grilla de órdenes × covariables con el backtest vectorizado.
+
+    Args:
+        covariables: dict nombre -> niveles por semana (None = sin covariable)
+
+    Returns:
+        DataFrame con orden, covariable, modo, n_transiciones, accuracy y
+        n_contextos (claves de la tabla dispersa de mayor orden)
+    """
+    estados = np.asarray(estados)
+    filas = []
+    for nombre, niveles in covariables.items():
+        for orden in ordenes:
+            pos, pred, modelo = backtest_orden_k(codigo, estados, orden, niveles, modo)
+            filas.append({
+                'orden': orden,
+                'covariable': nombre or 'ninguna',
+                'modo': modo,
+                'n_transiciones': len(pos),
+                'accuracy': float(np.mean(pred == estados[pos])) if len(pos) else np.nan,
+                'n_contextos': len(modelo.tablas[orden])
+            })
+    return pd.DataFrame(filas)
+
+
+def discretizar(valores, cortes):
+    """Niveles 0..len(cortes) por np.digitize; NaN en un nivel propio (len(cortes)+1)"""
+    valores = np.asarray(valores, dtype=float)
+    niveles = np.digitize(valores, cortes)
+    niveles[np.isnan(valores)] = len(cortes) + 1
+    return niveles
@@ -0,0 +1,239 @@
+"""
+markov_store.py
+Almacén Persistente de Conteos de Transición del Semáforo (actualización online)
+
+El paso 12 estimaba las matrices de transición desde fuzzy_output.csv
+completo en cada ejecución. MarkovStore guarda, por usuario, un array int32
+(3 x 3) de conteos de transición más su último estado y semana observada, y
+se actualiza en O(1) cuando llega una semana nueva (actualizar), sin volver
+a leer la historia. La matriz global se mantiene como suma corriente.
+
+Conteos en punto fijo: cada transición suma ESCALA (2^10), de modo que el
+olvido exponencial opcional (olvido = λ < 1: antes de sumar, los conteos
+del usuario se multiplican por λ y se redondean) también cabe en int32. Con
+λ = 1 los conteos son enteros exactos y las probabilidades coinciden con
+las de conteo simple.
+
+Con la historia se guarda un hash por usuario de las semanas ya
+incorporadas (hash_historia, lo calcula el paso 12): si una semana pasada
+se re-escribe o se elimina, el hash deja de coincidir y el almacén se
+reconstruye en vez de seguir actualizando conteos obsoletos.
+
+Las potencias P^1..P^H (global o por usuario) se guardan como una tabla
+(H x 3 x 3) construida una sola vez por matriz con productos sucesivos
+(P^h = P^(h-1) P) y ampliada sólo si se pide un horizonte mayor; se
+invalida únicamente cuando cambia la matriz correspondiente. Así las
+predicciones de todos los usuarios a todos los horizontes salen de un
+gather sobre la tabla, sin una exponenciación por usuario.
+
+Uso:
+    from markov_store import MarkovStore
+    store = MarkovStore.desde_transiciones(usuarios, codigo, estado_t, estado_t1,
+                                           ultimo_estado, ultima_semana)
+    store.actualizar('u3', pd.Timestamp('2025-06-02'), estado=2)
+    probs = store.probabilidades('u3', horizonte=4)
+    tabla = store.tabla_potencias(12)          # P^1..P^12 (12 x 3 x 3)
+    store.guardar(OUTPUT_DIR / 'markov_store.npz')
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+N_ESTADOS = 3
+ESCALA = 1 << 10
+
+
+def normalizar_filas(counts):
+    """Conteos (..., 3, 3) -> probabilidades por fila; fila sin transiciones = persistencia"""
+    counts = np.asarray(counts, dtype=float)
+    n = counts.shape[-1]
+    fila_sum = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        probs = np.where(fila_sum > 0, counts / fila_sum, 0.0)
+    # si no hay transiciones observadas desde i, asumir alta persistencia
+    sin_datos = fila_sum[..., 0] == 0
+    probs[..., np.arange(n), np.arange(n)] += sin_datos
+    return probs
+
+
+class MarkovStore:
+    """
+    Conteos de transición por usuario (int32, punto fijo) con actualización
+    online, olvido exponencial opcional y caché de potencias de la matriz.
+    """
+
+    def __init__(self, usuarios, counts, ultimo_estado, ultima_semana, olvido=1.0,
+                 umbrales=None, hash_historia=None):
+        self.usuarios = np.asarray(usuarios, dtype=str)
+        self.counts = np.ascontiguousarray(counts, dtype=np.int32)
+        self.ultimo_estado = np.asarray(ultimo_estado, dtype=np.int8)
+        self.ultima_semana = np.asarray(ultima_semana, dtype='datetime64[D]')
+        self.olvido = float(olvido)
+        self.umbrales = None if umbrales is None else tuple(float(u) for u in umbrales)
+        # Hash por usuario de las semanas incorporadas (None = desconocido)
+        self.hash_historia = None if hash_historia is None else \
+            np.asarray(hash_historia, dtype=np.uint64)
+
+        self.indice = {u: i for i, u in enumerate(self.usuarios)}
+        self.counts_global = self.counts.sum(axis=0, dtype=np.int64)
+        self._potencias_global = {}
+        self._potencias_usuario = {}
+
+    # ------------------------------------------------------------------
+    # Construcción
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def desde_transiciones(cls, usuarios, codigo, estado_t, estado_t1, ultimo_estado,
+                           ultima_semana, olvido=1.0, umbrales=None):
+        """
+        Construye el almacén desde los pares (estado_t, estado_t+1) de toda
+        la historia, en orden cronológico dentro de cada usuario.
+
+        Con olvido = 1 los conteos salen de un bincount; con olvido < 1 se
+        aplica la misma regla que actualizar (decaer y sumar), paso a paso
+        en la posición de cada transición dentro de su usuario, vectorizado
+        sobre usuarios.
+        """
+        n_u = len(usuarios)
+        codigo = np.asarray(codigo)
+        celda = np.asarray(estado_t) * N_ESTADOS + np.asarray(estado_t1)
+
+        if olvido >= 1.0:
+            counts = np.bincount(codigo * N_ESTADOS ** 2 + celda,
+                                 minlength=n_u * N_ESTADOS ** 2) * ESCALA
+            counts = counts.reshape(n_u, N_ESTADOS, N_ESTADOS)
+        else:
+            # Posición de cada transición dentro de su usuario (codigo ordenado)
+            inicio = np.searchsorted(codigo, np.arange(n_u))
+            paso = np.arange(len(codigo)) - inicio[codigo]
+            planos = np.zeros((n_u, N_ESTADOS ** 2), dtype=np.int64)
+            for p in range(paso.max() + 1 if len(paso) else 0):
+                sel = paso == p
+                u = codigo[sel]
+                planos[u] = np.rint(planos[u] * olvido)
+                planos[u, celda[sel]] += ESCALA
+            counts = planos.reshape(n_u, N_ESTADOS, N_ESTADOS)
+
+        return cls(usuarios, counts, ultimo_estado, ultima_semana, olvido, umbrales)
+
+    # ------------------------------------------------------------------
+    # Actualización online
+    # ------------------------------------------------------------------
+
+    def _agregar_usuario(self, usuario):
+        self.indice[usuario] = len(self.usuarios)
+        self.usuarios = np.append(self.usuarios, usuario)
+        self.counts = np.concatenate([self.counts, np.zeros((1, N_ESTADOS, N_ESTADOS),
+                                                            dtype=np.int32)])
+        self.ultimo_estado = np.append(self.ultimo_estado, np.int8(-1))
+        self.ultima_semana = np.append(self.ultima_semana, np.datetime64('NaT', 'D'))
+        if self.hash_historia is not None:
+            self.hash_historia = np.append(self.hash_historia, np.uint64(0))
+        return self.indice[usuario]
+
+    def actualizar(self, usuario, semana, estado):
+        """
+        Registra una semana nueva de un usuario (O(1)).
+
+        Returns:
+            False si la semana no es posterior a la última registrada (se
+            ignora), True en otro caso
+        """
+        i = self.indice.get(usuario)
+        if i is None:
+            i = self._agregar_usuario(usuario)
+        semana = np.datetime64(semana, 'D')
+        ultima = self.ultima_semana[i]
+        if not np.isnat(ultima) and semana <= ultima:
+            return False
+
+        anterior = int(self.ultimo_estado[i])
+        if anterior >= 0:
+            viejos = self.counts[i].astype(np.int64)
+            nuevos = np.rint(viejos * self.olvido) if self.olvido < 1.0 else viejos.copy()
+            nuevos[anterior, estado] += ESCALA
+            self.counts[i] = nuevos
+            self.counts_global += (nuevos - viejos).astype(np.int64)
+            self._potencias_global.clear()
+            self._potencias_usuario.pop(usuario, None)
+
+        self.ultimo_estado[i] = estado
+        self.ultima_semana[i] = semana
+        return True
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+
+    def conteos(self, usuario=None):
+        """Conteos (en unidades de transición) global o de un usuario"""
+        c = self.counts_global if usuario is None else self.counts[self.indice[usuario]]
+        if self.olvido >= 1.0:
+            return c.astype(np.int64) // ESCALA
+        return c / ESCALA
+
+    def matriz(self, usuario=None):
+        """Matriz de transición (probabilidades) global o de un usuario"""
+        c = self.counts_global if usuario is None else self.counts[self.indice[usuario]]
+        return normalizar_filas(c)
+
+    def tabla_potencias(self, H, usuario=None):
+        """
+        Tabla cacheada de potencias P^1..P^H (H x 3 x 3), global o de un
+        usuario; si ya existe una tabla más corta sólo se calculan los
+        horizontes que faltan.
+        """
+        cache = self._potencias_global if usuario is None else \
+            self._potencias_usuario.setdefault(usuario, {})
+        tabla = cache.get('tabla')
+        if tabla is None:
+            tabla = self.matriz(usuario)[None]
+        if len(tabla) < H:
+            P = tabla[0]
+            nuevas = [tabla[-1]]
+            for _ in range(H - len(tabla)):
+                nuevas.append(nuevas[-1] @ P)
+            tabla = np.concatenate([tabla, np.stack(nuevas[1:])])
+        cache['tabla'] = tabla
+        return tabla[:H]
+
+    def potencia(self, h, usuario=None):
+        """P^h desde la tabla cacheada (global o de un usuario)"""
+        return self.tabla_potencias(max(h, 1), usuario)[max(h, 1) - 1]
+
+    def probabilidades(self, usuario, horizonte=1, matriz_usuario=False):
+        """Distribución del estado a `horizonte` semanas desde el último estado del usuario"""
+        estado = int(self.ultimo_estado[self.indice[usuario]])
+        P_h = self.potencia(horizonte, usuario if matriz_usuario else None)
+        return P_h[estado]
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+
+    def guardar(self, path):
+        path = Path(path)
+        tmp = path.with_name(path.stem + '.tmp.npz')
+        np.savez(tmp, usuarios=self.usuarios, counts=self.counts,
+                 ultimo_estado=self.ultimo_estado, ultima_semana=self.ultima_semana,
+                 olvido=self.olvido, escala=ESCALA,
+                 umbrales=np.array(self.umbrales if self.umbrales else [np.nan, np.nan]),
+                 **({} if self.hash_historia is None else {'hash_historia': self.hash_historia}))
+        tmp.replace(path)
+
+    @classmethod
+    def cargar(cls, path):
+        """Almacén guardado con guardar(), o None si no existe o no es compatible"""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as z:
+            if int(z['escala']) != ESCALA:
+                return None
+            umbrales = z['umbrales']
+            return cls(z['usuarios'], z['counts'], z['ultimo_estado'], z['ultima_semana'],
+                       float(z['olvido']),
+                       None if np.isnan(umbrales).any() else tuple(umbrales),
+                       z['hash_historia'] if 'hash_historia' in z.files else None)
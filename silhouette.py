@@ -0,0 +1,158 @@
+"""
+silhouette.py
+Silhouette por Bloques (exacta) y por Muestra Estratificada (con IC)
+
+El silhouette de n puntos requiere las n² distancias entre pares. Aquí:
+
+    - silhouette_bloques: exacta; procesa `bloque` filas a la vez contra
+      todos los puntos y reduce las distancias a sumas por cluster con un
+      producto matricial (memoria O(bloque · n), nunca la matriz n × n).
+    - silhouette_muestra: aproximada; evalúa s(i) exacto (contra todos los
+      puntos) sólo para una muestra estratificada por cluster, y estima la
+      media con su intervalo de confianza (varianza del estimador
+      estratificado, con corrección por población finita).
+
+resumen_silhouette elige el método por ejecución: 'exacta', 'muestra' o
+'auto' (muestra cuando n > UMBRAL_MUESTRA).
+
+Convención igual a sklearn.metrics.silhouette_samples: s(i) = 0 para puntos
+en clusters de un solo elemento.
+
+Uso:
+    from silhouette import resumen_silhouette
+    res = resumen_silhouette(X_scaled, labels, metodo='auto')
+    res['mean'], res['ic95_inf'], res['ic95_sup']
+"""
+
+import numpy as np
+from sklearn.metrics import pairwise_distances
+
+BLOQUE = 2048
+UMBRAL_MUESTRA = 20_000
+N_MUESTRA = 5_000
+Z_95 = 1.959964
+
+
+def silhouette_bloques(X, labels, filas=None, bloque=BLOQUE):
+    """
+    Silhouette exacto s(i) de las filas pedidas, por bloques.
+
+    Args:
+        X: matriz (n × n_features)
+        labels: etiquetas de cluster (n,)
+        filas: posiciones a evaluar (None = todas); las distancias siempre
+            se calculan contra los n puntos
+        bloque: filas por bloque (memoria ~ bloque · n · 8 bytes)
+
+    Returns:
+        array float64 con s(i) para cada fila evaluada
+    """
+    X = np.asarray(X)
+    _, codigos = np.unique(labels, return_inverse=True)
+    codigos = codigos.ravel()
+    n_clusters = codigos.max() + 1
+    tam = np.bincount(codigos, minlength=n_clusters).astype(np.float64)
+    one_hot = np.zeros((len(X), n_clusters))
+    one_hot[np.arange(len(X)), codigos] = 1.0
+
+    filas = np.arange(len(X)) if filas is None else np.asarray(filas)
+    s = np.empty(len(filas))
+    for i in range(0, len(filas), bloque):
+        idx = filas[i:i + bloque]
+        D = pairwise_distances(X[idx], X).astype(np.float64)
+        D[np.arange(len(idx)), idx] = 0.0
+
+        sumas = D @ one_hot
+        propio = codigos[idx]
+        filas_b = np.arange(len(idx))
+        a = sumas[filas_b, propio] / np.maximum(tam[propio] - 1, 1)
+        medias = sumas / tam
+        medias[filas_b, propio] = np.inf
+        b = medias.min(axis=1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            s_b = np.nan_to_num((b - a) / np.maximum(a, b))
+        s_b[tam[propio] <= 1] = 0.0
+        s[i:i + bloque] = s_b
+    return s
+
+
+def muestra_estratificada(labels, n_muestra=N_MUESTRA, seed=42, min_por_cluster=30):
+    """
+    Posiciones de una muestra estratificada por cluster (asignación
+    proporcional, al menos min_por_cluster por cluster si existe).
+
+    Returns:
+        (posiciones ordenadas, dict cluster -> (N_h, n_h))
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.asarray(labels)
+    n = len(labels)
+    posiciones = []
+    estratos = {}
+    for c in np.unique(labels):
+        miembros = np.flatnonzero(labels == c)
+        n_h = int(round(n_muestra * len(miembros) / n))
+        n_h = min(len(miembros), max(n_h, min_por_cluster))
+        posiciones.append(rng.choice(miembros, size=n_h, replace=False))
+        estratos[c] = (len(miembros), n_h)
+    return np.sort(np.concatenate(posiciones)), estratos
+
+
+def silhouette_muestra(X, labels, n_muestra=N_MUESTRA, seed=42, bloque=BLOQUE):
+    """
+    Estimación estratificada de la media y desviación del silhouette.
+
+    Returns:
+        dict con mean, std, ic95_inf, ic95_sup, n_evaluadas
+    """
+    labels = np.asarray(labels)
+    posiciones, estratos = muestra_estratificada(labels, n_muestra, seed)
+    s = silhouette_bloques(X, labels, filas=posiciones, bloque=bloque)
+    lab_m = labels[posiciones]
+    n = len(labels)
+
+    media = 0.0
+    segundo_momento = 0.0
+    varianza_media = 0.0
+    for c, (N_h, n_h) in estratos.items():
+        s_h = s[lab_m == c]
+        W_h = N_h / n
+        media += W_h * s_h.mean()
+        segundo_momento += W_h * np.mean(s_h ** 2)
+        if n_h > 1:
+            varianza_media += W_h ** 2 * (1 - n_h / N_h) * s_h.var(ddof=1) / n_h
+
+    semi = Z_95 * np.sqrt(varianza_media)
+    return {'mean': media,
+            'std': np.sqrt(max(segundo_momento - media ** 2, 0.0)),
+            'ic95_inf': media - semi, 'ic95_sup': media + semi,
+            'n_evaluadas': len(posiciones)}
+
+
+def resumen_silhouette(X, labels, metodo='auto', n_muestra=N_MUESTRA, seed=42,
+                       bloque=BLOQUE):
+    """
+    Media y desviación del silhouette con el método elegido.
+
+    Args:
+        metodo: 'exacta' (por bloques), 'muestra' (estratificada) o 'auto'
+            (muestra si n > UMBRAL_MUESTRA)
+
+    Returns:
+        dict con mean, std, ic95_inf, ic95_sup, n_evaluadas y metodo
+        (en la exacta el IC coincide con la media)
+    """
+    if metodo == 'auto':
+        metodo = 'muestra' if len(X) > UMBRAL_MUESTRA else 'exacta'
+    if metodo == 'muestra':
+        res = silhouette_muestra(X, labels, n_muestra, seed, bloque)
+    elif metodo == 'exacta':
+        s = silhouette_bloques(X, labels, bloque=bloque)
+        res = {'mean': s.mean(), 'std': s.std(),
+               'ic95_inf': s.mean(), 'ic95_sup': s.mean(),
+               'n_evaluadas': len(s)}
+    else:
+        raise ValueError(f"Método de silhouette no válido: {metodo}")
+    res['metodo'] = metodo
+    return res
@@ -0,0 +1,6 @@
+"""Configuración de pytest: los módulos compartidos viven en la raíz del repo"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
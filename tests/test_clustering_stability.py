@@ -0,0 +1,109 @@
+"""
+Caché de estabilidad bootstrap (analisis_u/06_clustering_semana.py):
+  - reutiliza ARI sólo con la misma matriz, etiquetas y configuración
+  - poda de contextos antiguos
+  - la matriz compartida con los workers no queda en disco
+"""
+
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+RUTA = Path(__file__).resolve().parents[1] / 'analisis_u' / '06_clustering_semana.py'
+
+
+@pytest.fixture(scope='module')
+def clustering():
+    spec = importlib.util.spec_from_file_location('clustering_semana', RUTA)
+    modulo = importlib.util.module_from_spec(spec)
+    # Registrado para que los workers del pool resuelvan sus funciones
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    yield modulo
+    del sys.modules[spec.name]
+
+
+@pytest.fixture
+def cs(clustering, tmp_path, monkeypatch):
+    """Módulo con la caché en tmp_path y conteo de réplicas calculadas"""
+    monkeypatch.setattr(clustering, 'STABILITY_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(clustering, 'STABILITY_CACHE_FILE', tmp_path / 'bootstrap_ari.json')
+    llamadas = []
+    original = clustering.bootstrap_ari
+
+    def contar(seed, *args, **kwargs):
+        llamadas.append(seed)
+        return original(seed, *args, **kwargs)
+
+    monkeypatch.setattr(clustering, 'bootstrap_ari', contar)
+    monkeypatch.setattr(clustering, 'llamadas', llamadas, raising=False)
+    return clustering
+
+
+@pytest.fixture
+def datos():
+    rng = np.random.default_rng(0)
+    X = np.vstack([rng.normal(c, 0.5, (40, 3)) for c in (0, 4, 8)])
+    labels = np.repeat([0, 1, 2], 40)
+    return X, labels
+
+
+def _estabilidad(cs, X, labels, k=3):
+    cs.llamadas.clear()
+    ari = cs.compute_stability(X, k, n_iter=4, labels_ref=labels)
+    return ari, len(cs.llamadas)
+
+
+def test_reutiliza_con_mismo_contexto(cs, datos):
+    X, labels = datos
+    ari, calculadas = _estabilidad(cs, X, labels)
+    assert calculadas == 4
+    assert _estabilidad(cs, X, labels) == (ari, 0)
+
+
+def test_invalida_por_etiquetas_matriz_y_configuracion(cs, datos, monkeypatch):
+    X, labels = datos
+    _estabilidad(cs, X, labels)
+
+    otras = labels.copy()
+    otras[:5] = 1
+    assert _estabilidad(cs, X, otras)[1] == 4
+    assert _estabilidad(cs, X + 1e-9, labels)[1] == 4
+    assert _estabilidad(cs, X, labels, k=2)[1] == 4
+    for nombre, valor in [('BOOTSTRAP_N_INIT', 3), ('BOOTSTRAP_MAX_ITER', 50),
+                          ('KSWEEP_MINIBATCH', True), ('KSWEEP_WARM_START', True)]:
+        with monkeypatch.context() as m:
+            m.setattr(cs, nombre, valor)
+            assert _estabilidad(cs, X, labels)[1] == 4, nombre
+    # El contexto original sigue en caché
+    assert _estabilidad(cs, X, labels)[1] == 0
+
+
+def test_poda_contextos_antiguos(cs, datos, monkeypatch):
+    X, labels = datos
+    monkeypatch.setattr(cs, 'STABILITY_CACHE_MAX_CONTEXTOS', 2)
+    for desplazamiento in range(4):
+        _estabilidad(cs, X + desplazamiento, labels)
+    with open(cs.STABILITY_CACHE_FILE) as f:
+        assert len(json.load(f)['contextos']) == 2
+    # Quedan los dos más recientes
+    assert _estabilidad(cs, X + 3, labels)[1] == 0
+    assert _estabilidad(cs, X, labels)[1] == 4
+
+
+def test_descarta_formato_anterior(cs, datos):
+    X, labels = datos
+    cs.STABILITY_CACHE_FILE.write_text(json.dumps({'3|abc|0': 0.5}))
+    assert _estabilidad(cs, X, labels)[1] == 4
+
+
+def test_workers_no_dejan_matriz_compartida(cs, datos):
+    X, labels = datos
+    secuencial = cs.compute_stability(X, 3, n_iter=4, labels_ref=labels, usar_cache=False)
+    paralelo = cs.compute_stability(X, 3, n_iter=4, labels_ref=labels, workers=2)
+    assert paralelo == secuencial
+    assert not list(cs.STABILITY_CACHE_DIR.glob('X_scaled_*.npy'))
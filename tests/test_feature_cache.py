@@ -0,0 +1,75 @@
+"""
+Caché de features (feature_cache.py):
+  - matriz e índice en caché iguales a la tabla de origen
+  - load_scaled igual a un ajuste directo de RobustScaler (float64)
+  - invalidación por contenido de la fuente
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import RobustScaler
+
+import feature_cache
+from data_store import read_table, write_table
+
+
+@pytest.fixture
+def fuente(tmp_path, monkeypatch):
+    """Tabla semanal sintética con claves, calidad y las 8 features"""
+    monkeypatch.setattr(feature_cache, 'CACHE_DIR', tmp_path / 'cache')
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame({
+        'usuario_id': [f'u{1 + i % 3}' for i in range(n)],
+        'usuario_alias': [f'alias{1 + i % 3}' for i in range(n)],
+        'semana_inicio': pd.date_range('2024-01-01', periods=n, freq='W-MON').astype(str),
+        'dias_monitoreados': rng.integers(1, 8, n),
+        'flag_baja_cobertura': rng.integers(0, 2, n),
+        'pct_imputada_FC_walk': rng.uniform(0, 100, n),
+    })
+    for feat in feature_cache.CLUSTER_FEATURES:
+        df[feat] = rng.lognormal(0, 1, n) / 3
+    path = tmp_path / 'weekly_test.csv'
+    write_table(df, path)
+    return path
+
+
+def test_features_iguales_a_fuente(fuente):
+    index, X = feature_cache.load_features(source=fuente)
+    df = read_table(fuente)
+    assert X.dtype == np.float64
+    assert np.array_equal(np.asarray(X), df[feature_cache.CLUSTER_FEATURES].to_numpy())
+    pd.testing.assert_frame_equal(index, df[feature_cache.INDEX_COLS])
+    # Índice escrito vía temporal: no quedan archivos .tmp
+    assert not list(feature_cache.CACHE_DIR.glob('*.tmp*'))
+
+
+@pytest.mark.parametrize('con_filas', [False, True])
+def test_load_scaled_igual_a_ajuste_directo(fuente, con_filas):
+    df = read_table(fuente)
+    filas = (df['dias_monitoreados'] >= 3).to_numpy() if con_filas else None
+    X = df[feature_cache.CLUSTER_FEATURES].to_numpy()
+    esperado = RobustScaler().fit_transform(X if filas is None else X[filas])
+
+    for _ in range(2):  # ajuste y luego lectura desde la caché
+        X_scaled, scaler = feature_cache.load_scaled(
+            feature_cache.CLUSTER_FEATURES, filas=filas, source=fuente)
+        assert X_scaled.dtype == np.float64
+        assert np.array_equal(np.asarray(X_scaled), esperado)
+        assert np.array_equal(scaler.transform(X if filas is None else X[filas]), esperado)
+
+
+def test_cambio_de_fuente_reconstruye(fuente):
+    feature_cache.load_scaled(feature_cache.CLUSTER_FEATURES, source=fuente)
+    hash_antes = feature_cache._cache_valida(fuente)['hash']
+
+    df = read_table(fuente)
+    df.loc[0, 'HRV_SDNN_p50'] += 1.0
+    write_table(df, fuente)
+    assert feature_cache._cache_valida(fuente) is None
+
+    _, X = feature_cache.load_features(['HRV_SDNN_p50'], source=fuente)
+    assert X[0, 0] == df.loc[0, 'HRV_SDNN_p50']
+    # Las matrices escaladas de la versión anterior se eliminan
+    assert not list(feature_cache.CACHE_DIR.glob(f'*_scaled_{hash_antes[:12]}*'))
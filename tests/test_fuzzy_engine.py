@@ -0,0 +1,118 @@
+"""
+Equivalencias del motor difuso (fuzzy_engine.py):
+  - modo LUT vs membresías exactas (memb, score y semanas neutrales)
+  - score_lote vs score() de un sistema por conjunto de puntos de quiebre
+"""
+
+import copy
+import json
+
+import numpy as np
+import pytest
+import yaml
+
+from fuzzy_engine import (CONFIG_FILE, REGLAS_SEDENTARISMO, SCALERS_FILE,
+                          FuzzyInferenceSystem, triangular_mf_matrix)
+
+
+@pytest.fixture(scope='module')
+def fis():
+    return FuzzyInferenceSystem.from_files()
+
+
+@pytest.fixture(scope='module')
+def X(fis):
+    """Semanas al azar en [min, max] ± 10%, los quiebres crudos y NaN"""
+    rng = np.random.default_rng(0)
+    rango = fis.feat_max - fis.feat_min
+    X = fis.feat_min + rng.uniform(-0.1, 1.1, (20000, len(fis.features))) * rango
+    quiebres = fis.breakpoints_raw.reshape(len(fis.features), -1).T
+    X = np.vstack([X, quiebres])
+    X[::97, 1] = np.nan
+    return X
+
+
+@pytest.mark.parametrize('n_bins', [1, 7, 256, 4096])
+def test_lut_membresias_iguales_a_exactas(fis, X, n_bins):
+    fis_lut = FuzzyInferenceSystem.from_files(lut_bins=n_bins)
+    exacto = triangular_mf_matrix(fis.escalar(X), fis.breakpoints)
+    lut = fis_lut.membresias(X)
+    assert np.abs(lut - exacto).max() <= 1e-12
+    # Fuera de (a, c] la membresía LUT es exactamente 0
+    assert np.array_equal(lut > 0, exacto > 0)
+
+
+@pytest.mark.parametrize('n_bins', [7, 256, 4096])
+def test_lut_score_y_neutrales(fis, X, n_bins):
+    fis_lut = FuzzyInferenceSystem.from_files(lut_bins=n_bins)
+    comparacion = fis_lut.comparar_lut(X)
+    assert comparacion['discrepancias_neutral'] == 0
+    assert comparacion['error_score_max'] <= 1e-12
+    np.testing.assert_allclose(fis_lut.score(X)[0], fis.score(X)[0], rtol=0, atol=1e-12)
+
+
+def test_lut_error_max_en_grilla_densa(fis):
+    n_bins = 256
+    fis_lut = FuzzyInferenceSystem.from_files(lut_bins=n_bins)
+    assert fis_lut.lut_error_max <= 1e-12
+    # Puntos fuera de la grilla usada para medir lut_error_max
+    puntos = np.linspace(0.0, 1.0, 50 * n_bins + 7)
+    P = np.repeat(puntos[:, None], len(fis.features), axis=1)
+    error = np.abs(fis_lut._membresias_lut(P) - triangular_mf_matrix(P, fis.breakpoints))
+    assert error.max() <= 1e-12
+
+
+@pytest.fixture(scope='module')
+def configuracion():
+    with open(CONFIG_FILE) as f:
+        mf_config = yaml.safe_load(f)
+    with open(SCALERS_FILE) as f:
+        scalers = json.load(f)
+    return mf_config, scalers
+
+
+def _config_con_breakpoints(fis, mf_config, breakpoints_raw):
+    """Copia de mf_config con los puntos de quiebre crudos reemplazados"""
+    config = copy.deepcopy(mf_config)
+    for i, feat in enumerate(fis.features):
+        for j, label in enumerate(fis.labels[feat]):
+            config[feat]['membership_functions'][label]['values'] = \
+                breakpoints_raw[i, j].tolist()
+    return config
+
+
+def test_score_lote_base_igual_a_score(fis, X):
+    lote = fis.score_lote(X, fis.breakpoints[None])[0]
+    np.testing.assert_array_equal(lote, fis.score(X)[0])
+
+
+def test_score_lote_igual_a_score_por_conjunto(fis, X, configuracion):
+    mf_config, scalers = configuracion
+    factores = [0.8, 0.95, 1.0, 1.1, 1.3]
+    crudos = np.stack([fis.breakpoints_raw * f for f in factores])
+    rng = np.random.default_rng(1)
+    pesos = rng.uniform(0.1, 1.0, (len(factores), len(fis.rule_ids)))
+    salidas = rng.uniform(0.0, 1.0, (len(factores), len(fis.rule_ids)))
+
+    lote = fis.score_lote(X, fis.escalar_breakpoints(crudos), pesos, salidas, bloque=2)
+    for i in range(len(factores)):
+        reglas = [dict(r, weight=w, output=o) for r, w, o in
+                  zip(fis.rules, pesos[i], salidas[i])]
+        fis_i = FuzzyInferenceSystem(
+            _config_con_breakpoints(fis, mf_config, crudos[i]), scalers, rules=reglas)
+        np.testing.assert_array_equal(lote[i], fis_i.score(X)[0])
+
+
+def test_score_lote_regla_con_etiqueta_inexistente(X, configuracion):
+    mf_config, scalers = configuracion
+    reglas = REGLAS_SEDENTARISMO + [{
+        'id': 'RX',
+        'conditions': [('Actividad_relativa_p50', 'Baja'),
+                       ('HRV_SDNN_p50', 'Inexistente')],
+        'output': 0.0,
+        'weight': 1.0,
+    }]
+    fis_x = FuzzyInferenceSystem(mf_config, scalers, rules=reglas)
+    scores, firing = fis_x.score(X)
+    assert not firing[:, fis_x.rule_ids.index('RX')].any()
+    np.testing.assert_array_equal(fis_x.score_lote(X, fis_x.breakpoints[None])[0], scores)
@@ -0,0 +1,97 @@
+"""
+Almacén de transiciones del semáforo (markov_store.py y paso 12):
+  - actualización incremental igual a reconstruir con la historia completa
+  - guardar/cargar conserva el almacén
+  - hash_historia detecta semanas ya incorporadas re-escritas
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from markov_store import MarkovStore
+
+RUTA = Path(__file__).resolve().parents[1] / '12_prediccion_markov_semaforo.py'
+
+
+@pytest.fixture(scope='module')
+def markov():
+    spec = importlib.util.spec_from_file_location('prediccion_markov', RUTA)
+    modulo = importlib.util.module_from_spec(spec)
+    # Registrado antes de ejecutar: las dataclasses lo buscan en sys.modules
+    sys.modules[spec.name] = modulo
+    spec.loader.exec_module(modulo)
+    yield modulo
+    del sys.modules[spec.name]
+
+
+@pytest.fixture
+def semanas():
+    """Historia sintética desordenada; u4 aparece sólo en las semanas nuevas"""
+    rng = np.random.default_rng(0)
+    filas = []
+    for usuario, n in [('u1', 40), ('u2', 25), ('u3', 3), ('u4', 6)]:
+        inicio = pd.Timestamp('2024-01-01') + pd.Timedelta(weeks=int(rng.integers(0, 10)))
+        for i in range(n):
+            filas.append((usuario, inicio + pd.Timedelta(weeks=i), int(rng.integers(0, 3))))
+    df = pd.DataFrame(filas, columns=['usuario_id', 'semana_inicio', 'estado_idx'])
+    return df.sample(frac=1.0, random_state=1).reset_index(drop=True)
+
+
+def _historia(df, corte):
+    """Semanas hasta `corte` (u4 queda fuera) como la corrida anterior"""
+    return df[(df['semana_inicio'] <= corte) & (df['usuario_id'] != 'u4')]
+
+
+def _assert_stores_iguales(a, b):
+    assert sorted(a.usuarios) == sorted(b.usuarios)
+    for u in b.usuarios:
+        i, j = a.indice[u], b.indice[u]
+        assert np.array_equal(a.counts[i], b.counts[j]), u
+        assert a.ultimo_estado[i] == b.ultimo_estado[j]
+        assert a.ultima_semana[i] == b.ultima_semana[j]
+        assert a.hash_historia[i] == b.hash_historia[j]
+    assert np.array_equal(a.counts_global, b.counts_global)
+    np.testing.assert_array_equal(a.tabla_potencias(6), b.tabla_potencias(6))
+
+
+@pytest.mark.parametrize('olvido', [1.0, 0.9])
+def test_incremental_igual_a_reconstruir(markov, semanas, olvido, tmp_path):
+    th = markov.Thresholds(0.33, 0.67)
+    corte = semanas['semana_inicio'].quantile(0.6)
+
+    store = markov.construir_store(_historia(semanas, corte), th, olvido=olvido)
+    store.tabla_potencias(3)  # la caché de potencias debe invalidarse
+    store.guardar(tmp_path / 'markov_store.npz')
+    store = MarkovStore.cargar(tmp_path / 'markov_store.npz')
+
+    n_nuevas = markov.actualizar_store(store, semanas)
+    assert n_nuevas == len(semanas) - len(_historia(semanas, corte))
+    _assert_stores_iguales(store, markov.construir_store(semanas, th, olvido=olvido))
+
+    # Sin semanas nuevas no cambia nada
+    assert markov.actualizar_store(store, semanas) == 0
+    _assert_stores_iguales(store, markov.construir_store(semanas, th, olvido=olvido))
+
+
+def test_hash_historia_detecta_semanas_reescritas(markov, semanas):
+    th = markov.Thresholds(0.33, 0.67)
+    store = markov.construir_store(semanas, th)
+    assert np.array_equal(
+        store.hash_historia, markov.hash_historia(semanas, store.usuarios, store.ultima_semana))
+
+    modificado = semanas.copy()
+    fila = modificado.index[modificado['usuario_id'] == 'u2'][0]
+    modificado.loc[fila, 'estado_idx'] = (modificado.loc[fila, 'estado_idx'] + 1) % 3
+    nuevo = markov.hash_historia(modificado, store.usuarios, store.ultima_semana)
+    distintos = store.usuarios[store.hash_historia != nuevo]
+    assert list(distintos) == ['u2']
+
+    # Eliminar una semana incorporada también cambia el hash
+    eliminado = semanas.drop(index=semanas.index[semanas['usuario_id'] == 'u1'][:1])
+    nuevo = markov.hash_historia(eliminado, store.usuarios, store.ultima_semana)
+    assert list(store.usuarios[store.hash_historia != nuevo]) == ['u1']
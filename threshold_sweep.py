@@ -0,0 +1,140 @@
+"""
+threshold_sweep.py
+Barrido de Umbrales τ sobre Scores Ordenados (sumas acumuladas)
+
+Para binarizar el score difuso (pred = score >= τ) y compararlo con la
+etiqueta de cluster, los pasos 09, 10 y 11 evaluaban F1, accuracy,
+precision, recall y MCC con sklearn una vez por cada τ (O(T·n)). Aquí los
+scores se ordenan una sola vez; para cada τ, el número de positivos y
+negativos por debajo del umbral sale de sumas acumuladas de la etiqueta
+(searchsorted), y todas las métricas se derivan vectorizadas de la matriz
+de confusión (O(n log n + T log n)).
+
+Las métricas reproducen exactamente las de sklearn con zero_division=0
+(misma fórmula y orden de operaciones para MCC). Los scores NaN cuentan
+como predicción negativa, igual que (NaN >= τ) == False.
+
+Con umbrales=None se evalúan todos los scores distintos, de modo que el τ
+óptimo es exacto y no depende de la resolución de una grilla.
+
+Uso:
+    from threshold_sweep import metricas_umbrales, tau_optimo
+    df_tau = metricas_umbrales(scores, y_true, np.arange(0.20, 0.41, 0.01))
+    tau, f1 = tau_optimo(scores, y_true)          # exacto
+"""
+
+import numpy as np
+import pandas as pd
+
+METRICAS = ['accuracy', 'f1', 'precision', 'recall', 'mcc']
+
+
+def umbrales_candidatos(scores):
+    """Scores distintos (no NaN) más +inf (ningún positivo predicho)"""
+    s = np.asarray(scores, dtype=float)
+    return np.append(np.unique(s[~np.isnan(s)]), np.inf)
+
+
+def confusion_umbrales(scores, y_true, umbrales):
+    """
+    Matriz de confusión de (scores >= τ) contra y_true para cada τ.
+
+    Args:
+        scores: scores continuos (n,)
+        y_true: etiquetas binarias 0/1 (n,)
+        umbrales: umbrales τ (T,)
+
+    Returns:
+        (tp, fp, fn, tn), cada uno un array int64 (T,)
+    """
+    s = np.asarray(scores, dtype=float)
+    y = np.asarray(y_true).astype(bool)
+    validos = ~np.isnan(s)
+
+    orden = np.argsort(s[validos], kind='stable')
+    s_ord = s[validos][orden]
+    pos_acum = np.concatenate([[0], np.cumsum(y[validos][orden], dtype=np.int64)])
+
+    # Índice del primer score >= τ: todo lo anterior se predice negativo
+    corte = np.searchsorted(s_ord, np.asarray(umbrales, dtype=float), side='left')
+    n_validos = len(s_ord)
+    n_pos = int(y.sum())
+    n_neg = len(y) - n_pos
+
+    tp = pos_acum[-1] - pos_acum[corte]
+    fp = (n_validos - corte) - tp
+    fn = n_pos - tp
+    tn = n_neg - fp
+    return tp, fp, fn, tn
+
+
+def metricas_confusion(tp, fp, fn, tn):
+    """
+    Accuracy, F1, precision, recall y MCC a partir de conteos (vectorizado).
+
+    Mismas fórmulas que sklearn con zero_division=0: F1 = 2·tp / (2·tp + fp
+    + fn) y MCC desde las sumas de la matriz de confusión (0 si el
+    denominador se anula).
+    """
+    tp, fp, fn, tn = (np.asarray(c, dtype=np.float64) for c in (tp, fp, fn, tn))
+    n = tp + fp + fn + tn
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pred_pos = tp + fp
+        true_pos = tp + fn
+        precision = np.where(pred_pos > 0, tp / pred_pos, 0.0)
+        recall = np.where(true_pos > 0, tp / true_pos, 0.0)
+        denom_f1 = true_pos + pred_pos
+        f1 = np.where(denom_f1 > 0, 2.0 * tp / denom_f1, 0.0)
+
+        # MCC como en sklearn.metrics.matthews_corrcoef
+        t_sum = (tn + fp, fn + tp)
+        p_sum = (tn + fn, fp + tp)
+        cov_ytyp = (tn + tp) * n - (t_sum[0] * p_sum[0] + t_sum[1] * p_sum[1])
+        cov_ypyp = n ** 2 - (p_sum[0] * p_sum[0] + p_sum[1] * p_sum[1])
+        cov_ytyt = n ** 2 - (t_sum[0] * t_sum[0] + t_sum[1] * t_sum[1])
+        cov_ypyp_ytyt = cov_ypyp * cov_ytyt
+        mcc = np.where(cov_ypyp_ytyt != 0, cov_ytyp / np.sqrt(cov_ypyp_ytyt), 0.0)
+
+        accuracy = (tp + tn) / n
+
+    return {'accuracy': accuracy, 'f1': f1, 'precision': precision,
+            'recall': recall, 'mcc': mcc}
+
+
+def metricas_umbrales(scores, y_true, umbrales=None):
+    """
+    Métricas de clasificación para cada umbral τ en una sola pasada.
+
+    Args:
+        scores: scores continuos (n,)
+        y_true: etiquetas binarias 0/1 (n,)
+        umbrales: umbrales τ; None = todos los scores distintos (exacto)
+
+    Returns:
+        DataFrame con columnas tau, tp, fp, fn, tn y METRICAS (una fila por τ)
+    """
+    if umbrales is None:
+        umbrales = umbrales_candidatos(scores)
+    umbrales = np.asarray(umbrales, dtype=float)
+    tp, fp, fn, tn = confusion_umbrales(scores, y_true, umbrales)
+    df = pd.DataFrame({'tau': umbrales, 'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn})
+    for nombre, valores in metricas_confusion(tp, fp, fn, tn).items():
+        df[nombre] = valores
+    return df
+
+
+def tau_optimo(scores, y_true, metrica='f1', umbrales=None):
+    """
+    Umbral que maximiza una métrica (el menor τ en caso de empate).
+
+    Con umbrales=None el óptimo es exacto: el τ devuelto es el score del caso
+    límite, y cualquier τ entre el score distinto anterior y éste da el mismo
+    resultado.
+
+    Returns:
+        (tau, valor de la métrica)
+    """
+    df = metricas_umbrales(scores, y_true, umbrales)
+    i = int(np.argmax(df[metrica].to_numpy()))
+    return float(df['tau'].iloc[i]), float(df[metrica].iloc[i])